@@ -0,0 +1,471 @@
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+import deadline
+import summary_cache
+import tracing
+
+SYSTEM_MESSAGE = ("You are a highly efficient executive assistant. Your task is to analyze the provided text, which includes emails, meeting notes (from Zoom), and personal task notes (from OneNote). "
+                  "Consolidate this information and extract ONLY the following:\n\n"
+                  "1. Key Decisions: List any significant decisions explicitly mentioned.\n\n"
+                  "2. Action Items (Seth Benkov): List all action items assigned specifically to Seth Benkov. Include any mentioned due dates.\n\n"
+                  "3. Action Items (Others): List action items assigned to Kevin or Trent that have upcoming due dates (e.g., today, tomorrow, this week). Be specific about who is responsible.\n\n"
+                  "4. Due Dates: List any other major deadlines or due dates mentioned.\n\n"
+                  "Format the output clearly with headings for each section. If no information is found for a section, state 'None identified'. Be concise and focus only on these points.")
+
+# Map step: one batch of items -> one short extract per item, so extracts can be memoized per item
+ITEM_MAP_SYSTEM_MESSAGE = ("You are a highly efficient executive assistant. You are given a numbered batch of items (emails, meeting notes, task notes). "
+                           "For EACH item, extract only key decisions, action items for Seth Benkov, action items for Kevin or Trent with due dates, and deadlines, keeping every owner and due date. "
+                           "Respond with ONLY a JSON object mapping each item number (as a string) to its extract, e.g. {\"1\": \"Decision: ...\", \"2\": \"None\"}. "
+                           "Use \"None\" for items with nothing relevant. Be terse.")
+
+# Intermediate reduce step, used only when the extracts are too large for a single final call
+PARTIAL_REDUCE_SYSTEM_MESSAGE = ("You are a highly efficient executive assistant. Merge the following extracts into Key Decisions, Action Items (Seth Benkov), "
+                                 "Action Items (Others) and Due Dates, keeping every owner and due date and removing duplicates. Be terse; your output will be merged again.")
+
+NO_CONTENT_SUMMARY = ("Key Decisions:\nNone identified\n\nAction Items (Seth Benkov):\nNone identified\n\n"
+                      "Action Items (Others):\nNone identified\n\nDue Dates:\nNone identified")
+
+# Reduce step: partial extracts -> final brief in the four sections
+REDUCE_USER_PREFIX = ("The following are partial extracts produced from separate batches of content from yesterday and today. "
+                      "Merge them into one summary, removing duplicates:\n\n")
+
+SECTION_HEADER_PATTERN = re.compile(r'^--- .+ ---$')
+# Sections where every line is its own item (tasks), rather than blank-line separated blocks
+LINE_ITEM_SECTIONS = ('--- OneNote Tasks ---',)
+
+# tiktoken encoder, loaded on first use; False when tiktoken isn't installed
+_encoder = None
+
+def count_tokens(text):
+    """Counts tokens locally (exact with tiktoken installed, otherwise ~4 characters per token)."""
+    global _encoder
+    if _encoder is None:
+        try:
+            import tiktoken # Optional: exact token counts
+            try:
+                _encoder = tiktoken.encoding_for_model(config.OPENAI_MODEL)
+            except KeyError:
+                _encoder = tiktoken.get_encoding('cl100k_base')
+        except ImportError:
+            _encoder = False
+    if _encoder:
+        return len(_encoder.encode(text))
+    return len(text) // 4 + 1
+
+def _get_client():
+    """Creates an OpenAI client, or returns None if no API key is configured."""
+    api_key = os.getenv(config.OPENAI_API_KEY_ENV_VAR)
+    if not api_key:
+        return None
+    # The SDK is imported here, not at start-up: it is by far the slowest import in the pipeline
+    from openai import OpenAI
+    # OPENAI_BASE_URL points the client at a compatible endpoint (e.g. fake_openai_server.py)
+    return OpenAI(api_key=api_key, base_url=os.getenv(config.OPENAI_BASE_URL_ENV_VAR) or None)
+
+def _complete(client, system_message, user_message, on_delta=None):
+    """Runs one chat completion and returns the stripped text.
+
+    With on_delta the completion is streamed, and on_delta is called with each text fragment as it arrives.
+    """
+    request = {
+        'model': config.OPENAI_MODEL,
+        'messages': [
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": user_message}
+        ],
+        'max_tokens': config.OPENAI_MAX_TOKENS,
+        'temperature': 0.5,
+        'timeout': deadline.timeout(config.OPENAI_TIMEOUT_SECONDS) # Capped by the current stage's slice
+    }
+    with tracing.span('openai.call', bytes=len(user_message.encode('utf-8')), requests=1) as span:
+        if on_delta is not None:
+            parts = []
+            for chunk in client.chat.completions.create(stream=True, **request):
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    on_delta(delta)
+            span.set('chunks', len(parts))
+            return ''.join(parts).strip()
+        response = client.chat.completions.create(**request)
+        usage = getattr(response, 'usage', None)
+        if usage is not None:
+            span.set('prompt_tokens', usage.prompt_tokens)
+            span.set('completion_tokens', usage.completion_tokens)
+    return response.choices[0].message.content.strip()
+
+def split_into_items(text):
+    """Splits the combined input into (section_header, item_text) pairs.
+
+    Items are blank-line separated blocks (one email each) or single lines in LINE_ITEM_SECTIONS
+    (one task each); blocks larger than the chunk budget are split by line, so every item fits
+    into a single batch.
+    """
+    items = []
+    section = ''
+    block = []
+
+    def flush():
+        if not block:
+            return
+        block_text = '\n'.join(block)
+        if count_tokens(block_text) <= config.AI_CHUNK_TOKEN_BUDGET:
+            items.append((section, block_text))
+        else:
+            for line in block:
+                # Hard-split pathological single lines by characters
+                step = config.AI_CHUNK_TOKEN_BUDGET * 3
+                for i in range(0, len(line), step):
+                    items.append((section, line[i:i + step]))
+        block.clear()
+
+    for line in text.splitlines():
+        stripped = line.strip()
+        if SECTION_HEADER_PATTERN.match(stripped):
+            flush()
+            section = stripped
+        elif not stripped:
+            flush()
+        else:
+            block.append(line)
+            if section in LINE_ITEM_SECTIONS:
+                flush()
+    flush()
+    return items
+
+def pack_batches(entries, token_budget, item_text=lambda entry: entry[1]):
+    """Greedily packs entries into batches of at most token_budget tokens (by item_text(entry))."""
+    batches = []
+    current = []
+    current_tokens = 0
+    for entry in entries:
+        entry_tokens = count_tokens(item_text(entry)) + 2
+        if current and current_tokens + entry_tokens > token_budget:
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(entry)
+        current_tokens += entry_tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def _format_numbered_batch(batch):
+    """Renders a batch of items as '[n] (Section) text' blocks for the item map prompt."""
+    blocks = []
+    for number, (section, item_text) in enumerate(batch, start=1):
+        label = section.strip('- ').strip()
+        blocks.append(f"[{number}] ({label})\n{item_text}" if label else f"[{number}]\n{item_text}")
+    return '\n\n'.join(blocks)
+
+def _parse_item_extracts(response_text, batch_size):
+    """Parses the map step's JSON answer into {item_number: extract}; returns {} if it isn't valid JSON."""
+    start, end = response_text.find('{'), response_text.rfind('}')
+    if start == -1 or end <= start:
+        return {}
+    try:
+        parsed = json.loads(response_text[start:end + 1])
+    except ValueError:
+        return {}
+    return {int(k): str(v).strip() for k, v in parsed.items() if str(k).isdigit() and 1 <= int(k) <= batch_size}
+
+def _item_cache_key(section, item_text):
+    return summary_cache.make_key('item', config.OPENAI_MODEL, ITEM_MAP_SYSTEM_MESSAGE, section, item_text)
+
+def _is_empty_extract(extract):
+    return not extract or extract.strip().rstrip('.').lower() in ('none', 'none identified', 'n/a')
+
+def _map_items(client, items):
+    """Returns one extract per item, reusing memoized extracts and sending only new items to the model.
+
+    A batch whose answer can't be attributed to individual items is kept as a single
+    batch-level extract (and not memoized).
+    """
+    extracts = [None] * len(items)
+    pending = []
+    for index, (section, item_text) in enumerate(items):
+        cached = summary_cache.get(_item_cache_key(section, item_text))
+        if cached is not None:
+            extracts[index] = cached
+        else:
+            pending.append(index)
+
+    print(f"Per-item memo: {len(items) - len(pending)} cached, {len(pending)} new items.")
+    batches = pack_batches([(index, items[index]) for index in pending], config.AI_CHUNK_TOKEN_BUDGET, item_text=lambda entry: entry[1][1])
+    if not batches:
+        return extracts, 0, 0
+
+    print(f"Summarizing {len(batches)} batches with up to {config.AI_MAX_WORKERS} concurrent requests...")
+    unattributed = []
+    from openai import OpenAIError # Already loaded with the client
+
+    def summarize_batch(batch):
+        batch_items = [item for _, item in batch]
+        try:
+            response_text = _complete(client, ITEM_MAP_SYSTEM_MESSAGE, _format_numbered_batch(batch_items))
+        except OpenAIError as e:
+            print(f"OpenAI API Error on batch: {e}")
+            return False
+        parsed = _parse_item_extracts(response_text, len(batch))
+        if len(parsed) < len(batch):
+            # Model didn't follow the JSON format; keep its answer, but don't memoize it per item
+            unattributed.append(response_text)
+            return True
+        for number, (index, (section, item_text)) in enumerate(batch, start=1):
+            extracts[index] = parsed[number]
+            summary_cache.put(_item_cache_key(section, item_text), parsed[number])
+        return True
+
+    with ThreadPoolExecutor(max_workers=config.AI_MAX_WORKERS) as executor:
+        results = list(executor.map(tracing.propagate(summarize_batch), batches))
+
+    failed = results.count(False)
+    extracts.extend(unattributed)
+    return extracts, failed, len(batches)
+
+def _reduce(client, partials, on_delta=None):
+    """Merges extracts into the final four-section summary (tree-reducing if they don't fit)."""
+    while count_tokens('\n\n'.join(partials)) > config.AI_SINGLE_CALL_TOKEN_LIMIT and len(partials) > 1:
+        print(f"Extracts exceed the token budget; reducing {len(partials)} extracts in groups...")
+        groups = pack_batches(partials, config.AI_SINGLE_CALL_TOKEN_LIMIT, item_text=lambda p: p)
+        with ThreadPoolExecutor(max_workers=config.AI_MAX_WORKERS) as executor:
+            partials = list(executor.map(
+                tracing.propagate(lambda group: _complete(client, PARTIAL_REDUCE_SYSTEM_MESSAGE, REDUCE_USER_PREFIX + '\n\n'.join(group))),
+                groups
+            ))
+    return _complete(client, SYSTEM_MESSAGE, REDUCE_USER_PREFIX + '\n\n---\n\n'.join(partials), on_delta)
+
+def _map_reduce_summary(client, text_to_summarize, on_delta=None):
+    items = split_into_items(text_to_summarize)
+    extracts, failed, batch_count = _map_items(client, items)
+    if failed and failed == batch_count and not any(extracts):
+        return "Error: OpenAI API error: all summarization batches failed."
+
+    partials = [extract for extract in extracts if not _is_empty_extract(extract)]
+    if not partials:
+        summary = NO_CONTENT_SUMMARY
+    else:
+        reduce_key = summary_cache.make_key('reduce', config.OPENAI_MODEL, SYSTEM_MESSAGE, partials)
+        summary = summary_cache.get(reduce_key)
+        if summary is None:
+            summary = _reduce(client, partials, on_delta)
+            if not failed:
+                summary_cache.put(reduce_key, summary)
+    if failed:
+        summary += f"\n\n(Note: {failed} of {batch_count} content batches could not be summarized.)"
+    return summary
+
+class IncrementalSummarizer:
+    """Map-reduce summary of items that arrive one at a time (e.g. from a backfill stream).
+
+    Items are mapped in groups of about AI_MAX_WORKERS batches as they arrive, and the
+    non-empty extracts are merged into a rolling partial whenever they exceed
+    AI_SINGLE_CALL_TOKEN_LIMIT, so memory stays bounded however many items are added.
+    """
+
+    def __init__(self):
+        self.client = _get_client()
+        self.items_added = 0
+        self.failed_batches = 0
+        self.batch_count = 0
+        self._pending = []
+        self._pending_tokens = 0
+        self._partials = []
+        self._partial_tokens = 0
+
+    def add(self, section, item_text):
+        if self.client is None:
+            return
+        self.items_added += 1
+        self._pending.append((section, item_text))
+        self._pending_tokens += count_tokens(item_text) + 2
+        if self._pending_tokens >= config.AI_CHUNK_TOKEN_BUDGET * config.AI_MAX_WORKERS:
+            self._map_pending()
+
+    def _map_pending(self):
+        if not self._pending:
+            return
+        from openai import OpenAIError
+        try:
+            extracts, failed, batch_count = _map_items(self.client, self._pending)
+        except OpenAIError as e:
+            print(f"OpenAI API Error on backfill batch: {e}")
+            extracts, failed, batch_count = [], 1, 1
+        self.failed_batches += failed
+        self.batch_count += batch_count
+        self._pending, self._pending_tokens = [], 0
+        for extract in extracts:
+            if not _is_empty_extract(extract):
+                self._partials.append(extract)
+                self._partial_tokens += count_tokens(extract) + 2
+        if self._partial_tokens > config.AI_SINGLE_CALL_TOKEN_LIMIT and len(self._partials) > 1:
+            try:
+                merged = _complete(self.client, PARTIAL_REDUCE_SYSTEM_MESSAGE, REDUCE_USER_PREFIX + '\n\n'.join(self._partials))
+            except OpenAIError as e:
+                print(f"OpenAI API Error merging backfill extracts (retrying with the next batch): {e}")
+                return
+            self._partials, self._partial_tokens = [merged], count_tokens(merged)
+
+    def finish(self):
+        """Maps what is left and returns the four-section summary (or an "Error:" string)."""
+        if self.client is None:
+            print(f"Error: {config.OPENAI_API_KEY_ENV_VAR} not found in environment variables.")
+            return "Error: OpenAI API key not configured."
+        from openai import OpenAIError
+        try:
+            self._map_pending()
+            if self.batch_count and self.failed_batches == self.batch_count:
+                return "Error: OpenAI API error: all summarization batches failed."
+            summary = _reduce(self.client, self._partials) if self._partials else NO_CONTENT_SUMMARY
+        except OpenAIError as e:
+            print(f"OpenAI API Error: {e}")
+            return f"Error: OpenAI API error: {e}"
+        finally:
+            summary_cache.evict()
+        if self.failed_batches:
+            summary += f"\n\n(Note: {self.failed_batches} of {self.batch_count} content batches could not be summarized.)"
+        return summary
+
+def presummarize_items(text_to_summarize):
+    """Runs only the map step, memoizing per-item extracts so a later map-reduce summary of
+    the same items needs just the reduce call. Returns the number of batches sent to the model."""
+    items = split_into_items(text_to_summarize or "")
+    if not items:
+        return 0
+    client = _get_client()
+    if client is None:
+        print(f"Error: {config.OPENAI_API_KEY_ENV_VAR} not found in environment variables.")
+        return 0
+    from openai import OpenAIError
+    try:
+        _, _, batch_count = _map_items(client, items)
+        summary_cache.evict()
+        return batch_count
+    except OpenAIError as e:
+        print(f"OpenAI API Error while pre-summarizing: {e}")
+        return 0
+
+def _use_map_reduce(text_to_summarize):
+    if config.AI_SUMMARY_MODE == 'map_reduce':
+        return True
+    if config.AI_SUMMARY_MODE == 'auto':
+        return count_tokens(text_to_summarize) > config.AI_SINGLE_CALL_TOKEN_LIMIT
+    return False
+
+def get_ai_summary(text_to_summarize, on_delta=None):
+    """Summarizes the provided text using the OpenAI ChatCompletion API.
+
+    With on_delta the final completion is streamed (see _complete); cached summaries are returned without it.
+    """
+    print("\n--- Calling OpenAI for Summarization ---")
+    if not text_to_summarize or text_to_summarize.strip() == "":
+        print("No text provided for AI summary.")
+        return "No email or meeting content available to summarize."
+
+    # Whole-summary cache: identical inputs (e.g. a re-run after a failed send) cost nothing,
+    # not even the OpenAI SDK import
+    summary_key = summary_cache.make_key('summary', config.OPENAI_MODEL, SYSTEM_MESSAGE, text_to_summarize)
+    cached_summary = summary_cache.get(summary_key)
+    if cached_summary is not None:
+        print("Using cached AI summary for unchanged input.")
+        return cached_summary
+
+    # Load API key and initialize client
+    client = _get_client()
+    if client is None:
+        print(f"Error: {config.OPENAI_API_KEY_ENV_VAR} not found in environment variables.")
+        return "Error: OpenAI API key not configured."
+    from openai import OpenAIError
+
+    try:
+        if _use_map_reduce(text_to_summarize):
+            summary = _map_reduce_summary(client, text_to_summarize, on_delta)
+        else:
+            user_message = f"Analyze the following content from yesterday and today:\n\n{text_to_summarize}"
+            summary = _complete(client, SYSTEM_MESSAGE, user_message, on_delta)
+        if not summary.startswith("Error:") and "(Note:" not in summary:
+            summary_cache.put(summary_key, summary)
+        summary_cache.evict()
+        print("OpenAI Summary generated successfully.")
+        return summary
+    except OpenAIError as e:
+        print(f"OpenAI API Error: {e}")
+        return f"Error: OpenAI API error: {e}"
+    except Exception as e:
+        print(f"Unexpected error in OpenAI summarization: {e}")
+        return f"Error generating AI summary: {e}"
+
+class SummaryStream:
+    """An AI summary generated in a background thread, streamed so a partial summary is
+    available if it doesn't finish by its deadline.
+
+    The deadline defaults to config.AI_SUMMARY_DEADLINE_SECONDS, capped by the time left in
+    the current deadline stage. fallback, if given, is called with the text result() is about
+    to return and returns (text to use instead, stale time or None); see main.summary_or_last_good.
+    """
+
+    def __init__(self, text_to_summarize, deadline_seconds=None, fallback=None):
+        self.restart_clock(deadline_seconds)
+        self.fallback = fallback
+        self.summary = None
+        self.cache_stats = None
+        self.rendered = None # What result() returned, e.g. for archiving what was sent
+        self.stale_at = None # Set when the fallback replaced the summary with an earlier one
+        self._parts = []
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        threading.Thread(target=tracing.propagate(self._run), args=(text_to_summarize,), name='ai-summary', daemon=True).start()
+
+    def _append(self, delta):
+        with self._lock:
+            self._parts.append(delta)
+
+    def _run(self, text_to_summarize):
+        stats_before = summary_cache.get_stats()
+        try:
+            with tracing.span('summarize', bytes=len(text_to_summarize.encode('utf-8'))) as span:
+                self.summary = get_ai_summary(text_to_summarize, on_delta=self._append)
+                stats_after = summary_cache.get_stats()
+                self.cache_stats = {key: stats_after[key] - stats_before[key] for key in stats_after}
+                span.set('cache_hits', self.cache_stats['hits'])
+                span.set('cache_misses', self.cache_stats['misses'])
+        except Exception as e:
+            self.summary = f"Error generating AI summary: {e}"
+        finally:
+            self._done.set()
+
+    def restart_clock(self, deadline_seconds=None):
+        """Counts the deadline from now, e.g. from delivery for a summary started at a prefetch."""
+        self.started = time.time()
+        self.deadline_seconds = deadline.cap(config.AI_SUMMARY_DEADLINE_SECONDS) if deadline_seconds is None else deadline_seconds
+
+    def result(self):
+        """Waits until the summary is done or the deadline passes (measured from the start or restart_clock).
+
+        Past the deadline, returns the text streamed so far followed by a truncation note;
+        the summary keeps generating in the background and is cached when it completes.
+        Later calls return the same text as the first.
+        """
+        if self.rendered is None:
+            rendered = self._wait_for_result()
+            if self.fallback:
+                rendered, self.stale_at = self.fallback(rendered)
+            self.rendered = rendered
+        return self.rendered
+
+    def _wait_for_result(self):
+        remaining = max(0.0, self.started + self.deadline_seconds - time.time())
+        if self._done.wait(remaining):
+            print(f"AI Summary Result: {self.summary[:100]}...")
+            return self.summary
+        with self._lock:
+            partial = ''.join(self._parts).strip()
+        print(f"Warning: AI summary not finished within {self.deadline_seconds:.0f}s deadline; using {len(partial)} characters received so far.")
+        if not partial:
+            return f"Error: AI summary was not ready within the {self.deadline_seconds:.0f}s deadline."
+        return f"{partial}\n\n{config.AI_DEADLINE_MARKER}"
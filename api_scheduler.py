@@ -0,0 +1,219 @@
+import json
+import os
+import random
+import socket
+import threading
+import time
+from urllib.parse import urlparse
+
+import config
+import deadline
+import tracing
+
+# HTTP statuses worth retrying; 403 only when the error reason is a rate limit
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = ('ratelimitexceeded', 'userratelimitexceeded', 'quotaexceeded')
+
+class TokenBucket:
+    """Thread-safe token bucket: refills at `rate` units per second up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, cost=1):
+        """Blocks until `cost` units have been taken (costs above capacity are taken in installments)."""
+        remaining = float(cost)
+        while remaining > 0:
+            chunk = min(remaining, self.capacity)
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= chunk:
+                    self.tokens -= chunk
+                    remaining -= chunk
+                    continue
+                wait = (chunk - self.tokens) / self.rate
+            time.sleep(wait)
+
+_lock = threading.Lock()
+_buckets = {}
+_host_semaphores = {}
+_stats = {'requests': 0, 'retries': 0, 'quota_units': 0}
+
+def _api_for(method_id):
+    """Maps a discovery methodId (e.g. 'gmail.users.messages.get') to its quota group."""
+    return (method_id or '').split('.', 1)[0] or 'default'
+
+def request_cost(request):
+    """Returns the quota units a request consumes (Gmail methods have per-method costs)."""
+    method_id = getattr(request, 'methodId', None)
+    if method_id in config.GOOGLE_METHOD_QUOTA_UNITS:
+        return config.GOOGLE_METHOD_QUOTA_UNITS[method_id]
+    return 1
+
+def _bucket_for(api, request):
+    # Quotas are per user, so buckets are per (api, credentials)
+    credentials = getattr(getattr(request, 'http', None), 'credentials', None)
+    key = (api, id(credentials))
+    with _lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            quota = config.GOOGLE_API_QUOTAS.get(api, config.GOOGLE_API_QUOTAS['default'])
+            bucket = _buckets[key] = TokenBucket(quota['units_per_second'], quota['burst'])
+        return bucket
+
+def _host_semaphore(request):
+    host = urlparse(getattr(request, 'uri', '') or '').netloc
+    with _lock:
+        semaphore = _host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = _host_semaphores[host] = threading.BoundedSemaphore(config.GOOGLE_MAX_CONCURRENT_PER_HOST)
+        return semaphore
+
+def is_retryable(error):
+    """True for transient failures: 429/5xx, rate-limit 403s and network errors."""
+    from googleapiclient.errors import HttpError # Only needed once a request has failed
+    if isinstance(error, HttpError):
+        if error.resp is None: # e.g. BatchError for a malformed batch response
+            return False
+        status = error.resp.status
+        if status in RETRYABLE_STATUSES:
+            return True
+        if status == 403:
+            content = (error.content or b'').decode('utf-8', 'ignore').lower()
+            return any(reason in content for reason in RATE_LIMIT_REASONS)
+        return False
+    import httplib2 # Already loaded by the time a request has failed
+    return isinstance(error, (socket.timeout, TimeoutError, ConnectionError, httplib2.HttpLib2Error))
+
+def retry_delay(attempt, error=None):
+    """Seconds to wait before retry `attempt` (0-based): Retry-After if given, else full-jitter backoff."""
+    from googleapiclient.errors import HttpError
+    if isinstance(error, HttpError) and error.resp is not None:
+        retry_after = error.resp.get('retry-after')
+        if retry_after:
+            try:
+                return min(float(retry_after), config.GOOGLE_RETRY_MAX_DELAY_SECONDS)
+            except ValueError:
+                pass # HTTP-date form; fall back to backoff
+    ceiling = min(config.GOOGLE_RETRY_MAX_DELAY_SECONDS, config.GOOGLE_RETRY_BASE_DELAY_SECONDS * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+def _out_of_time(delay):
+    """True when waiting delay seconds would run past the current deadline slice."""
+    left = deadline.remaining()
+    return left is not None and delay >= left
+
+def _record(key, amount=1):
+    with _lock:
+        _stats[key] += amount
+    if key != 'quota_units':
+        tracing.add(key, amount) # Also attribute requests/retries to the current stage span
+
+def _payload_size(response):
+    """Approximate size of a parsed JSON response, for the stage byte counters."""
+    try:
+        return len(json.dumps(response, separators=(',', ':')))
+    except (TypeError, ValueError):
+        return 0
+
+def execute(request, cost=None, quota_request=None):
+    """Executes a googleapiclient request with quota pacing, a per-host concurrency cap and retries.
+
+    quota_request (defaults to request) decides the quota bucket and host; batches pass
+    one of their inner requests since the batch envelope carries no method or credentials.
+    Retries end at the current deadline slice; the transport (utils._PooledHttp) caps socket
+    timeouts by it and raises deadline.DeadlineExceeded once it has run out.
+    """
+    quota_request = quota_request or request
+    api = _api_for(getattr(quota_request, 'methodId', None))
+    cost = request_cost(request) if cost is None else cost
+    bucket = _bucket_for(api, quota_request)
+    semaphore = _host_semaphore(quota_request)
+
+    attempt = 0
+    while True:
+        bucket.acquire(cost)
+        _record('requests')
+        _record('quota_units', cost)
+        try:
+            with semaphore:
+                response = request.execute()
+            if isinstance(response, dict):
+                tracing.add('bytes', _payload_size(response))
+            return response
+        except Exception as error:
+            if attempt >= config.GOOGLE_MAX_RETRIES or not is_retryable(error):
+                raise
+            delay = retry_delay(attempt, error)
+            if _out_of_time(delay):
+                raise
+            print(f"Transient Google API error ({error}); retrying in {delay:.1f}s (attempt {attempt + 1}/{config.GOOGLE_MAX_RETRIES}).")
+            _record('retries')
+            time.sleep(delay)
+            attempt += 1
+
+def _new_batch(service, callback):
+    api_endpoint = os.getenv(config.GOOGLE_API_ENDPOINT_ENV_VAR)
+    if api_endpoint:
+        from googleapiclient.http import BatchHttpRequest
+        # Discovery derives the batch URI from rootUrl and ignores api_endpoint overrides
+        return BatchHttpRequest(callback=callback, batch_uri=api_endpoint.rstrip('/') + '/batch')
+    return service.new_batch_http_request(callback=callback)
+
+def execute_batch(service, requests):
+    """Executes {request_id: request} through batch HTTP requests, retrying transient per-item failures.
+
+    Returns (responses, errors): dicts keyed by request_id. Each batch holds at most
+    config.GMAIL_BATCH_SIZE requests and is paced by the summed quota cost of its items.
+    """
+    responses = {}
+    errors = {}
+    pending = dict(requests)
+    attempt = 0
+    while pending:
+        retry_later = {}
+        retry_errors = []
+
+        def on_response(request_id, response, exception):
+            if exception is None:
+                responses[request_id] = response
+                tracing.add('bytes', _payload_size(response))
+            elif is_retryable(exception) and attempt < config.GOOGLE_MAX_RETRIES:
+                retry_later[request_id] = pending[request_id]
+                retry_errors.append(exception)
+            else:
+                errors[request_id] = exception
+
+        request_ids = list(pending)
+        for i in range(0, len(request_ids), config.GMAIL_BATCH_SIZE):
+            chunk = request_ids[i:i + config.GMAIL_BATCH_SIZE]
+            batch = _new_batch(service, on_response)
+            for request_id in chunk:
+                batch.add(pending[request_id], request_id=request_id)
+            # The batch envelope itself is retried like any other request
+            execute(batch, cost=sum(request_cost(pending[request_id]) for request_id in chunk),
+                    quota_request=pending[chunk[0]])
+
+        if retry_later:
+            delay = max(retry_delay(attempt, error) for error in retry_errors)
+            if _out_of_time(delay):
+                # No time left for another round; report them as failed
+                errors.update(zip(retry_later, retry_errors))
+                break
+            print(f"{len(retry_later)} batched requests hit transient errors; retrying in {delay:.1f}s.")
+            _record('retries', len(retry_later))
+            time.sleep(delay)
+            attempt += 1
+        pending = retry_later
+    return responses, errors
+
+def get_stats():
+    """Returns request, retry and quota-unit totals for this process."""
+    with _lock:
+        return dict(_stats)
@@ -0,0 +1,222 @@
+"""Weekly or monthly digests over long date ranges, streamed in bounded memory.
+
+Usage:
+    python backfill.py --days 7                                   # Last week's digest
+    python backfill.py --since 2024-04-01 --until 2024-05-01 --output april.html --no-ai
+
+Stages run as a pipeline connected by bounded queues: Gmail pages are fetched in a
+producer thread, rendered into the digest as they arrive and handed to a summarizer
+thread that maps them in batches. A full queue blocks the stage feeding it, so the
+fetcher never runs more than BACKFILL_QUEUE_SIZE items ahead of the slowest consumer.
+"""
+import argparse
+import itertools
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+
+import ai_summarizer
+import config
+import email_composer
+import gmail_fetcher
+import onenote_parser
+import tracing
+import utils
+
+_DONE = object()
+
+class _Failed:
+    def __init__(self, exception):
+        self.exception = exception
+
+def _put(q, item, stop):
+    """Puts item on q, waiting while it is full; returns False if stop was set meanwhile."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def bounded(iterable, maxsize, name):
+    """Iterates `iterable` in a producer thread and yields its items through a bounded queue.
+
+    The producer blocks while maxsize items are waiting (backpressure) and stops when the
+    consumer does; its exceptions are re-raised in the consumer.
+    """
+    q = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                if not _put(q, item, stop):
+                    return
+        except Exception as e:
+            _put(q, _Failed(e), stop)
+        else:
+            _put(q, _DONE, stop)
+
+    threading.Thread(target=tracing.propagate(produce), name=name, daemon=True).start()
+    try:
+        while True:
+            item = q.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failed):
+                raise item.exception
+            yield item
+    finally:
+        stop.set()
+
+class SummarizerStage:
+    """Feeds items to an ai_summarizer.IncrementalSummarizer on its own thread, through a bounded queue."""
+
+    def __init__(self, maxsize):
+        self.queue = queue.Queue(maxsize)
+        self.stop = threading.Event()
+        self.summarizer = None
+        self.error = None
+        self.thread = threading.Thread(target=tracing.propagate(self._run), name='backfill-summarize', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        with tracing.span('summarize') as span:
+            try:
+                self.summarizer = ai_summarizer.IncrementalSummarizer()
+                while True:
+                    item = self.queue.get()
+                    if item is _DONE:
+                        break
+                    self.summarizer.add(*item)
+                span.set('count', self.summarizer.items_added)
+            except Exception as e:
+                self.error = e
+                self.stop.set() # Unblocks feed()
+
+    def feed(self, section, item_text):
+        _put(self.queue, (section, item_text), self.stop)
+
+    def finish(self):
+        _put(self.queue, _DONE, self.stop)
+        self.thread.join()
+        if self.error is not None:
+            return f"Error generating AI summary: {self.error}"
+        return self.summarizer.finish()
+
+class DaySection:
+    """One day of the digest; `emails` yields at most BACKFILL_MAX_ROWS_PER_DAY rows and counts the rest."""
+
+    def __init__(self, label, records, on_record):
+        self.label = label
+        self.hidden = 0
+        self._records = records
+        self._on_record = on_record
+
+    @property
+    def emails(self):
+        for index, record in enumerate(self._records):
+            self._on_record(record)
+            if index < config.BACKFILL_MAX_ROWS_PER_DAY:
+                yield record
+            else:
+                self.hidden += 1
+
+def _local_day(record, tz):
+    return datetime.fromtimestamp(record['internal_date'] / 1000, tz).date()
+
+def iter_day_sections(records, tz, on_record):
+    """Groups a newest-first record stream into DaySections without reading ahead of the current day."""
+    for day, day_records in itertools.groupby(records, key=lambda record: _local_day(record, tz)):
+        yield DaySection(day.strftime('%A, %B %d, %Y'), day_records, on_record)
+
+def backfill_query(since, until):
+    """Gmail query for messages in [since, until) (aware datetimes)."""
+    return f"{config.BACKFILL_GMAIL_QUERY} after:{int(since.timestamp())} before:{int(until.timestamp())}"
+
+def run_backfill(since, until, tz, output_file, use_ai=True, token_file=None, export_folder=None):
+    """Writes the digest for [since, until) to output_file, with days in timezone tz.
+
+    Returns {'messages', 'tasks', 'summary'}.
+    """
+    counts = {'messages': 0, 'tasks': 0, 'summary': None}
+    summarizer = SummarizerStage(config.BACKFILL_QUEUE_SIZE) if use_ai else None
+
+    def on_record(record):
+        counts['messages'] += 1
+        if summarizer:
+            summarizer.feed('--- Emails ---', gmail_fetcher.format_email_item({**record, 'count': 1}))
+
+    def finish():
+        # Open tasks go to the summary only; the digest lists emails
+        if export_folder:
+            latest_export = onenote_parser.find_latest_docx(export_folder)
+            if latest_export:
+                for task in onenote_parser.iter_open_tasks(latest_export):
+                    counts['tasks'] += 1
+                    if summarizer:
+                        summarizer.feed('--- OneNote Tasks ---', task)
+        counts['summary'] = summarizer.finish() if summarizer else None
+        return {'ai_summary': counts['summary'], 'message_count': counts['messages'], 'task_count': counts['tasks']}
+
+    service = utils.get_google_service('gmail', 'v1', config.GOOGLE_SCOPES, config.GOOGLE_CREDENTIALS_FILE,
+                                       token_file or config.GOOGLE_TOKEN_FILE)
+    records = bounded(gmail_fetcher.iter_messages(service, backfill_query(since, until)),
+                      config.BACKFILL_QUEUE_SIZE, 'backfill-fetch')
+    title = f"Digest - {since:%b %d} to {(until - timedelta(seconds=1)):%b %d, %Y}"
+    with tracing.span('render'):
+        email_composer.write_digest(output_file, title, iter_day_sections(records, tz, on_record), finish)
+    return counts
+
+def _parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Render a digest over a long date range in bounded memory.")
+    parser.add_argument('--days', type=int, default=7, help="Days back from --until (default: 7)")
+    parser.add_argument('--since', type=_parse_date, help="First day (YYYY-MM-DD); overrides --days")
+    parser.add_argument('--until', type=_parse_date, help="Day after the last one (YYYY-MM-DD, default: today)")
+    parser.add_argument('--output', default=config.BACKFILL_OUTPUT_FILE, help="HTML file (default: %(default)s)")
+    parser.add_argument('--no-ai', action='store_true', help="Skip the OpenAI summary")
+    parser.add_argument('--send', action='store_true', help="Also email the digest to the configured recipient")
+    return parser.parse_args(argv)
+
+def _target_timezone():
+    import pytz
+    try:
+        return pytz.timezone(config.TARGET_TIMEZONE)
+    except pytz.UnknownTimeZoneError:
+        return pytz.utc
+
+def main(argv=None):
+    args = parse_args(argv)
+    load_dotenv()
+    tz = _target_timezone()
+    until_day = args.until or datetime.now(tz).date()
+    since_day = args.since or until_day - timedelta(days=args.days)
+    since = tz.localize(datetime.combine(since_day, datetime.min.time()))
+    until = tz.localize(datetime.combine(until_day, datetime.min.time()))
+
+    start_time = time.time()
+    print(f"Backfilling {since_day} to {until_day} (exclusive)...")
+    with tracing.span('backfill') as root:
+        result = run_backfill(since, until, tz, args.output, use_ai=not args.no_ai,
+                              export_folder=os.getenv(config.ONENOTE_EXPORT_FOLDER_ENV_VAR))
+    if config.TRACE_ENABLED:
+        tracing.export(root, 'backfill', trace_file=config.BACKFILL_TRACE_FILE)
+    print(f"Digest of {result['messages']} emails written to {args.output} in {time.time() - start_time:.2f} seconds.")
+
+    if args.send:
+        import main as brief_main # Shares the outbox-backed sender
+        with open(args.output, 'r', encoding='utf-8') as f:
+            html = f.read()
+        brief_main.send_gmail(f"Digest - {since_day:%b %d} to {until_day - timedelta(days=1):%b %d, %Y}", html,
+                              os.getenv(config.RECIPIENT_EMAIL_ENV_VAR))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""Offline end-to-end benchmark: runs the full brief against local Gmail/Calendar/OpenAI stand-ins.
+
+Usage:
+    python benchmark.py --messages 50,500,5000 --tasks 2000 --google-latency 0.02 --openai-latency 0.2
+    python benchmark.py --messages 50000 --error-rate 0.02 --json bench.json
+
+Each inbox size gets a cold run (empty stores and caches) followed by --warm-runs warm runs,
+reporting end-to-end and per-stage latency, API request counts and peak traced memory.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from google.oauth2.credentials import Credentials
+
+import config
+import fake_google_server
+import fake_openai_server
+import main
+import summary_cache
+import synthetic_data
+import utils
+
+# Stage columns shown in the report (see tracing.py for the span names)
+REPORT_STAGES = ['fetch.gmail', 'gmail.list', 'gmail.get', 'fetch.calendar', 'docx.parse', 'zoom.parse', 'summarize', 'render', 'send']
+
+def _write_token_file(token_file):
+    """Writes credentials the stand-ins accept; they never expire, so no refresh or OAuth flow runs."""
+    with open(token_file, 'wb') as token:
+        pickle.dump(Credentials(token='benchmark-token', scopes=config.GOOGLE_SCOPES), token)
+
+def prepare_workspace(workspace, args):
+    """Creates the user profile, token file, OneNote export and Zoom recaps for one benchmark size."""
+    export_folder = os.path.join(workspace, 'onenote')
+    os.makedirs(export_folder)
+    synthetic_data.generate_onenote_docx(os.path.join(export_folder, 'tasks.docx'), args.tasks, seed=args.seed)
+    zoom_folder = os.path.join(workspace, 'zoom')
+    os.makedirs(zoom_folder)
+    for i in range(args.meetings):
+        synthetic_data.generate_zoom_recap(os.path.join(zoom_folder, f'meeting-{i}.html'), seed=args.seed + i)
+    token_file = os.path.join(workspace, 'token.json')
+    _write_token_file(token_file)
+
+    config.OUTBOX_DIR = os.path.join(workspace, 'outbox')
+    config.METRICS_TEXTFILE_DIR = workspace
+    config.AI_CACHE_FILE = os.path.join(workspace, 'ai_summary_cache.sqlite3')
+    summary_cache.close() # Reopen on the new (empty) cache file
+    utils.clear_google_service_cache()
+
+    return {
+        'name': 'benchmark',
+        'token_file': token_file,
+        'recipient': 'bench@example.com',
+        'onenote_export_folder': export_folder,
+        'zoom_summary_folder': zoom_folder,
+        'calendars': [f'cal-{i}' for i in range(args.calendars)],
+        'cache_dir': workspace,
+        'output_file': os.path.join(workspace, config.LOCAL_OUTPUT_HTML_FILE),
+    }
+
+def run_once(user, measure_memory, verbose):
+    """Runs one brief; returns (result, elapsed seconds, stage totals, peak traced bytes)."""
+    if measure_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        result = main.run_brief(user)
+    elapsed = time.perf_counter() - start
+    peak = 0
+    if measure_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    with open(os.path.join(user['cache_dir'], config.TRACE_FILE), 'r', encoding='utf-8') as f:
+        stages = json.load(f)['stages']
+    return result, elapsed, stages, peak
+
+def benchmark_size(message_count, args):
+    """Benchmarks one inbox size; returns a row per run."""
+    state = fake_google_server.FakeGoogleState(
+        synthetic_data.generate_inbox(message_count, seed=args.seed),
+        {f'cal-{i}': synthetic_data.generate_calendar_events(f'cal-{i}', args.events, seed=args.seed, shared=True)
+         for i in range(args.calendars)},
+    )
+    google_server, google_endpoint = fake_google_server.start_in_background(state, 0, args.google_latency, args.error_rate)
+    openai_server, openai_url = fake_openai_server.start_in_background(0, args.openai_latency, args.error_rate)
+    os.environ[config.GOOGLE_API_ENDPOINT_ENV_VAR] = google_endpoint
+    os.environ[config.OPENAI_BASE_URL_ENV_VAR] = openai_url
+    os.environ[config.OPENAI_API_KEY_ENV_VAR] = 'benchmark'
+    config.MAX_EMAILS_TO_PROCESS = args.max_emails or message_count
+
+    workspace = tempfile.mkdtemp(prefix=f'brief-bench-{message_count}-')
+    rows = []
+    try:
+        user = prepare_workspace(workspace, args)
+        for run in range(1 + args.warm_runs):
+            google_before = dict(google_server.RequestHandlerClass.stats, lock=None)
+            openai_before = openai_server.RequestHandlerClass.stats['requests']
+            result, elapsed, stages, peak = run_once(user, not args.no_memory, args.verbose)
+            google_stats = google_server.RequestHandlerClass.stats
+            rows.append({
+                'messages': message_count,
+                'run': 'cold' if run == 0 else f'warm{run}',
+                'ok': result['ok'] and result['sent'],
+                'total_seconds': elapsed,
+                'stages': {name: stages.get(name, {}).get('seconds', 0.0) for name in REPORT_STAGES},
+                'google_http_requests': google_stats['http_requests'] - google_before['http_requests'],
+                'google_api_calls': google_stats['calls'] - google_before['calls'],
+                'injected_errors': google_stats['injected_errors'] - google_before['injected_errors'],
+                'openai_requests': openai_server.RequestHandlerClass.stats['requests'] - openai_before,
+                'peak_memory_mb': peak / (1024 * 1024),
+            })
+    finally:
+        google_server.shutdown()
+        openai_server.shutdown()
+        if args.keep:
+            print(f"Workspace kept at {workspace}")
+        else:
+            shutil.rmtree(workspace, ignore_errors=True)
+    return rows
+
+def print_report(rows):
+    columns = ['messages', 'run', 'total'] + REPORT_STAGES + ['http', 'calls', 'errs', 'openai', 'peak MB', 'ok']
+    print("\n=== Benchmark Results (seconds unless noted) ===")
+    print('  '.join(f"{c:>14}" if c in REPORT_STAGES else f"{c:>8}" for c in columns))
+    for r in rows:
+        values = [str(r['messages']), r['run'], f"{r['total_seconds']:.2f}"]
+        values += [f"{r['stages'][name]:.3f}" for name in REPORT_STAGES]
+        values += [str(r['google_http_requests']), str(r['google_api_calls']), str(r['injected_errors']),
+                   str(r['openai_requests']), f"{r['peak_memory_mb']:.1f}", 'yes' if r['ok'] else 'NO']
+        print('  '.join(f"{v:>14}" if c in REPORT_STAGES else f"{v:>8}" for c, v in zip(columns, values)))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', default='50,500,5000', help='Comma-separated synthetic inbox sizes')
+    parser.add_argument('--max-emails', type=int, default=None, help='MAX_EMAILS_TO_PROCESS (default: the whole inbox)')
+    parser.add_argument('--calendars', type=int, default=3)
+    parser.add_argument('--events', type=int, default=15, help='Events per calendar')
+    parser.add_argument('--meetings', type=int, default=5, help='Zoom recap pages in the synthetic recap folder')
+    parser.add_argument('--tasks', type=int, default=2000, help='Task lines in the synthetic OneNote export')
+    parser.add_argument('--google-latency', type=float, default=0.02, help='Seconds per Gmail/Calendar HTTP request')
+    parser.add_argument('--openai-latency', type=float, default=0.2, help='Seconds per OpenAI request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of API calls answered with 429/503/500')
+    parser.add_argument('--warm-runs', type=int, default=1, help='Runs after the cold run, reusing stores and caches')
+    parser.add_argument('--real-quota', action='store_true', help='Keep Google per-user quota pacing (slow for big inboxes)')
+    parser.add_argument('--no-memory', action='store_true', help='Skip tracemalloc (it slows runs down noticeably)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Also write the results to this JSON file')
+    parser.add_argument('--keep', action='store_true', help='Keep the temporary workspaces')
+    parser.add_argument('--verbose', action='store_true', help='Show the pipeline output')
+    args = parser.parse_args()
+
+    if not args.real_quota:
+        # Measure client-side cost, not the quota pacer
+        config.GOOGLE_API_QUOTAS = {api: {'units_per_second': 1e9, 'burst': 1e9} for api in config.GOOGLE_API_QUOTAS}
+    # Big inboxes must not be cut off by the production fetch timeouts
+    config.FETCH_TIMEOUT_SECONDS = {name: 3600 for name in config.FETCH_TIMEOUT_SECONDS}
+    config.GOOGLE_RETRY_MAX_DELAY_SECONDS = min(config.GOOGLE_RETRY_MAX_DELAY_SECONDS, 2.0)
+
+    all_rows = []
+    for size in [int(s) for s in args.messages.split(',') if s.strip()]:
+        print(f"Benchmarking inbox of {size} messages...")
+        all_rows.extend(benchmark_size(size, args))
+    print_report(all_rows)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(all_rows, f, indent=2)
+        print(f"Results written to {args.json}")
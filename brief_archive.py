@@ -0,0 +1,244 @@
+"""Archive of every delivered brief's inputs and AI summary, with full-text search.
+
+Usage:
+    python brief_archive.py search "vendor contract"        # FTS5 query (LIKE fallback)
+    python brief_archive.py search budget --kind email --limit 20
+    python brief_archive.py list                            # Recent briefs
+    python brief_archive.py show 2024-05-14                 # One day's items
+
+Items (events, email threads, tasks, meetings, the summary) are stored once per distinct
+version and linked to the briefs they appeared in, so carry-over items cost one row per day.
+Querying never calls an API.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import config
+import onenote_index
+
+ITEM_KINDS = ('event', 'email', 'task', 'meeting', 'summary')
+NEW = 'new'
+CHANGED = 'changed'
+
+def connect(db_file=None):
+    """Opens (and creates if needed) the brief archive."""
+    conn = sqlite3.connect(db_file or config.BRIEF_ARCHIVE_FILE)
+    conn.row_factory = sqlite3.Row
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS briefs (
+            id INTEGER PRIMARY KEY,
+            user TEXT,
+            brief_date TEXT,
+            created_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_briefs_user ON briefs (user, id);
+        CREATE TABLE IF NOT EXISTS items (
+            id INTEGER PRIMARY KEY,
+            kind TEXT,
+            item_key TEXT,
+            fingerprint TEXT,
+            text TEXT,
+            data TEXT,
+            UNIQUE (kind, item_key, fingerprint)
+        );
+        CREATE TABLE IF NOT EXISTS brief_items (
+            brief_id INTEGER,
+            item_id INTEGER,
+            status TEXT,
+            PRIMARY KEY (brief_id, item_id)
+        );
+    """)
+    try:
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(text, content='items', content_rowid='id')")
+    except sqlite3.OperationalError:
+        pass # SQLite built without FTS5; search falls back to LIKE
+    return conn
+
+def has_fts(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'items_fts'").fetchone() is not None
+
+def _digest(value):
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()[:16]
+
+def _item(kind, key, text, data=None):
+    # Items with the same key but a different text are the same thing, changed
+    return {'kind': kind, 'key': _digest(key), 'fingerprint': _digest(text), 'text': text, 'data': data}
+
+def collect_items(calendar_events, email_list, onenote_tasks, zoom_recaps=()):
+    """Turns fetched sources into archive items; placeholder and error entries are skipped.
+
+    Returns {source: [item per source entry, None for skipped entries]} so statuses line up
+    with the rendered lists.
+    """
+    import zoom_parser # Only for formatting recaps
+    items = {'calendar': [], 'gmail': [], 'onenote': [], 'zoom': []}
+    for event in calendar_events:
+        # Keyed on the event id, so a rescheduled meeting is one changed item (the time is in the text)
+        key = (event.get('id') or f"{event['time']}|{event['name']}") if isinstance(event, dict) else None
+        items['calendar'].append(_item('event', key, f"{event['time']} - {event['name']}") if key else None)
+    for email in email_list:
+        key = email.get('thread_id') or f"{email['sender']}|{email['subject']}"
+        text = f"{email['sender']}: {email['subject']} ({email.get('count', 1)})\n{email.get('snippet', '')}"
+        items['gmail'].append(_item('email', key, text, {'sender': email['sender'], 'subject': email['subject'],
+                                                          'count': email.get('count', 1)}))
+    for task in onenote_tasks:
+        is_task = not task.startswith("Error:") and task != "No open tasks found in latest OneNote export."
+        items['onenote'].append(_item('task', onenote_index.normalize_task(task), task) if is_task else None)
+    for recap in zoom_recaps:
+        items['zoom'].append(_item('meeting', f"{recap['title']}|{recap['time']}", zoom_parser.format_recap(recap))
+                             if isinstance(recap, dict) else None)
+    return items
+
+def last_brief_fingerprints(conn, user):
+    """{(kind, key): fingerprint} of the user's most recent archived brief (empty if none)."""
+    row = conn.execute("SELECT id FROM briefs WHERE user = ? ORDER BY id DESC LIMIT 1", (user,)).fetchone()
+    if row is None:
+        return {}
+    rows = conn.execute("""SELECT i.kind, i.item_key, i.fingerprint FROM brief_items bi
+                           JOIN items i ON i.id = bi.item_id WHERE bi.brief_id = ?""", (row['id'],))
+    return {(r['kind'], r['item_key']): r['fingerprint'] for r in rows}
+
+def diff(items, previous):
+    """Returns {source: [status per entry]}: NEW, CHANGED or None (unchanged or skipped).
+
+    With no previous brief nothing is marked, so a first run is not all "new".
+    """
+    statuses = {}
+    for source, source_items in items.items():
+        statuses[source] = []
+        for item in source_items:
+            status = None
+            if item is not None and previous:
+                old = previous.get((item['kind'], item['key']))
+                status = NEW if old is None else CHANGED if old != item['fingerprint'] else None
+            statuses[source].append(status)
+    return statuses
+
+def archive_brief(conn, user, items, ai_summary=None, statuses=None):
+    """Stores one delivered brief; returns its id."""
+    statuses = statuses or {}
+    fts = has_fts(conn)
+    with conn:
+        brief_id = conn.execute("INSERT INTO briefs (user, brief_date, created_at) VALUES (?, ?, ?)",
+                                (user, time.strftime('%Y-%m-%d'), time.time())).lastrowid
+        entries = [(item, status) for source, source_items in items.items()
+                   for item, status in zip(source_items, statuses.get(source) or [None] * len(source_items)) if item]
+        if ai_summary and not ai_summary.startswith("Error"):
+            entries.append((_item('summary', f"{user}|{brief_id}", ai_summary), None))
+        for item, status in entries:
+            row = conn.execute("SELECT id FROM items WHERE kind = ? AND item_key = ? AND fingerprint = ?",
+                               (item['kind'], item['key'], item['fingerprint'])).fetchone()
+            if row:
+                item_id = row['id']
+            else:
+                item_id = conn.execute("INSERT INTO items (kind, item_key, fingerprint, text, data) VALUES (?, ?, ?, ?, ?)",
+                                       (item['kind'], item['key'], item['fingerprint'], item['text'],
+                                        json.dumps(item['data']) if item['data'] else None)).lastrowid
+                if fts:
+                    conn.execute("INSERT INTO items_fts (rowid, text) VALUES (?, ?)", (item_id, item['text']))
+            conn.execute("INSERT OR IGNORE INTO brief_items (brief_id, item_id, status) VALUES (?, ?, ?)",
+                         (brief_id, item_id, status))
+    return brief_id
+
+def search(conn, query, kind=None, user=None, limit=20):
+    """Returns matching items, newest brief first, with the dates they appeared."""
+    if has_fts(conn):
+        try:
+            matched = conn.execute("SELECT rowid FROM items_fts WHERE items_fts MATCH ? ORDER BY rank LIMIT 1000", (query,))
+            item_ids = [row['rowid'] for row in matched]
+        except sqlite3.OperationalError:
+            # Not valid FTS5 syntax (e.g. stray quotes); search for it as a phrase
+            phrase = '"' + query.replace('"', '""') + '"'
+            item_ids = [row['rowid'] for row in
+                        conn.execute("SELECT rowid FROM items_fts WHERE items_fts MATCH ? LIMIT 1000", (phrase,))]
+        if not item_ids:
+            return []
+        condition = f"i.id IN ({','.join('?' * len(item_ids))})"
+        params = list(item_ids)
+    else:
+        condition = "i.text LIKE ?"
+        params = [f"%{query}%"]
+    if kind:
+        condition += " AND i.kind = ?"
+        params.append(kind)
+    if user:
+        condition += " AND b.user = ?"
+        params.append(user)
+    rows = conn.execute(f"""
+        SELECT i.kind, i.text, MIN(b.brief_date) AS first_date, MAX(b.brief_date) AS last_date,
+               COUNT(DISTINCT b.id) AS briefs
+        FROM items i JOIN brief_items bi ON bi.item_id = i.id JOIN briefs b ON b.id = bi.brief_id
+        WHERE {condition}
+        GROUP BY i.id ORDER BY MAX(b.id) DESC LIMIT ?""", params + [limit])
+    return [dict(row) for row in rows]
+
+def recent_briefs(conn, user=None, limit=14):
+    rows = conn.execute(f"""
+        SELECT b.id, b.user, b.brief_date, COUNT(bi.item_id) AS items,
+               SUM(bi.status = '{NEW}') AS new, SUM(bi.status = '{CHANGED}') AS changed
+        FROM briefs b LEFT JOIN brief_items bi ON bi.brief_id = b.id
+        WHERE ? IS NULL OR b.user = ?
+        GROUP BY b.id ORDER BY b.id DESC LIMIT ?""", (user, user, limit))
+    return [dict(row) for row in rows]
+
+def brief_items(conn, brief_date, user=None):
+    """Items of the last brief on a date (YYYY-MM-DD), in archive order."""
+    row = conn.execute("SELECT id FROM briefs WHERE brief_date = ? AND (? IS NULL OR user = ?) ORDER BY id DESC LIMIT 1",
+                       (brief_date, user, user)).fetchone()
+    if row is None:
+        return []
+    rows = conn.execute("""SELECT i.kind, i.text, bi.status FROM brief_items bi JOIN items i ON i.id = bi.item_id
+                           WHERE bi.brief_id = ? ORDER BY bi.rowid""", (row['id'],))
+    return [dict(row) for row in rows]
+
+def _first_line(text, width=100):
+    line = text.splitlines()[0] if text else ''
+    return line if len(line) <= width else line[:width - 3] + '...'
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search and browse archived Daily Briefs (no API calls).")
+    parser.add_argument('--archive', default=config.BRIEF_ARCHIVE_FILE, help="Archive file (default: %(default)s)")
+    parser.add_argument('--user', help="Only this user's briefs (team runs)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    search_parser = commands.add_parser('search', help="Full-text search over archived items and summaries")
+    search_parser.add_argument('query')
+    search_parser.add_argument('--kind', choices=ITEM_KINDS)
+    search_parser.add_argument('--limit', type=int, default=20)
+    list_parser = commands.add_parser('list', help="Recent briefs with new/changed counts")
+    list_parser.add_argument('--limit', type=int, default=14)
+    show_parser = commands.add_parser('show', help="Items of one day's brief")
+    show_parser.add_argument('date', help="YYYY-MM-DD")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.archive):
+        print(f"No archive at {args.archive}; it is created by the first delivered brief.")
+        return
+    conn = connect(args.archive)
+    try:
+        if args.command == 'search':
+            results = search(conn, args.query, args.kind, args.user, args.limit)
+            for result in results:
+                dates = result['first_date'] if result['first_date'] == result['last_date'] else \
+                    f"{result['first_date']}..{result['last_date']}"
+                print(f"[{result['kind']}] {dates} ({result['briefs']} briefs) {_first_line(result['text'])}")
+            print(f"{len(results)} results{'' if has_fts(conn) else ' (substring search; FTS5 unavailable)'}.")
+        elif args.command == 'list':
+            for brief in recent_briefs(conn, args.user, args.limit):
+                print(f"{brief['brief_date']}  {brief['user']:<12} {brief['items']:>4} items, "
+                      f"{brief['new'] or 0} new, {brief['changed'] or 0} changed")
+        else:
+            items = brief_items(conn, args.date, args.user)
+            for item in items:
+                marker = f" ({item['status']})" if item['status'] else ''
+                print(f"[{item['kind']}]{marker} {_first_line(item['text'])}")
+            if not items:
+                print(f"No brief archived for {args.date}.")
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
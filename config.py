@@ -14,29 +14,177 @@ GOOGLE_SCOPES = [
 ]
 GOOGLE_CREDENTIALS_FILE = 'credentials.json'
 GOOGLE_TOKEN_FILE = 'token.json'
+GOOGLE_HTTP_TIMEOUT_SECONDS = 60 # Socket timeout for Google API HTTP connections
+TOKEN_REFRESH_MARGIN_SECONDS = 300 # Cached tokens are refreshed in the background this long before expiry
+DISCOVERY_CACHE_DIR = '.discovery_cache' # Used only when bundled (static) discovery documents are unavailable
+GOOGLE_API_ENDPOINT_ENV_VAR = 'GOOGLE_API_ENDPOINT' # Overrides the API host, e.g. fake_google_server.py for offline runs
+
+# Google API Request Scheduling (api_scheduler.py)
+# Per-user token buckets in quota units per second. Gmail allows 250 units/user/second;
+# Calendar is paced in requests (1 unit each).
+GOOGLE_API_QUOTAS = {
+    'gmail': {'units_per_second': 250, 'burst': 250},
+    'calendar': {'units_per_second': 10, 'burst': 20},
+    'default': {'units_per_second': 10, 'burst': 10},
+}
+# Gmail quota units per method (https://developers.google.com/gmail/api/reference/quota)
+GOOGLE_METHOD_QUOTA_UNITS = {
+    'gmail.users.getProfile': 1,
+    'gmail.users.history.list': 2,
+    'gmail.users.messages.list': 5,
+    'gmail.users.messages.get': 5,
+    'gmail.users.messages.send': 100,
+    'gmail.users.threads.list': 10,
+    'gmail.users.threads.get': 10,
+}
+GOOGLE_MAX_CONCURRENT_PER_HOST = 8 # In-flight requests per API host
+GOOGLE_MAX_RETRIES = 5
+GOOGLE_RETRY_BASE_DELAY_SECONDS = 1.0 # Exponential backoff base (full jitter)
+GOOGLE_RETRY_MAX_DELAY_SECONDS = 32.0 # Cap for backoff and Retry-After
 
 # Email Fetching
 GMAIL_QUERY = 'newer_than:1d in:inbox -label:trash' # Last 24 hours, inbox, not trash
 MAX_EMAILS_TO_PROCESS = 50 # Limit number of emails processed
+GMAIL_LIST_PAGE_SIZE = 500 # messages().list maxResults per page (API maximum is 500)
+GMAIL_BATCH_SIZE = 100 # messages().get calls per batch HTTP request (API maximum is 100)
+GMAIL_INCREMENTAL_SYNC = True # Sync deltas via users.history.list into a local store instead of re-querying
+GMAIL_STORE_FILE = 'gmail_store.sqlite3' # Local SQLite store of message metadata and snippets
+GMAIL_LOOKBACK_HOURS = 24 # Window the brief is built from when reading the local store (matches newer_than:1d)
+GMAIL_STORE_RETENTION_DAYS = 7 # Stored messages older than this are pruned
+GMAIL_THREAD_FETCH = True # Fetch a thread whole (threads.get) when that costs fewer quota units than its messages
+
+# Email De-duplication (email_dedup.py)
+EMAIL_DEDUP_ENABLED = True # One brief item (with a count) per thread
+EMAIL_DEDUP_NEAR_DUPLICATES = True # Also merge near-identical emails from the same sender (e.g. notification storms)
+EMAIL_DEDUP_THRESHOLD = 0.7 # Estimated Jaccard similarity of subject + snippet needed to merge
+EMAIL_DEDUP_SHINGLE_SIZE = 3 # Words per shingle
+EMAIL_DEDUP_NUM_PERM = 64 # MinHash signature length
+EMAIL_DEDUP_LSH_BANDS = 16 # Bands of NUM_PERM / BANDS rows; more bands find less similar candidates
+
+# Calendar Fetching
+CALENDAR_IDS_ENV_VAR = 'CALENDAR_IDS' # Optional comma-separated calendar ids (team, room, shared calendars)
+CALENDAR_IDS = ['primary'] # Used when the environment variable is not set
+CALENDAR_MAX_WORKERS = 8 # Calendars fetched concurrently
+CALENDAR_INCREMENTAL_SYNC = True # Use syncToken-based incremental sync backed by a local cache
+CALENDAR_CACHE_FILE = 'calendar_cache.json'
+CALENDAR_SYNC_WINDOW_DAYS = 14 # Days covered by a full sync; a new full sync runs once the window is used up
 
 # OneNote Local Parsing
 ONENOTE_EXPORT_FOLDER_ENV_VAR = 'ONENOTE_EXPORT_FOLDER' # Environment variable name
 ONENOTE_DONE_MARKER = "DONE"
+ONENOTE_CACHE_FILE = 'onenote_cache.json' # Parsed tasks keyed by (path, size, mtime) (per user, under cache_dir)
+ONENOTE_CACHE_MAX_ENTRIES = 20
+ONENOTE_PARSE_MODE = 'latest' # 'latest' (newest export only) or 'notebook' (every export, tasks deduplicated)
+ONENOTE_TASK_INDEX_FILE = 'onenote_tasks.sqlite3' # Notebook mode's task index (per user, under cache_dir)
+ONENOTE_PARSE_WORKERS = None # Processes for parsing changed exports in notebook mode (None = CPU count)
+ONENOTE_INDEX_RETENTION_DAYS = 90 # Tasks missing from every export for this long are forgotten
+ONENOTE_WATCH_ENABLED = True # Daemon mode keeps the latest export and its tasks current in the background
+ONENOTE_WATCH_POLL_SECONDS = 30 # Poll interval without watchdog (also the event loop's wake-up interval)
+ONENOTE_WATCH_RESCAN_MINUTES = 10 # Full folder rescan even when no change was noticed
+ONENOTE_WATCH_DEBOUNCE_SECONDS = 2 # Wait after a filesystem event before re-parsing
+
+# Brief Archive
+ARCHIVE_ENABLED = True # Store each sent brief's items and summary, and mark what is new since the last one
+BRIEF_ARCHIVE_FILE = 'brief_archive.sqlite3' # Per user, under cache_dir
+ARCHIVE_AI_NEW_ONLY = False # Summarize only new/changed items (main.py --new-only)
+
+# Backfill Digests (backfill.py)
+BACKFILL_GMAIL_QUERY = 'in:inbox -label:trash' # The date range is added as after:/before:
+BACKFILL_QUEUE_SIZE = 1000 # Items buffered between pipeline stages before the producer blocks
+BACKFILL_MAX_ROWS_PER_DAY = 100 # Emails listed per day in the digest (all are summarized)
+BACKFILL_OUTPUT_FILE = 'backfill_digest.html'
+BACKFILL_TRACE_FILE = 'backfill_trace.json'
 
 # Zoom Parsing
 ZOOM_SUMMARY_FOLDER_ENV_VAR = 'ZOOM_SUMMARY_FOLDER' # Environment variable name
 ZOOM_RECAP_ID = 'quick-recap'
 ZOOM_NEXT_STEPS_ID = 'next-steps'
 ZOOM_SUMMARY_ID = 'summary'
+ZOOM_LOOKBACK_HOURS = 24 # Recap files modified within this window feed the brief
+ZOOM_INDEX_FILE = 'zoom_index.json' # Parsed recaps keyed by (path, size, mtime) (per user, under cache_dir)
+ZOOM_INDEX_RETENTION_DAYS = 7 # Index entries for older files are dropped
+
+# Concurrent Fetch Stage
+# Each source runs in its own worker thread; a source that has not finished
+# within its timeout (or the fetch stage's deadline slice) falls back to its last good
+# result, or renders as a degraded section, instead of blocking the brief.
+FETCH_TIMEOUT_SECONDS = {
+    'calendar': 30,
+    'gmail': 60,
+    'onenote': 30,
+    'zoom': 30,
+}
+
+# Brief Deadline Budget (deadline.py)
+# Each stage must finish by its cumulative share of the total, so the brief goes out on time.
+# Google HTTP, OAuth refresh and OpenAI timeouts are capped by the current stage's remaining time;
+# a source whose slice runs out is replaced by its last good result, marked as stale.
+BRIEF_DEADLINE_SECONDS = 240 # Total time from the start of a brief to sending it (0 disables the budget)
+DEADLINE_STAGE_SHARES = {'fetch': 0.4, 'summarize': 0.4, 'render': 0.05, 'send': 0.15} # In pipeline order
+SECTION_CACHE_FILE = 'last_good_sections.json' # Last successful result per source (per user, under cache_dir)
+SECTION_CACHE_MAX_AGE_HOURS = 12 # Older results are not used (e.g. yesterday's agenda); the section renders as unavailable
 
 # OpenAI API Key
 OPENAI_API_KEY_ENV_VAR = 'OPENAI_API_KEY' # Environment variable name
+OPENAI_BASE_URL_ENV_VAR = 'OPENAI_BASE_URL' # Optional: point at a compatible endpoint (e.g. fake_openai_server.py)
+
+# AI Summarization
+OPENAI_MODEL = 'gpt-3.5-turbo'
+OPENAI_MAX_TOKENS = 1000 # Max tokens per completion
+OPENAI_TIMEOUT_SECONDS = 60 # Per request; also capped by the brief's deadline budget
+AI_SUMMARY_MODE = 'auto' # 'single', 'map_reduce', or 'auto' (map-reduce only when the input is too large for one call)
+AI_SINGLE_CALL_TOKEN_LIMIT = 12000 # Input tokens above which 'auto' switches to map-reduce
+AI_CHUNK_TOKEN_BUDGET = 3000 # Input tokens per map batch
+AI_MAX_WORKERS = 4 # Concurrent OpenAI requests during the map step
+AI_CACHE_ENABLED = True # Content-addressed cache of summaries and per-item extracts
+AI_CACHE_FILE = 'ai_summary_cache.sqlite3'
+AI_CACHE_MAX_AGE_DAYS = 14 # Entries older than this are evicted
+AI_CACHE_MAX_BYTES = 20 * 1024 * 1024 # Least recently used entries are evicted beyond this size
+AI_STREAMING_ENABLED = True # Stream the summary in the background while the other sections render
+AI_SUMMARY_DEADLINE_SECONDS = 90 # After this, the brief ships with the summary received so far
+AI_DEADLINE_MARKER = "(Note: summary truncated at the AI deadline.)" # Appended to a partial summary
+
+# AI Prompt Budget (prompt_builder.py)
+PROMPT_TOKEN_BUDGET = 8000 # Input tokens for the AI prompt; low-value snippets are cut, then items left out (0 = no limit)
+IMPORTANT_SENDERS_ENV_VAR = 'IMPORTANT_SENDERS' # Optional comma-separated addresses or @domains ranked highest
+IMPORTANT_SENDERS = [] # Used when the environment variable is not set
+AUTOMATED_SENDER_PATTERNS = ['noreply', 'no-reply', 'donotreply', 'notifications', 'newsletter', 'mailer-daemon'] # Ranked lowest
+PROMPT_RECENCY_HALF_LIFE_HOURS = 12 # An email's recency score halves every this many hours
+PROMPT_SCORE_WEIGHTS = {'sender': 3.0, 'recipient': 2.0, 'recency': 1.0} # Each component scores 0..1
+PROMPT_TASK_SCORE = 5.0 # OneNote tasks are the user's own notes, so they rank above most emails
+PROMPT_MEETING_SCORE = 4.5 # Zoom recaps (decisions and next steps from yesterday's meetings)
 
 # Email Sending
 RECIPIENT_EMAIL_ENV_VAR = 'RECIPIENT_EMAIL' # Environment variable name for recipient
+OUTBOX_DIR = 'outbox' # Rendered emails wait here until Gmail accepts them
+SEND_MAX_WORKERS = 4 # Concurrent messages().send calls when flushing the outbox
+OUTBOX_MAX_ATTEMPTS = 5 # Flushes an entry may fail transiently before moving to outbox/failed/
+OUTBOX_INFLIGHT_TIMEOUT_SECONDS = 600 # In-flight entries older than this are assumed orphaned by a crash
+
+# Team (Multi-User) Runs
+TEAM_CONFIG_FILE = 'team.json' # Lists users: name, token_file, recipient, onenote_export_folder, calendars
+TEAM_MAX_WORKERS = 8 # Users processed concurrently
+TEAM_CACHE_DIR = 'users' # Per-user stores, caches and HTML output go under users/<name>/
+
+# Daemon Mode (daemon.py)
+DAEMON_SEND_TIME = '07:00' # Daily delivery time (HH:MM in TARGET_TIMEZONE)
+DAEMON_PREFETCH_INTERVAL_MINUTES = 15 # Incremental fetch + per-item pre-summarization cadence overnight
+DAEMON_FINAL_PREFETCH_LEAD_MINUTES = 5 # Last fetch and AI reduce start this long before the send time
+DAEMON_AI_SUMMARY_MODE = 'map_reduce' # Per-item extracts are what the overnight prefetches can reuse
+DAEMON_CATCH_UP_MINUTES = 120 # On start-up, send a missed brief if the send time passed less than this long ago (0 disables)
+DAEMON_STATE_FILE = 'daemon_state.json' # Date of the last delivered brief, so restarts don't send twice
+DAEMON_PREFETCH_TRACE_FILE = 'daily_brief_prefetch_trace.json' # Spans of the last prefetch cycle
 
 # Output Files
 LOCAL_OUTPUT_HTML_FILE = 'daily_brief_local_output.html'
+TEMPLATE_BYTECODE_CACHE_DIR = '.jinja_cache' # Compiled Jinja2 templates
+
+# Tracing and Metrics
+TRACE_ENABLED = True # Record per-stage timing spans
+TRACE_FILE = 'daily_brief_trace.json' # Spans of the last run (written to the user's cache dir)
+TRACE_MAX_TRACES = 50 # Unexported traces kept in memory
+METRICS_TEXTFILE_DIR = '' # Where daily_brief_<user>.prom is written (point at node_exporter's textfile directory)
+PROFILE_ENV_VAR = 'DAILY_BRIEF_PROFILE' # Set to 'cprofile' or 'pyinstrument' to profile a run
 
 # --- Environment Variable Loading (Handled in specific modules) ---
 # ONENOTE_EXPORT_FOLDER and ZOOM_SUMMARY_FOLDER
@@ -0,0 +1,236 @@
+"""Long-running daemon: prefetches through the night and delivers the brief at a fixed local time.
+
+Usage:
+    python daemon.py                                   # daily at config.DAEMON_SEND_TIME (config.TARGET_TIMEZONE)
+    python daemon.py --send-time 06:30 --interval-minutes 10
+
+Between deliveries every cycle syncs Gmail, Calendar and OneNote incrementally and
+pre-summarizes new items (the map step). The OneNote export folder is watched in the
+background, so cycles read the latest export's tasks without scanning or parsing. Shortly before the send time a final cycle
+runs the AI reduce, so at the send time only rendering and sending remain.
+Credentials, the token refresher, stores, caches and compiled templates stay warm in
+the process between cycles.
+"""
+import argparse
+import json
+import os
+import signal
+import threading
+import time as time_module
+from datetime import datetime, time, timedelta
+
+from dotenv import load_dotenv
+
+import ai_summarizer
+import config
+import deadline
+import gmail_sender
+import main
+import onenote_parser
+import tracing
+import utils
+
+def parse_send_time(value):
+    """argparse type for HH:MM."""
+    try:
+        hours, minutes = value.strip().split(':')
+        return time(int(hours), int(minutes))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid time '{value}'; expected HH:MM")
+
+def _target_timezone():
+    import pytz
+    try:
+        return pytz.timezone(config.TARGET_TIMEZONE)
+    except pytz.UnknownTimeZoneError:
+        print(f"Warning: Unknown timezone '{config.TARGET_TIMEZONE}'. Scheduling in UTC.")
+        return pytz.utc
+
+def send_time_on(day, send_time, tz):
+    """The send time on a local date as an aware datetime (DST gaps resolve forward)."""
+    return tz.normalize(tz.localize(datetime.combine(day, send_time)))
+
+class BriefDaemon:
+    """Schedules prefetch cycles and the daily delivery for one user profile."""
+
+    def __init__(self, user, send_time, interval_minutes, send=True, sections=main.SOURCES, use_ai=True):
+        self.user = user
+        self.send_time = send_time
+        self.interval = timedelta(minutes=interval_minutes)
+        self.lead = timedelta(minutes=config.DAEMON_FINAL_PREFETCH_LEAD_MINUTES)
+        self.send = send
+        self.sections = sections
+        self.use_ai = use_ai
+        self.tz = _target_timezone()
+        self.stop_event = threading.Event()
+        self.state_file = os.path.join(user.get('cache_dir', ''), config.DAEMON_STATE_FILE)
+        self.state = self._load_state()
+        self.prepared = None # Output of main.prepare_brief from the final prefetch
+        self.prepared_at = None
+
+    def _load_state(self):
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self):
+        try:
+            utils.write_atomic(self.state_file, json.dumps(self.state))
+        except OSError as e:
+            print(f"Warning: could not save daemon state {self.state_file}: {e}")
+
+    def now(self):
+        return datetime.now(self.tz)
+
+    def next_send_at(self):
+        """The next send time whose date has not been delivered yet."""
+        now = self.now()
+        day = now.date()
+        while True:
+            send_at = send_time_on(day, self.send_time, self.tz)
+            if send_at > now and day.isoformat() != self.state.get('last_sent_date'):
+                return send_at
+            day += timedelta(days=1)
+
+    def wait_until(self, when):
+        """Sleeps until `when`; returns False if the daemon was stopped first."""
+        while not self.stop_event.is_set():
+            remaining = (when - self.now()).total_seconds()
+            if remaining <= 0:
+                return True
+            # Short waits so clock changes and suspend/resume are picked up
+            self.stop_event.wait(min(remaining, 60))
+        return False
+
+    def stop(self, *_):
+        print("\nStopping daemon...")
+        self.stop_event.set()
+
+    def _traced_cycle(self, name, func):
+        """Runs one cycle in a root span; returns func's result, or None if it raised."""
+        result = None
+        with tracing.span(name, user=self.user['name']) as root:
+            try:
+                result = func()
+            except Exception as e:
+                print(f"Error during {name}: {e}")
+                root.set('error', str(e))
+        if config.TRACE_ENABLED:
+            trace_file = os.path.join(self.user.get('cache_dir', ''),
+                                      config.TRACE_FILE if name == 'brief' else config.DAEMON_PREFETCH_TRACE_FILE)
+            tracing.export(root, self.user['name'] if name == 'brief' else f"{self.user['name']}_{name}", trace_file=trace_file)
+        return result
+
+    def prefetch(self):
+        """Incremental sync of every source plus per-item pre-summarization (no reduce)."""
+        print(f"\n=== Prefetch at {self.now():%H:%M:%S %Z} ===")
+
+        def cycle():
+            with tracing.span('fetch'):
+                fetched = main.fetch_all_sources(self.user, self.sections)
+            if self.use_ai and any(name in self.sections for name in main.AI_SOURCES):
+                with tracing.span('summarize') as span:
+                    span.set('count', ai_summarizer.presummarize_items(main.build_ai_input(fetched)[0]))
+            if self.send:
+                gmail_sender.flush_outbox() # Retry anything an earlier delivery left queued
+
+        self._traced_cycle('prefetch', cycle)
+
+    def final_prefetch(self):
+        """Last sync before delivery; runs the AI reduce so only render and send remain."""
+        print(f"\n=== Final prefetch at {self.now():%H:%M:%S %Z} ===")
+
+        def cycle():
+            with deadline.budget():
+                return main.prepare_brief(self.user, self.sections, self.use_ai)
+
+        prepared = self._traced_cycle('prefetch', cycle)
+        if prepared is not None:
+            self.prepared, self.prepared_at = prepared, self.now()
+
+    def deliver(self, day):
+        """Renders and sends the prepared brief (preparing it now if the final prefetch failed)."""
+        print(f"\n=== Delivering brief for {day.isoformat()} at {self.now():%H:%M:%S %Z} ===")
+        start_time = time_module.time()
+
+        def cycle():
+            with deadline.budget():
+                prepared = self.prepared
+                if prepared is None:
+                    print("No prepared brief; fetching and summarizing now.")
+                    prepared = main.prepare_brief(self.user, self.sections, self.use_ai)
+                elif isinstance(prepared['ai_summary'], ai_summarizer.SummaryStream):
+                    # The summary started at the final prefetch; its deadline counts from delivery
+                    with deadline.stage('summarize'):
+                        prepared['ai_summary'].restart_clock()
+                return main.deliver_brief(self.user, prepared, send=self.send)
+
+        result = self._traced_cycle('brief', cycle)
+        self.prepared = self.prepared_at = None
+        # A failed send stays in the outbox and is retried by later prefetch cycles
+        if result is not None and result['ok']:
+            self.state['last_sent_date'] = day.isoformat()
+            self._save_state()
+        print(f"Delivery finished in {time_module.time() - start_time:.2f} seconds "
+              f"({'sent' if result and result['sent'] else 'not sent'}).")
+
+    def catch_up(self):
+        """Delivers today's brief right away if the daemon was down at the send time."""
+        if not config.DAEMON_CATCH_UP_MINUTES:
+            return
+        today = self.now().date()
+        send_at = send_time_on(today, self.send_time, self.tz)
+        missed_by = self.now() - send_at
+        if today.isoformat() != self.state.get('last_sent_date') and \
+                timedelta(0) <= missed_by <= timedelta(minutes=config.DAEMON_CATCH_UP_MINUTES):
+            print(f"Missed today's {self.send_time:%H:%M} delivery by {int(missed_by.total_seconds() // 60)} minutes; sending now.")
+            self.deliver(today)
+
+    def run(self):
+        print(f"Daemon started: delivering at {self.send_time:%H:%M} {self.tz.zone}, "
+              f"prefetching every {self.interval.total_seconds() / 60:g} minutes.")
+        export_folder = self.user.get('onenote_export_folder')
+        if config.ONENOTE_WATCH_ENABLED and config.ONENOTE_PARSE_MODE == 'latest' and 'onenote' in self.sections and export_folder:
+            onenote_parser.start_watching(export_folder, os.path.join(self.user.get('cache_dir', ''), config.ONENOTE_CACHE_FILE))
+        self.catch_up()
+        while not self.stop_event.is_set():
+            send_at = self.next_send_at()
+            final_at = send_at - self.lead
+            if self.now() < final_at:
+                self.prefetch()
+                self.wait_until(min(self.now() + self.interval, final_at))
+                continue
+            if self.prepared_at is None or self.prepared_at < final_at:
+                self.final_prefetch()
+            if self.wait_until(send_at):
+                self.deliver(send_at.date())
+        onenote_parser.stop_watching()
+        print("Daemon stopped.")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Prefetch overnight and deliver the Daily Brief at a fixed time.")
+    parser.add_argument('--send-time', type=parse_send_time, default=parse_send_time(config.DAEMON_SEND_TIME),
+                        help=f"Delivery time, HH:MM in {config.TARGET_TIMEZONE} (default: {config.DAEMON_SEND_TIME})")
+    parser.add_argument('--interval-minutes', type=float, default=config.DAEMON_PREFETCH_INTERVAL_MINUTES,
+                        help=f"Minutes between prefetch cycles (default: {config.DAEMON_PREFETCH_INTERVAL_MINUTES})")
+    parser.add_argument('--only', type=main.parse_sections, default=main.SOURCES, metavar='SECTIONS',
+                        help="Comma-separated sources to fetch; others render as not included")
+    parser.add_argument('--no-send', action='store_true', help="Render the brief locally without sending it")
+    parser.add_argument('--no-ai', action='store_true', help="Skip the OpenAI summary")
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    args = parse_args()
+    load_dotenv()
+    # Per-item extracts are memoized only in map-reduce mode
+    config.AI_SUMMARY_MODE = config.DAEMON_AI_SUMMARY_MODE
+
+    daemon = BriefDaemon(main.default_user(), args.send_time, args.interval_minutes,
+                         send=not args.no_send, sections=args.only, use_ai=not args.no_ai)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        daemon.stop()
@@ -0,0 +1,87 @@
+"""Time budget for one brief, split into per-stage slices.
+
+Each stage (fetch, summarize, render, send) must finish by its cumulative share of the
+total, measured from the brief's start, so time an early stage doesn't use carries over
+to the later ones. The active budget and stage travel with the brief's worker threads
+(tracing.propagate copies them) and cap Google HTTP, OAuth refresh and OpenAI timeouts.
+"""
+import contextlib
+import contextvars
+import time
+
+import config
+
+class DeadlineExceeded(TimeoutError):
+    """Raised instead of starting a request once the current stage's slice is used up."""
+
+class Budget:
+    """Stage end times for a total budget of total_seconds starting now."""
+
+    def __init__(self, total_seconds, shares=None):
+        self.start = time.time()
+        self.total_seconds = total_seconds
+        shares = shares or config.DEADLINE_STAGE_SHARES
+        scale = sum(shares.values())
+        self.stage_ends = {}
+        cumulative = 0.0
+        for name, share in shares.items():
+            cumulative += share / scale
+            self.stage_ends[name] = self.start + total_seconds * cumulative
+
+    def ends_at(self, stage_name=None):
+        """End of stage_name's slice (the whole budget's end for None or an unknown stage)."""
+        return self.stage_ends.get(stage_name, self.start + self.total_seconds)
+
+    def remaining(self, stage_name=None):
+        return self.ends_at(stage_name) - time.time()
+
+# (Budget or None, stage name or None) of the current brief
+_current = contextvars.ContextVar('deadline', default=(None, None))
+
+@contextlib.contextmanager
+def budget(total_seconds=None):
+    """Runs the enclosed block under a new budget (config.BRIEF_DEADLINE_SECONDS by default; 0 disables it)."""
+    total_seconds = config.BRIEF_DEADLINE_SECONDS if total_seconds is None else total_seconds
+    token = _current.set((Budget(total_seconds) if total_seconds else None, None))
+    try:
+        yield _current.get()[0]
+    finally:
+        _current.reset(token)
+
+@contextlib.contextmanager
+def stage(name):
+    """Runs the enclosed block as stage `name` of the current budget (no-op without one)."""
+    token = _current.set((_current.get()[0], name))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+def current_stage():
+    return _current.get()[1]
+
+def remaining():
+    """Seconds left in the current stage's slice, or None when no budget is active."""
+    current_budget, stage_name = _current.get()
+    if current_budget is None:
+        return None
+    return current_budget.remaining(stage_name)
+
+def cap(seconds):
+    """Returns seconds capped by the time left in the current stage (seconds itself without a budget)."""
+    left = remaining()
+    if left is None:
+        return seconds
+    return max(0.0, min(seconds, left))
+
+def timeout(seconds):
+    """A timeout for a request about to start: seconds, capped by the current stage's slice.
+
+    Raises DeadlineExceeded when the slice is already used up, so no new request starts.
+    """
+    left = remaining()
+    if left is None:
+        return seconds
+    if left <= 0:
+        raise DeadlineExceeded(f"the {current_stage() or 'brief'} stage ran out of time")
+    return left if seconds is None else min(seconds, left)
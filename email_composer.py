@@ -1,46 +1,264 @@
 import os
+import re
+import shutil
+import uuid
 from datetime import datetime
-import pytz
-from jinja2 import Environment, FileSystemLoader, select_autoescape
+from functools import lru_cache
 
 import config
 
-def compose_email(calendar_events, email_list, onenote_tasks, ai_summary):
-    """Renders the HTML email using the Jinja2 template and collected data."""
+TEMPLATE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_NAME = "email_template.html"
+DIGEST_TEMPLATE_NAME = "backfill_template.html"
+# Template blocks that depend on the AI summary; spliced in after the rest of the brief is rendered
+AI_BLOCKS = ('ai_summary', 'ai_cache_stats')
+# Virtual template name for the CSS-inlined, minified variant (built from TEMPLATE_NAME at compile time)
+INLINED_TEMPLATE_NAME = "email_template.inlined.html"
+
+JINJA_SYNTAX_PATTERN = re.compile(r'({{.*?}}|{%.*?%}|{#.*?#})', re.DOTALL)
+STYLE_BLOCK_PATTERN = re.compile(r'<style[^>]*>(.*?)</style>', re.DOTALL | re.IGNORECASE)
+OPEN_TAG_PATTERN = re.compile(r'<([a-zA-Z][a-zA-Z0-9]*)((?:\s[^<>]*?)?)(/?)>')
+SIMPLE_SELECTOR_PATTERN = re.compile(r'^(?:[a-z][a-z0-9]*|\.[\w-]+)$')
+
+# --- CSS inlining (applied once to the template source, not per message) ---
+
+def _split_css_rules(css):
+    """Splits a stylesheet into (inlinable simple-selector rules, leftover CSS such as @media blocks)."""
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.DOTALL)
+    rules = []
+    leftover = []
+    pos = 0
+    while True:
+        brace = css.find('{', pos)
+        if brace == -1:
+            break
+        selector_text = css[pos:brace].strip()
+        if selector_text.startswith('@'):
+            # Keep at-rules (e.g. @media) intact by matching nested braces
+            depth, end = 0, brace
+            while end < len(css):
+                if css[end] == '{':
+                    depth += 1
+                elif css[end] == '}':
+                    depth -= 1
+                    if depth == 0:
+                        break
+                end += 1
+            leftover.append(css[pos:end + 1].strip())
+            pos = end + 1
+            continue
+        close = css.find('}', brace)
+        declarations = [d.strip() for d in css[brace + 1:close].split(';') if d.strip()]
+        complex_selectors = []
+        for selector in (s.strip() for s in selector_text.split(',')):
+            if SIMPLE_SELECTOR_PATTERN.match(selector):
+                rules.append((selector, declarations))
+            else:
+                complex_selectors.append(selector)
+        if complex_selectors:
+            leftover.append(f"{', '.join(complex_selectors)} {{ {'; '.join(declarations)} }}")
+        pos = close + 1
+    return rules, leftover
+
+def _inline_tag_styles(match, tag_rules, class_rules):
+    """Adds a style="" attribute to one opening tag from the rules matching its name and classes."""
+    tag_name, attrs, self_closing = match.group(1), match.group(2), match.group(3)
+    declarations = list(tag_rules.get(tag_name.lower(), []))
+    class_match = re.search(r'class="([^"]*)"', attrs)
+    if class_match:
+        for class_name in class_match.group(1).split():
+            declarations.extend(class_rules.get(class_name, []))
+    if not declarations:
+        return match.group(0)
+
+    # Existing inline styles come last so they keep winning
+    style_match = re.search(r'\s*style="([^"]*)"', attrs)
+    if style_match:
+        attrs = attrs.replace(style_match.group(0), '')
+        declarations.extend(d.strip() for d in style_match.group(1).split(';') if d.strip())
+    merged = {}
+    for declaration in declarations:
+        prop, _, value = declaration.partition(':')
+        # Double quotes (e.g. font names) would terminate the attribute
+        merged[prop.strip()] = value.strip().replace('"', "'")
+    style = ';'.join(f"{prop}:{value}" for prop, value in merged.items())
+    return f'<{tag_name}{attrs.rstrip()} style="{style}"{self_closing}>'
+
+def _transform_html_segments(source, transform):
+    """Applies transform to the HTML between Jinja constructs, leaving Jinja syntax untouched."""
+    parts = JINJA_SYNTAX_PATTERN.split(source)
+    return ''.join(transform(part) if i % 2 == 0 else part for i, part in enumerate(parts))
+
+def _minify(html):
+    html = re.sub(r'<!--.*?-->', '', html, flags=re.DOTALL)
+    html = re.sub(r'>\s+<', '><', html)
+    return re.sub(r'\s+', ' ', html)
+
+def inline_css_and_minify(template_source):
+    """Returns template_source with simple CSS rules inlined as style="" attributes, then minified.
+
+    Rules that can't be inlined (descendant selectors, @media queries) stay in the <style> block.
+    """
+    style_match = STYLE_BLOCK_PATTERN.search(template_source)
+    if not style_match:
+        return _transform_html_segments(template_source, _minify)
+
+    rules, leftover = _split_css_rules(style_match.group(1))
+    tag_rules, class_rules = {}, {}
+    # Tag rules are applied before class rules, matching CSS specificity
+    for selector, declarations in rules:
+        if selector.startswith('.'):
+            class_rules.setdefault(selector[1:], []).extend(declarations)
+        else:
+            tag_rules.setdefault(selector, []).extend(declarations)
+
+    leftover_css = re.sub(r'\s+', ' ', ' '.join(leftover)).strip()
+    head = template_source[:style_match.start()] + (f"<style>{leftover_css}</style>" if leftover_css else '')
+    body = template_source[style_match.end():]
+
+    inline = lambda html: OPEN_TAG_PATTERN.sub(lambda m: _inline_tag_styles(m, tag_rules, class_rules), html)
+    return (_transform_html_segments(head, _minify)
+            + _transform_html_segments(body, lambda html: _minify(inline(html))))
+
+def _load_inlined_template(name):
+    """FunctionLoader hook: builds the inlined variant from the real template source."""
+    if name != INLINED_TEMPLATE_NAME:
+        return None
+    path = os.path.join(TEMPLATE_DIR, TEMPLATE_NAME)
+    with open(path, 'r', encoding='utf-8') as f:
+        source = f.read()
+    mtime = os.path.getmtime(path)
+    return inline_css_and_minify(source), None, lambda: os.path.getmtime(path) == mtime
+
+# --- Template environment (created once per process) ---
+
+@lru_cache(maxsize=None)
+def _get_environment():
+    """Returns the shared Jinja2 environment, with compiled templates cached on disk."""
+    # Imported on first render rather than at start-up
+    from jinja2 import ChoiceLoader, Environment, FileSystemBytecodeCache, FileSystemLoader, FunctionLoader, select_autoescape
+    os.makedirs(config.TEMPLATE_BYTECODE_CACHE_DIR, exist_ok=True)
+    return Environment(
+        loader=ChoiceLoader([FileSystemLoader(TEMPLATE_DIR), FunctionLoader(_load_inlined_template)]),
+        autoescape=select_autoescape(['html', 'xml']),
+        bytecode_cache=FileSystemBytecodeCache(config.TEMPLATE_BYTECODE_CACHE_DIR),
+        auto_reload=False # Templates are compiled once per process
+    )
+
+@lru_cache(maxsize=None)
+def _get_template(inline_css=False):
+    env = _get_environment()
+    # The inlined variant autoescapes like the .html original
+    return env.get_template(INLINED_TEMPLATE_NAME if inline_css else TEMPLATE_NAME)
+
+@lru_cache(maxsize=None)
+def _get_target_timezone():
+    import pytz
+    try:
+        return pytz.timezone(config.TARGET_TIMEZONE)
+    except pytz.UnknownTimeZoneError:
+        print(f"Warning: Unknown timezone '{config.TARGET_TIMEZONE}'. Using UTC for footer.")
+        return pytz.utc
+
+def _footer_context():
+    """Date and generation-time strings shared by every brief rendered in one batch."""
+    now_local = datetime.now(_get_target_timezone())
+    return {
+        'today_date': now_local.strftime("%A, %B %d, %Y"),
+        'generation_time': now_local.strftime("%I:%M %p"),
+        'generation_timezone': now_local.strftime("%Z"),
+    }
+
+def compose_emails(shared_context, per_recipient_overrides, inline_css=False):
+    """Renders one brief per entry of per_recipient_overrides from a shared context.
+
+    shared_context holds the template variables common to every brief (calendar_events,
+    email_list, onenote_tasks, ai_summary, ...); each override dict replaces any of them
+    for one recipient. With inline_css=True the CSS-inlined, minified variant is rendered.
+    Returns a list of HTML strings in the same order as per_recipient_overrides.
+    """
+    print(f"\n--- Composing {len(per_recipient_overrides)} Emails ---")
+    template = _get_template(inline_css)
+    base_context = {**_footer_context(), **shared_context}
+    return [template.render({**base_context, **overrides}) for overrides in per_recipient_overrides]
+
+def _render_with_summary_stream(template, context, summary_stream):
+    """Renders everything but the AI blocks while the summary streams in, then splices them in."""
+    # Unique tokens: a plain-text placeholder survives autoescaping and minification
+    pending_blocks = {name: f"pending-block-{name}-{uuid.uuid4().hex}" for name in AI_BLOCKS}
+    html_output = template.render({**context, 'ai_summary': None, 'pending_blocks': pending_blocks})
+
+    summary = summary_stream.result() # Returns by the stream's deadline, partial if need be
+    stale_sections = {**context['stale_sections'], 'ai': summary_stream.stale_at} if summary_stream.stale_at else context['stale_sections']
+    block_context = template.new_context({**context, 'ai_summary': summary, 'ai_cache_stats': summary_stream.cache_stats,
+                                          'stale_sections': stale_sections})
+    for name, token in pending_blocks.items():
+        html_output = html_output.replace(token, ''.join(template.blocks[name](block_context)), 1)
+    return html_output
+
+def write_digest(output_file, title, days, finish):
+    """Streams a backfill digest to output_file without holding the rendered HTML in memory.
+
+    days is consumed lazily while its section is rendered to a side file; finish() is called
+    after that and returns the rest of the context (ai_summary, message_count, task_count).
+    The page is then rendered around a marker where the side file is copied in.
+    """
+    template = _get_environment().get_template(DIGEST_TEMPLATE_NAME)
+    days_file = f"{output_file}.days.tmp"
+    try:
+        with open(days_file, 'w', encoding='utf-8') as f:
+            for chunk in template.blocks['days'](template.new_context({'days': days})):
+                f.write(chunk)
+
+        days_marker = f"digest-days-{uuid.uuid4().hex}"
+        context = {**_footer_context(), **finish(), 'title': title, 'days_marker': days_marker}
+        with open(output_file, 'w', encoding='utf-8') as out:
+            for chunk in template.generate(context):
+                before, found, after = chunk.partition(days_marker)
+                out.write(before)
+                if found:
+                    with open(days_file, 'r', encoding='utf-8') as f:
+                        shutil.copyfileobj(f, out)
+                    out.write(after)
+    finally:
+        if os.path.exists(days_file):
+            os.remove(days_file)
+
+def compose_email(calendar_events, email_list, onenote_tasks, ai_summary, ai_cache_stats=None, inline_css=False, skipped_sections=(),
+                  ai_input_stats=None, item_status=None, stale_sections=None):
+    """Renders the HTML email using the Jinja2 template and collected data.
+
+    Sections named in skipped_sections ('calendar', 'gmail', 'onenote', 'ai') are rendered
+    as not included in this run. ai_summary may also be an ai_summarizer.SummaryStream:
+    the other sections are then rendered while it streams and the summary is spliced in
+    when it completes (or its deadline passes). ai_input_stats (from prompt_builder) adds a
+    note when items were left out of the AI prompt. item_status (from brief_archive.diff)
+    marks items that are new or changed since the last brief. stale_sections ({source: time})
+    marks sections (and 'ai', the summary) showing an earlier result because their source did not respond in time.
+    """
     print("\n--- Composing Email ---")
     try:
-        # Set up Jinja2 environment
-        env = Environment(
-            loader=FileSystemLoader(os.path.dirname(os.path.abspath(__file__))),
-            autoescape=select_autoescape(['html', 'xml'])
-        )
-        template = env.get_template("email_template.html")
-
-        # Get current time in target timezone for the footer
-        try:
-            target_tz = pytz.timezone(config.TARGET_TIMEZONE)
-        except pytz.UnknownTimeZoneError:
-            print(f"Warning: Unknown timezone '{config.TARGET_TIMEZONE}'. Using UTC for footer.")
-            target_tz = pytz.utc
-
-        now_local = datetime.now(target_tz)
-        today_date_str = now_local.strftime("%A, %B %d, %Y")
-        generation_time_str = now_local.strftime("%I:%M %p")
-        generation_timezone_str = now_local.strftime("%Z")
+        template = _get_template(inline_css)
 
         # Prepare context data for the template
         context = {
-            'today_date': today_date_str,
-            'generation_time': generation_time_str,
-            'generation_timezone': generation_timezone_str,
+            **_footer_context(),
             'calendar_events': calendar_events,
             'email_list': email_list,
             'onenote_tasks': onenote_tasks,
-            'ai_summary': ai_summary
+            'ai_summary': ai_summary,
+            'ai_cache_stats': ai_cache_stats,
+            'ai_input_stats': ai_input_stats,
+            'skipped_sections': list(skipped_sections),
+            'item_status': item_status or {},
+            'stale_sections': stale_sections or {},
         }
 
         # Render the template
-        html_output = template.render(context)
+        if ai_summary is None or isinstance(ai_summary, str):
+            html_output = template.render(context)
+        else:
+            html_output = _render_with_summary_stream(template, context, ai_summary)
         print("Email composition successful.")
         return html_output
 
@@ -0,0 +1,123 @@
+"""Collapses reply chains and near-duplicate emails (notification storms) into one item each.
+
+Messages are first grouped by threadId. The thread representatives are then clustered by
+MinHash similarity of their subject and snippet (word shingles, LSH banding for candidate
+pairs), per sender. Each resulting item carries the number of messages it stands for.
+"""
+import random
+import re
+import zlib
+
+import config
+
+_PRIME = (1 << 61) - 1 # Mersenne prime for the universal hash family
+_MAX_HASH = (1 << 32) - 1
+_WORD_PATTERN = re.compile(r'\w+')
+_DIGITS_PATTERN = re.compile(r'\d+')
+_REPLY_PREFIX_PATTERN = re.compile(r'^\s*((re|fwd?|aw|wg)\s*:\s*)+', re.IGNORECASE)
+
+def _normalize(text):
+    """Lowercases and masks numbers, so "Build #1841 failed" and "Build #1842 failed" compare equal."""
+    return _DIGITS_PATTERN.sub('0', (text or '').lower())
+
+def shingles(text, size=None):
+    """Returns the set of `size`-word shingles of text, hashed to 32 bits."""
+    size = size or config.EMAIL_DEDUP_SHINGLE_SIZE
+    words = _WORD_PATTERN.findall(_normalize(text))
+    if len(words) <= size:
+        return {zlib.crc32(' '.join(words).encode('utf-8'))} if words else set()
+    return {zlib.crc32(' '.join(words[i:i + size]).encode('utf-8')) for i in range(len(words) - size + 1)}
+
+def _permutations(num_perm, seed=1):
+    rng = random.Random(seed)
+    return [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(num_perm)]
+
+def minhash(shingle_hashes, permutations):
+    """MinHash signature: for each permutation, the smallest permuted shingle hash."""
+    if not shingle_hashes:
+        return tuple([_MAX_HASH] * len(permutations))
+    return tuple(min([(a * h + b) % _PRIME for h in shingle_hashes]) & _MAX_HASH for a, b in permutations)
+
+def estimated_similarity(signature_a, signature_b):
+    """Estimated Jaccard similarity: the share of permutations whose minimums agree."""
+    return sum(1 for x, y in zip(signature_a, signature_b) if x == y) / len(signature_a)
+
+def _find(parents, item):
+    while parents[item] != item:
+        parents[item] = parents[parents[item]]
+        item = parents[item]
+    return item
+
+def group_threads(records):
+    """Groups records (newest first) by thread_id.
+
+    Returns one item per thread, in newest-first order, based on the thread's newest message,
+    with 'message_count' and 'senders' (distinct senders, newest first) added.
+    """
+    threads = {}
+    for record in records:
+        key = record.get('thread_id') or record['id']
+        thread = threads.get(key)
+        if thread is None:
+            threads[key] = dict(record, message_count=1, senders=[record['sender']])
+        else:
+            thread['message_count'] += 1
+            if record['sender'] not in thread['senders']:
+                thread['senders'].append(record['sender'])
+    return list(threads.values())
+
+def cluster_near_duplicates(items, threshold=None):
+    """Merges items from the same sender whose subject and snippet are near-duplicates.
+
+    Candidate pairs come from LSH banding of MinHash signatures and are kept when their
+    estimated similarity is at least threshold. Returns the merged items, newest first;
+    message counts are summed into the newest item of each cluster.
+    """
+    threshold = config.EMAIL_DEDUP_THRESHOLD if threshold is None else threshold
+    permutations = _permutations(config.EMAIL_DEDUP_NUM_PERM)
+    rows = max(1, config.EMAIL_DEDUP_NUM_PERM // config.EMAIL_DEDUP_LSH_BANDS)
+
+    signatures = []
+    signature_cache = {} # Identical normalized texts (common in notification storms) are hashed once
+    for item in items:
+        text = f"{_REPLY_PREFIX_PATTERN.sub('', item['subject'])}\n{item['snippet']}"
+        key = _normalize(text)
+        if key not in signature_cache:
+            signature_cache[key] = minhash(shingles(text), permutations)
+        signatures.append(signature_cache[key])
+
+    parents = list(range(len(items)))
+    buckets = {}
+    for index, (item, signature) in enumerate(zip(items, signatures)):
+        for band in range(0, len(signature), rows):
+            bucket_key = (item['sender'], band, signature[band:band + rows])
+            other = buckets.setdefault(bucket_key, index)
+            if other == index:
+                continue
+            root_a, root_b = _find(parents, index), _find(parents, other)
+            if root_a != root_b and estimated_similarity(signature, signatures[other]) >= threshold:
+                # Items are newest first, so the lower index (newer item) stays the root
+                parents[max(root_a, root_b)] = min(root_a, root_b)
+
+    merged = {}
+    for index, item in enumerate(items):
+        root = _find(parents, index)
+        if root == index:
+            merged[root] = dict(item, duplicate_count=0)
+        else:
+            merged[root]['message_count'] += item['message_count']
+            merged[root]['duplicate_count'] += 1
+    return [merged[index] for index in sorted(merged)]
+
+def collapse(records):
+    """Collapses threads and near-duplicates; returns (items, stats)."""
+    threads = group_threads(records)
+    items = cluster_near_duplicates(threads) if config.EMAIL_DEDUP_NEAR_DUPLICATES else \
+        [dict(thread, duplicate_count=0) for thread in threads]
+    stats = {
+        'messages': len(records),
+        'threads': len(threads),
+        'items': len(items),
+        'near_duplicates': len(threads) - len(items),
+    }
+    return items, stats
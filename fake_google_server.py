@@ -0,0 +1,238 @@
+"""Local stand-in for the Gmail and Calendar REST endpoints (including batch), for offline runs.
+
+Usage:
+    python fake_google_server.py --port 8766 --messages 5000 --latency 0.05
+    GOOGLE_API_ENDPOINT=http://127.0.0.1:8766/ python main.py   (with a token file holding any valid credentials)
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from email.parser import BytesParser
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import synthetic_data
+
+class FakeGoogleState:
+    """Mailbox and calendars served by the fake endpoints."""
+
+    def __init__(self, messages=None, calendars=None, history_id=1000):
+        self.messages = list(messages or []) # Newest first
+        self.by_id = {m['id']: m for m in self.messages}
+        self.by_thread = {}
+        for message in reversed(self.messages): # Oldest first, like Gmail
+            self.by_thread.setdefault(message['threadId'], []).append(message)
+        self.calendars = dict(calendars or {})
+        self.history_id = history_id
+        self.sent = []
+        self.lock = threading.Lock()
+
+def _parse_query(gmail_query):
+    """Supports the parts of Gmail search syntax the fetchers use: in:inbox, newer_than:Nd/h,
+    after:/before:<epoch seconds>, -label:x. Returns (required, excluded, newer_than_ms, older_than_ms)."""
+    required, excluded, newer_than_ms, older_than_ms = set(), set(), None, None
+    for term in (gmail_query or '').lower().split():
+        if term == 'in:inbox':
+            required.add('INBOX')
+        elif term.startswith('-label:') or term.startswith('-in:'):
+            excluded.add(term.split(':', 1)[1].upper())
+        elif term.startswith('newer_than:'):
+            value = term.split(':', 1)[1]
+            unit = {'d': 86400, 'h': 3600}.get(value[-1], 86400)
+            newer_than_ms = int((time.time() - int(value[:-1] or 1) * unit) * 1000)
+        elif term.startswith('after:'):
+            newer_than_ms = int(term.split(':', 1)[1]) * 1000
+        elif term.startswith('before:'):
+            older_than_ms = int(term.split(':', 1)[1]) * 1000
+    return required, excluded, newer_than_ms, older_than_ms
+
+def _parse_time(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00')) if value else None
+
+def _event_time(event_time):
+    """Start/end of an event as an aware datetime (all-day dates are taken as UTC midnight)."""
+    if event_time.get('dateTime'):
+        return _parse_time(event_time['dateTime'])
+    return datetime.fromisoformat(event_time['date']).replace(tzinfo=timezone.utc)
+
+def _page(items, query, default_size, key):
+    start = int(query.get('pageToken', ['0'])[0] or 0)
+    size = int(query.get('maxResults', [default_size])[0])
+    payload = {key: items[start:start + size]}
+    if start + size < len(items):
+        payload['nextPageToken'] = str(start + size)
+    return payload
+
+def route(state, method, path, query, body):
+    """Answers one API request; returns (status, payload)."""
+    parts = [unquote(p) for p in path.strip('/').split('/')]
+    if parts[:1] == ['calendars']:
+        # Calendar method paths are relative to its servicePath, which an api_endpoint override drops
+        parts = ['calendar', 'v3'] + parts
+    if parts[:4] == ['gmail', 'v1', 'users', 'me']:
+        rest = parts[4:]
+        if rest == ['profile']:
+            return 200, {'emailAddress': 'seth@example.com', 'messagesTotal': len(state.messages), 'historyId': str(state.history_id)}
+        if rest == ['messages'] and method == 'GET':
+            required, excluded, newer_than_ms, older_than_ms = _parse_query(query.get('q', [''])[0])
+            matches = [{'id': m['id'], 'threadId': m['threadId']} for m in state.messages
+                       if required.issubset(m['labelIds']) and not excluded.intersection(m['labelIds'])
+                       and (newer_than_ms is None or int(m['internalDate']) >= newer_than_ms)
+                       and (older_than_ms is None or int(m['internalDate']) < older_than_ms)]
+            payload = _page(matches, query, 100, 'messages')
+            payload['resultSizeEstimate'] = len(matches)
+            return 200, payload
+        if len(rest) == 2 and rest[0] == 'messages' and method == 'GET':
+            message = state.by_id.get(rest[1])
+            if message is None:
+                return 404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}}
+            wanted = query.get('metadataHeaders')
+            if wanted:
+                message = dict(message, payload={'headers': [h for h in message['payload']['headers'] if h['name'] in wanted]})
+            return 200, message
+        if len(rest) == 2 and rest[0] == 'threads' and method == 'GET':
+            wanted = query.get('metadataHeaders')
+            messages = state.by_thread.get(rest[1])
+            if not messages:
+                return 404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}}
+            if wanted:
+                messages = [dict(m, payload={'headers': [h for h in m['payload']['headers'] if h['name'] in wanted]}) for m in messages]
+            return 200, {'id': rest[1], 'historyId': str(state.history_id), 'messages': messages}
+        if rest == ['messages', 'send'] and method == 'POST':
+            with state.lock:
+                state.sent.append(body)
+                sent_id = f'sent-{len(state.sent)}'
+            return 200, {'id': sent_id, 'threadId': sent_id, 'labelIds': ['SENT']}
+        if rest == ['history']:
+            # The fake mailbox doesn't change between runs
+            return 200, {'history': [], 'historyId': str(state.history_id)}
+    if parts[:3] == ['calendar', 'v3', 'calendars'] and len(parts) == 5 and parts[4] == 'events':
+        events = state.calendars.get(parts[3])
+        if events is None:
+            return 404, {'error': {'code': 404, 'message': 'Not Found'}}
+        if 'syncToken' in query:
+            items = [] # No changes since the last sync
+        else:
+            time_min = _parse_time(query.get('timeMin', [None])[0])
+            time_max = _parse_time(query.get('timeMax', [None])[0])
+            items = [e for e in events
+                     if (time_max is None or _event_time(e['start']) < time_max)
+                     and (time_min is None or _event_time(e['end']) > time_min)]
+        payload = _page(items, query, 250, 'items')
+        if 'nextPageToken' not in payload:
+            payload['nextSyncToken'] = f'sync-{parts[3]}'
+        return 200, payload
+    return 404, {'error': {'code': 404, 'message': f'Unknown path {path}'}}
+
+class FakeGoogleHandler(BaseHTTPRequestHandler):
+    # Set by make_server()
+    latency = 0.0
+    error_rate = 0.0
+    state = None
+    stats = None
+
+    def log_message(self, format, *args):
+        pass # Keep benchmark output clean
+
+    def _inject_error(self):
+        """Deterministic injection: every (1 / error_rate)-th API call gets a 503 or 429."""
+        with self.stats['lock']:
+            self.stats['calls'] += 1
+            number = self.stats['calls']
+            failed = bool(self.error_rate) and int(number * self.error_rate) != int((number - 1) * self.error_rate)
+            if failed:
+                self.stats['injected_errors'] += 1
+        if not failed:
+            return None
+        status = 429 if number % 2 else 503
+        return status, {'error': {'code': status, 'message': 'Injected error',
+                                  'errors': [{'reason': 'rateLimitExceeded' if status == 429 else 'backendError'}]}}
+
+    def _answer(self, method, target, body):
+        url = urlsplit(target)
+        return self._inject_error() or route(self.state, method, url.path, parse_qs(url.query), body)
+
+    def _send(self, status, body, content_type='application/json; charset=UTF-8'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, method):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+        with self.stats['lock']:
+            self.stats['http_requests'] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.path.split('?')[0].rstrip('/').startswith('/batch'):
+            self._handle_batch(body)
+            return
+        status, payload = self._answer(method, self.path, json.loads(body) if body else None)
+        self._send(status, json.dumps(payload).encode('utf-8'))
+
+    def _handle_batch(self, body):
+        """Answers a multipart/mixed batch: every part is an embedded HTTP request."""
+        message = BytesParser().parsebytes(b'Content-Type: ' + self.headers['Content-Type'].encode() + b'\r\n\r\n' + body)
+        boundary = f'batch_{uuid.uuid4().hex}'
+        out = []
+        for part in message.get_payload():
+            content_id = (part.get('Content-ID') or '').strip().strip('<>')
+            request_text = part.get_payload()
+            head, _, inner_body = request_text.partition('\r\n\r\n') if '\r\n\r\n' in request_text else request_text.partition('\n\n')
+            method, target = head.splitlines()[0].split()[:2]
+            inner_body = inner_body.strip()
+            status, payload = self._answer(method, target, json.loads(inner_body) if inner_body else None)
+            payload_bytes = json.dumps(payload)
+            out.append(f'--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n'
+                       f'HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\nContent-Type: application/json; charset=UTF-8\r\n'
+                       f'Content-Length: {len(payload_bytes)}\r\n\r\n{payload_bytes}\r\n')
+        with self.stats['lock']:
+            self.stats['batch_parts'] += len(out)
+        out.append(f'--{boundary}--\r\n')
+        self._send(200, ''.join(out).encode('utf-8'), f'multipart/mixed; boundary={boundary}')
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+def make_server(state, port=0, latency=0.0, error_rate=0.0):
+    """Creates (but does not start) a fake server; port 0 picks a free port."""
+    handler = type('Handler', (FakeGoogleHandler,), {
+        'latency': latency,
+        'error_rate': error_rate,
+        'state': state,
+        'stats': {'lock': threading.Lock(), 'http_requests': 0, 'calls': 0, 'batch_parts': 0, 'injected_errors': 0},
+    })
+    return ThreadingHTTPServer(('127.0.0.1', port), handler)
+
+def start_in_background(state, port=0, latency=0.0, error_rate=0.0):
+    """Starts a fake server in a daemon thread and returns (server, api_endpoint)."""
+    server = make_server(state, port, latency, error_rate)
+    threading.Thread(target=server.serve_forever, name='fake-google', daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--messages', type=int, default=500, help='Synthetic inbox size')
+    parser.add_argument('--events', type=int, default=12, help='Events per calendar')
+    parser.add_argument('--calendars', default='primary', help='Comma-separated calendar ids')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to sleep per HTTP request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of API calls answered with 429/503')
+    args = parser.parse_args()
+    calendar_ids = [cal_id.strip() for cal_id in args.calendars.split(',') if cal_id.strip()]
+    fake_state = FakeGoogleState(
+        synthetic_data.generate_inbox(args.messages),
+        {cal_id: synthetic_data.generate_calendar_events(cal_id, args.events, shared=len(calendar_ids) > 1) for cal_id in calendar_ids},
+    )
+    server = make_server(fake_state, args.port, args.latency, args.error_rate)
+    print(f"Fake Gmail/Calendar endpoint listening on http://127.0.0.1:{args.port}/ ({args.messages} messages)")
+    server.serve_forever()
@@ -0,0 +1,146 @@
+"""Local stand-in for the OpenAI chat completions endpoint, for offline runs.
+
+Usage:
+    python fake_openai_server.py --port 8765 --latency 0.5 --chunk-delay 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=fake python main.py
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SECTIONS = ["Key Decisions", "Action Items (Seth Benkov)", "Action Items (Others)", "Due Dates"]
+
+ITEM_NUMBER_PATTERN = re.compile(r'^\[(\d+)\]', re.MULTILINE)
+
+def fake_completion_text(messages):
+    """Builds a deterministic four-section answer that reflects the size of the request.
+
+    Per-item map prompts (system message asks for a JSON object) get a JSON answer
+    with one extract per numbered item.
+    """
+    system_content = next((m['content'] for m in messages if m['role'] == 'system'), '')
+    user_content = next((m['content'] for m in reversed(messages) if m['role'] == 'user'), '')
+    if 'JSON object' in system_content:
+        extracts = {}
+        for block in re.split(r'\n\n(?=\[\d+\])', user_content):
+            match = ITEM_NUMBER_PATTERN.match(block)
+            if match:
+                subject = next((line[len('Subject: '):] for line in block.splitlines() if line.startswith('Subject: ')), None)
+                extracts[match.group(1)] = f"Decision: {subject}" if subject else "None"
+        return json.dumps(extracts)
+
+    lines = [line for line in user_content.splitlines() if line.strip()]
+    subjects = [line[len('Subject: '):] for line in lines if line.startswith('Subject: ')]
+    parts = []
+    for section in SECTIONS:
+        parts.append(f"**{section}:**")
+        if section == "Key Decisions" and subjects:
+            parts.extend(f"- {subject}" for subject in subjects[:5])
+        else:
+            parts.append("- None identified")
+        parts.append("")
+    parts.append(f"(fake summary of {len(lines)} input lines)")
+    return "\n".join(parts)
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    # Set by make_server()
+    latency = 0.0
+    chunk_delay = 0.0
+    error_rate = 0.0
+    stats = None
+
+    def log_message(self, format, *args):
+        pass # Keep benchmark output clean
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, request_number, model, text):
+        """Answers a stream=True request as server-sent events, one chunk per line of text."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        pieces = [line + '\n' for line in text.split('\n')]
+        for index, piece in enumerate(pieces + [None]):
+            if piece is not None and index and self.chunk_delay:
+                time.sleep(self.chunk_delay)
+            chunk = {
+                'id': f'chatcmpl-fake-{request_number}',
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'delta': {'content': piece} if piece is not None else {},
+                             'finish_reason': None if piece is not None else 'stop'}],
+            }
+            try:
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                return # Client stopped reading
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        with self.stats['lock']:
+            self.stats['requests'] += 1
+            self.stats['prompt_chars'] += sum(len(m.get('content', '')) for m in request.get('messages', []))
+            request_number = self.stats['requests']
+
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': f'Unknown path {self.path}'}})
+            return
+        if self.latency:
+            time.sleep(self.latency)
+        # Deterministic injection: every (1 / error_rate)-th request fails
+        if self.error_rate and int(request_number * self.error_rate) != int((request_number - 1) * self.error_rate):
+            self._send_json(500, {'error': {'message': 'Injected server error', 'type': 'server_error'}})
+            return
+
+        text = fake_completion_text(request.get('messages', []))
+        if request.get('stream'):
+            self._send_stream(request_number, request.get('model', 'fake'), text)
+            return
+        self._send_json(200, {
+            'id': f'chatcmpl-fake-{request_number}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'fake'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+        })
+
+def make_server(port=0, latency=0.0, error_rate=0.0, chunk_delay=0.0):
+    """Creates (but does not start) a fake server; port 0 picks a free port."""
+    handler = type('Handler', (FakeOpenAIHandler,), {
+        'latency': latency,
+        'chunk_delay': chunk_delay,
+        'error_rate': error_rate,
+        'stats': {'lock': threading.Lock(), 'requests': 0, 'prompt_chars': 0},
+    })
+    return ThreadingHTTPServer(('127.0.0.1', port), handler)
+
+def start_in_background(port=0, latency=0.0, error_rate=0.0, chunk_delay=0.0):
+    """Starts a fake server in a daemon thread and returns (server, base_url)."""
+    server = make_server(port, latency, error_rate, chunk_delay)
+    threading.Thread(target=server.serve_forever, name='fake-openai', daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to sleep per request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with HTTP 500')
+    parser.add_argument('--chunk-delay', type=float, default=0.0, help='Seconds between streamed chunks (stream=True requests)')
+    args = parser.parse_args()
+    server = make_server(args.port, args.latency, args.error_rate, args.chunk_delay)
+    print(f"Fake OpenAI endpoint listening on http://127.0.0.1:{args.port}/v1")
+    server.serve_forever()
@@ -1,14 +1,285 @@
-import base64
-from googleapiclient.errors import HttpError
+from email.utils import getaddresses, parseaddr
 
+import api_scheduler
 import config
+import email_dedup
+import gmail_store
+import tracing
 import utils
 
-def get_email_snippets():
-    """Fetches recent emails from Gmail, returning a list of {'sender', 'subject'} dicts
+# Headers requested for every message; stored alongside the record in gmail_store
+METADATA_HEADERS = ['From', 'Subject', 'To', 'Cc']
+
+def _list_message_ids(service, query, limit):
+    """Lists message ids matching query, following nextPageToken until limit is reached.
+
+    Returns (message_ids, thread_ids), where thread_ids maps each message id to its threadId.
+    """
+    message_ids = []
+    thread_ids = {}
+    page_token = None
+    with tracing.span('gmail.list') as span:
+        while len(message_ids) < limit:
+            results = api_scheduler.execute(service.users().messages().list(
+                userId='me',
+                q=query,
+                maxResults=min(config.GMAIL_LIST_PAGE_SIZE, limit - len(message_ids)),
+                pageToken=page_token
+            ))
+            for message in results.get('messages', []):
+                message_ids.append(message['id'])
+                thread_ids[message['id']] = message.get('threadId')
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+        span.set('count', len(message_ids[:limit]))
+    return message_ids[:limit], thread_ids
+
+def iter_messages(service, query, page_size=None):
+    """Yields parsed message records matching query, newest first, one list page at a time.
+
+    Only one page of ids and its metadata are held at once, so arbitrarily large
+    result sets (backfills) stream in bounded memory.
+    """
+    page_token = None
+    while True:
+        with tracing.span('gmail.list') as span:
+            results = api_scheduler.execute(service.users().messages().list(
+                userId='me',
+                q=query,
+                maxResults=page_size or config.GMAIL_LIST_PAGE_SIZE,
+                pageToken=page_token
+            ))
+            messages = results.get('messages', [])
+            span.set('count', len(messages))
+        for start in range(0, len(messages), config.GMAIL_BATCH_SIZE):
+            chunk = messages[start:start + config.GMAIL_BATCH_SIZE]
+            thread_ids = {message['id']: message.get('threadId') for message in chunk}
+            for msg in _get_messages_batched(service, [message['id'] for message in chunk], thread_ids):
+                yield _parse_message(msg)
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            break
+
+def _plan_thread_fetches(message_ids, thread_ids):
+    """Picks the threads cheaper to fetch whole (one threads.get) than message by message.
+
+    Returns {thread_id: [message ids wanted from it]}.
+    """
+    if not config.GMAIL_THREAD_FETCH or not thread_ids:
+        return {}
+    by_thread = {}
+    for message_id in message_ids:
+        if thread_ids.get(message_id):
+            by_thread.setdefault(thread_ids[message_id], []).append(message_id)
+    thread_cost = config.GOOGLE_METHOD_QUOTA_UNITS['gmail.users.threads.get']
+    message_cost = config.GOOGLE_METHOD_QUOTA_UNITS['gmail.users.messages.get']
+    return {thread_id: ids for thread_id, ids in by_thread.items() if len(ids) * message_cost > thread_cost}
+
+def _is_gone(error):
+    """True for a 404: the message or thread was deleted, so fetching it again won't help."""
+    return getattr(getattr(error, 'resp', None), 'status', None) == 404
+
+def _get_messages_batched(service, message_ids, thread_ids=None, failed=None):
+    """Fetches message metadata using Gmail batch requests (up to GMAIL_BATCH_SIZE gets per round trip).
+
+    With thread_ids ({message id: threadId}), threads where several messages are wanted are
+    fetched whole with threads.get when that costs fewer quota units.
+    Returns the messages in the same order as message_ids; messages that failed are skipped.
+    failed, if given (a set), receives the ids of messages that failed for a reason other
+    than being deleted, including those still failing when the deadline ran out.
+    """
+    whole_threads = _plan_thread_fetches(message_ids, thread_ids)
+    in_whole_threads = {message_id for ids in whole_threads.values() for message_id in ids}
+    requests = {
+        message_id: service.users().messages().get(
+            userId='me',
+            id=message_id,
+            format='metadata', # Fetch specific headers and snippet
+            metadataHeaders=METADATA_HEADERS
+        )
+        for message_id in message_ids if message_id not in in_whole_threads
+    }
+    for thread_id in whole_threads:
+        requests[f"thread-{thread_id}"] = service.users().threads().get(
+            userId='me',
+            id=thread_id,
+            format='metadata',
+            metadataHeaders=METADATA_HEADERS
+        )
+    # Transient per-message failures (429/5xx) are retried by the scheduler
+    with tracing.span('gmail.get') as span:
+        fetched, errors = api_scheduler.execute_batch(service, requests)
+        for thread_id, wanted_ids in whole_threads.items():
+            thread = fetched.pop(f"thread-{thread_id}", None)
+            if thread is not None:
+                wanted = set(wanted_ids)
+                fetched.update((m['id'], m) for m in thread.get('messages', []) if m['id'] in wanted)
+        span.set('count', len(fetched))
+        span.set('threads', len(whole_threads))
+        span.set('errors', len(errors))
+
+    for request_id, exception in errors.items():
+        print(f"  - Error fetching email {request_id}: {exception}")
+        if failed is not None and not _is_gone(exception):
+            thread_id = request_id[len('thread-'):] if request_id.startswith('thread-') else None
+            failed.update(whole_threads[thread_id] if thread_id in whole_threads else [request_id])
+
+    return [fetched[message_id] for message_id in message_ids if message_id in fetched]
+
+def _parse_message(msg):
+    """Converts a metadata-format message into a record with a cleaned sender, subject and snippet."""
+    headers = {h['name']: h['value'] for h in msg.get('payload', {}).get('headers', [])}
+    subject = headers.get('Subject', 'No Subject')
+    sender = headers.get('From', 'Unknown Sender')
+    snippet = msg.get('snippet', '')
+
+    # Clean up sender format (often includes email in < >)
+    if '<' in sender:
+        sender_name = sender.split('<')[0].strip()
+        if sender_name and sender_name != '""': # Use name if available
+            sender = sender_name.replace('"', '')
+        else: # Fallback to full address if name is empty
+            sender = sender.split('<')[1].split('>')[0]
+    else:
+        sender = sender.strip()
+
+    return {
+        'id': msg['id'],
+        'thread_id': msg.get('threadId'),
+        'internal_date': int(msg.get('internalDate', 0)),
+        'sender': sender,
+        'subject': subject,
+        'snippet': snippet,
+        'label_ids': msg.get('labelIds', []),
+        'headers': headers,
+    }
+
+def _full_sync(service, conn):
+    """Rebuilds the local store from GMAIL_QUERY and records the mailbox historyId to sync from next time."""
+    print("Performing full Gmail sync...")
+    # Read the historyId before listing so nothing that arrives mid-sync is missed
+    profile = api_scheduler.execute(service.users().getProfile(userId='me'))
+    history_id = profile['historyId']
+    message_ids, thread_ids = _list_message_ids(service, config.GMAIL_QUERY, config.MAX_EMAILS_TO_PROCESS)
+    failed = set()
+    records = [_parse_message(msg) for msg in _get_messages_batched(service, message_ids, thread_ids, failed)]
+    gmail_store.clear(conn)
+    gmail_store.upsert_messages(conn, records)
+    gmail_store.set_retry_ids(conn, failed)
+    gmail_store.set_state(conn, 'history_id', history_id)
+    gmail_store.set_state(conn, 'email_address', profile['emailAddress'])
+    print(f"Full sync stored {len(records)} emails.")
+
+def _incremental_sync(service, conn, start_history_id):
+    """Applies mailbox changes since start_history_id using users.history.list.
+
+    Messages whose get failed are saved in the store and fetched again by the next sync,
+    since the new historyId checkpoint no longer covers them.
+    """
+    changed_ids = set()
+    deleted_ids = set()
+    thread_ids = {}
+    page_token = None
+    latest_history_id = start_history_id
+    with tracing.span('gmail.history') as span:
+        while True:
+            response = api_scheduler.execute(service.users().history().list(
+                userId='me',
+                startHistoryId=start_history_id,
+                historyTypes=['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved'],
+                pageToken=page_token
+            ))
+            for history in response.get('history', []):
+                for key in ('messagesAdded', 'labelsAdded', 'labelsRemoved'):
+                    for item in history.get(key, []):
+                        changed_ids.add(item['message']['id'])
+                        thread_ids[item['message']['id']] = item['message'].get('threadId')
+                deleted_ids.update(item['message']['id'] for item in history.get('messagesDeleted', []))
+            latest_history_id = response.get('historyId', latest_history_id)
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+        span.set('count', len(changed_ids | deleted_ids))
+
+    retry_ids = gmail_store.get_retry_ids(conn) - deleted_ids
+    changed_ids = (changed_ids | retry_ids) - deleted_ids
+    print(f"Incremental sync: {len(changed_ids)} new/changed ({len(retry_ids)} retried), {len(deleted_ids)} deleted emails.")
+    failed = set()
+    if changed_ids:
+        records = [_parse_message(msg) for msg in _get_messages_batched(service, sorted(changed_ids), thread_ids, failed)]
+        gmail_store.upsert_messages(conn, records)
+    if deleted_ids:
+        gmail_store.delete_messages(conn, deleted_ids)
+    if failed:
+        print(f"{len(failed)} emails could not be fetched; they will be retried on the next sync.")
+    # Saved before the checkpoint moves past them
+    gmail_store.set_retry_ids(conn, failed)
+    gmail_store.set_state(conn, 'history_id', latest_history_id)
+
+def sync_store(service, conn):
+    """Brings the local message store up to date, falling back to a full sync when needed."""
+    from googleapiclient.errors import HttpError # Loaded with the service already
+    history_id = gmail_store.get_state(conn, 'history_id')
+    if not history_id:
+        _full_sync(service, conn)
+    else:
+        try:
+            _incremental_sync(service, conn, history_id)
+        except HttpError as error:
+            # 404 means the saved historyId is too old for the history API to serve
+            if error.resp.status != 404:
+                raise
+            print("Saved Gmail historyId has expired.")
+            _full_sync(service, conn)
+    gmail_store.prune(conn, config.GMAIL_STORE_RETENTION_DAYS)
+
+def _fetch_records(service, store_file=None):
+    """Returns (recent message records, the mailbox's own address), from the synced local store
+    or straight from the API."""
+    if config.GMAIL_INCREMENTAL_SYNC:
+        conn = gmail_store.connect(store_file)
+        try:
+            sync_store(service, conn)
+            user_address = gmail_store.get_state(conn, 'email_address')
+            if not user_address:
+                # Stores synced before the address was recorded
+                user_address = api_scheduler.execute(service.users().getProfile(userId='me'))['emailAddress']
+                gmail_store.set_state(conn, 'email_address', user_address)
+            return gmail_store.recent_messages(conn, config.GMAIL_LOOKBACK_HOURS, config.MAX_EMAILS_TO_PROCESS), user_address
+        finally:
+            conn.close()
+
+    # List messages matching the query (paginated up to the processing limit)
+    user_address = api_scheduler.execute(service.users().getProfile(userId='me'))['emailAddress']
+    message_ids, thread_ids = _list_message_ids(service, config.GMAIL_QUERY, config.MAX_EMAILS_TO_PROCESS)
+    if message_ids:
+        print(f"Found {len(message_ids)} emails. Fetching details in batches...")
+    return [_parse_message(msg) for msg in _get_messages_batched(service, message_ids, thread_ids)], user_address
+
+def _recipient_type(headers, user_address):
+    """'to' if user_address is a direct recipient, 'cc' if copied, '' otherwise (lists, Bcc)."""
+    user_address = (user_address or '').lower()
+    for header, recipient_type in (('To', 'to'), ('Cc', 'cc')):
+        if any(address.lower() == user_address for _, address in getaddresses([headers.get(header, '')])):
+            return recipient_type
+    return ''
+
+def format_email_item(email, include_snippet=True):
+    """Formats one email list entry as a prompt block (Sender, Subject, count, Snippet of the newest message)."""
+    count_line = f"({email['count']} messages)\n" if email.get('count', 1) > 1 else ""
+    snippet = email.get('snippet', '') if include_snippet else ''
+    return f"From: {email['sender']}\nSubject: {email['subject']}\n{count_line}{snippet}".rstrip('\n')
+
+def get_email_snippets(token_file=None, store_file=None):
+    """Fetches recent emails from Gmail, returning a list of {'sender', 'subject', 'count', ...} dicts
        and a combined string of raw email text for AI processing.
+       token_file/store_file default to config.GOOGLE_TOKEN_FILE/config.GMAIL_STORE_FILE.
+       Errors (HTTP, missing credentials, deadline.DeadlineExceeded) are raised, so a failed
+       fetch can't be mistaken for an empty inbox.
     """
     print("\n--- Fetching Gmail Snippets ---")
+    from googleapiclient.errors import HttpError # Not at module level: it would load googleapiclient at start-up
     email_list_data = [] # List of dictionaries for the email section
     raw_email_texts = [] # For AI summarization
     try:
@@ -16,56 +287,44 @@ def get_email_snippets():
             'gmail', 'v1',
             config.GOOGLE_SCOPES,
             config.GOOGLE_CREDENTIALS_FILE,
-            config.GOOGLE_TOKEN_FILE
+            token_file or config.GOOGLE_TOKEN_FILE
         )
 
-        # List messages matching the query
-        results = service.users().messages().list(
-            userId='me',
-            q=config.GMAIL_QUERY,
-            maxResults=config.MAX_EMAILS_TO_PROCESS
-        ).execute()
-        messages = results.get('messages', [])
+        records, user_address = _fetch_records(service, store_file)
 
-        if not messages:
+        if not records:
             print("No recent emails found matching the criteria.")
             return [], "" # Return empty list and string
         else:
-            print(f"Found {len(messages)} emails. Fetching details...")
-            count = 0
-            for message_info in messages:
-                if count >= config.MAX_EMAILS_TO_PROCESS:
-                    print(f"Reached processing limit ({config.MAX_EMAILS_TO_PROCESS}).")
-                    break
-                msg = service.users().messages().get(
-                    userId='me',
-                    id=message_info['id'],
-                    format='metadata', # Fetch specific headers and snippet
-                    metadataHeaders=['From', 'Subject']
-                ).execute()
-
-                headers = msg.get('payload', {}).get('headers', [])
-                subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-                sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
-                snippet = msg.get('snippet', '')
-
-                # Clean up sender format (often includes email in < >)
-                if '<' in sender:
-                    sender_name = sender.split('<')[0].strip()
-                    if sender_name and sender_name != '""': # Use name if available
-                        sender = sender_name.replace('"', '')
-                    else: # Fallback to full address if name is empty
-                        sender = sender.split('<')[1].split('>')[0]
-                else:
-                    sender = sender.strip()
-
-                # Append dict to email_list_data
-                email_list_data.append({'sender': sender, 'subject': subject})
+            if config.EMAIL_DEDUP_ENABLED:
+                # One item per reply chain / cluster of near-identical notifications
+                items, stats = email_dedup.collapse(records)
+                print(f"Collapsed {stats['messages']} emails into {stats['items']} items "
+                      f"({stats['threads']} threads, {stats['near_duplicates']} near-duplicates merged).")
+            else:
+                items = [dict(record, message_count=1, senders=[record['sender']]) for record in records]
+
+            for item in items:
+                subject, count = item['subject'], item['message_count']
+                senders = item['senders']
+                sender = ', '.join(senders[:3]) + (f" +{len(senders) - 3}" if len(senders) > 3 else "")
+
+                # Append dict to email_list_data (the extra fields are used to rank emails for the AI prompt)
+                email_list_data.append({
+                    'sender': sender,
+                    'subject': subject,
+                    'count': count,
+                    'snippet': item['snippet'],
+                    'sender_address': parseaddr(item['headers'].get('From', ''))[1].lower(),
+                    'internal_date': item['internal_date'],
+                    'label_ids': item['label_ids'],
+                    'recipient_type': _recipient_type(item['headers'], user_address),
+                    'thread_id': item.get('thread_id'),
+                })
                 print(f"  - Processed email: {subject[:50]}...")
 
-                # Collect raw data for AI summary (Sender, Subject, Snippet)
-                raw_email_texts.append(f"From: {sender}\nSubject: {subject}\n{snippet}")
-                count += 1
+                # Collect raw data for AI summary
+                raw_email_texts.append(format_email_item(email_list_data[-1]))
 
             return email_list_data, "\n\n".join(raw_email_texts) # Return list of dicts and joined raw texts
 
@@ -75,13 +334,7 @@ def get_email_snippets():
             print("Suggestion: Ensure the Gmail API is enabled in your GCP project.")
         elif error.resp.status == 401:
             print("Suggestion: Authentication error. Try deleting token.json and re-running.")
-        return [], "" # Return empty list and string on error
-    except FileNotFoundError as fnf_error:
-        print(f"Configuration error: {fnf_error}")
-        return [], "" # Return empty list and string on error
-    except Exception as e:
-        print(f'An unexpected error occurred fetching emails: {e}')
-        return [], "" # Return empty list and string on error
+        raise
 
 if __name__ == '__main__':
     # For local testing
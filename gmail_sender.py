@@ -0,0 +1,209 @@
+import argparse
+import base64
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from html.parser import HTMLParser
+
+import api_scheduler
+import config
+import tracing
+import utils
+
+# Outbox entry states are encoded in the file suffix so claiming an entry is one atomic rename
+PENDING_SUFFIX = '.json'
+INFLIGHT_SUFFIX = '.inflight'
+
+class _TextExtractor(HTMLParser):
+    """Collects readable text from the brief's HTML for the text/plain alternative."""
+    BLOCK_TAGS = {'p', 'div', 'h1', 'h2', 'h3', 'ul', 'ol', 'br', 'tr'}
+    SKIP_TAGS = {'head', 'style', 'script', 'title'}
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag == 'li':
+            self.parts.append('\n- ')
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag in ('h1', 'h2', 'h3'):
+            self.parts.append('\n')
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.parts.append(' '.join(data.split()) if data.strip() else '')
+
+def html_to_text(html_body):
+    """Generates the plaintext alternative for an HTML brief."""
+    extractor = _TextExtractor()
+    extractor.feed(html_body)
+    lines = [line.strip() for line in ''.join(extractor.parts).splitlines()]
+    text = '\n'.join(lines)
+    while '\n\n\n' in text:
+        text = text.replace('\n\n\n', '\n\n')
+    return text.strip() + '\n'
+
+def build_raw_message(subject, html_body, recipient):
+    """Builds a multipart/alternative (plaintext + HTML) message, base64url-encoded for the Gmail API."""
+    message = MIMEMultipart('alternative')
+    message['to'] = recipient
+    message['subject'] = subject
+    # You can set 'from' if needed, otherwise it defaults to the authenticated user
+    # message['from'] = 'Your Name <your_email@example.com>'
+    # Per RFC 2046 the preferred (richest) alternative goes last
+    message.attach(MIMEText(html_to_text(html_body), 'plain', 'utf-8'))
+    message.attach(MIMEText(html_body, 'html', 'utf-8'))
+    return base64.urlsafe_b64encode(message.as_bytes()).decode()
+
+def _entry_path(entry_id, suffix, outbox_dir=None):
+    return os.path.join(outbox_dir or config.OUTBOX_DIR, entry_id + suffix)
+
+def _write_entry(entry, path):
+    utils.write_atomic(path, json.dumps(entry), fsync=True)
+
+def enqueue(subject, html_body, recipient, token_file=None, outbox_dir=None):
+    """Durably stores a message in the outbox and returns its id.
+
+    Once enqueued, a crash or quota exhaustion only requires flushing the outbox again,
+    not re-running the fetch/summarize pipeline.
+    """
+    outbox_dir = outbox_dir or config.OUTBOX_DIR
+    os.makedirs(outbox_dir, exist_ok=True)
+    entry_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    entry = {
+        'id': entry_id,
+        'created_at': time.time(),
+        'recipient': recipient,
+        'subject': subject,
+        'token_file': token_file or config.GOOGLE_TOKEN_FILE,
+        'raw': build_raw_message(subject, html_body, recipient),
+        'attempts': 0,
+        'last_error': None,
+    }
+    _write_entry(entry, _entry_path(entry_id, PENDING_SUFFIX, outbox_dir))
+    print(f"Queued email to {recipient} in outbox ({entry_id}).")
+    return entry_id
+
+def list_pending(outbox_dir=None):
+    """Returns ids of outbox entries waiting to be sent, oldest first."""
+    outbox_dir = outbox_dir or config.OUTBOX_DIR
+    if not os.path.isdir(outbox_dir):
+        return []
+    return sorted(name[:-len(PENDING_SUFFIX)] for name in os.listdir(outbox_dir) if name.endswith(PENDING_SUFFIX))
+
+def _reclaim_stale_inflight(outbox_dir):
+    """Returns entries left in flight by a crashed process to the pending state."""
+    now = time.time()
+    for name in os.listdir(outbox_dir):
+        if not name.endswith(INFLIGHT_SUFFIX):
+            continue
+        path = os.path.join(outbox_dir, name)
+        try:
+            if now - os.path.getmtime(path) > config.OUTBOX_INFLIGHT_TIMEOUT_SECONDS:
+                os.replace(path, path[:-len(INFLIGHT_SUFFIX)] + PENDING_SUFFIX)
+                print(f"Reclaimed stale in-flight outbox entry {name}.")
+        except OSError:
+            pass # Another process got there first
+
+def _send_entry(entry_id, outbox_dir):
+    """Claims and sends one outbox entry. Returns 'sent', 'pending' (retry later) or 'failed'."""
+    pending_path = _entry_path(entry_id, PENDING_SUFFIX, outbox_dir)
+    inflight_path = _entry_path(entry_id, INFLIGHT_SUFFIX, outbox_dir)
+    try:
+        # Stamp the claim time first: the in-flight file keeps this mtime, and
+        # _reclaim_stale_inflight must not mistake an old queued entry for an orphaned claim
+        os.utime(pending_path)
+        os.replace(pending_path, inflight_path) # Atomic claim; fails if another sender took it
+    except OSError:
+        return 'claimed'
+
+    with open(inflight_path, 'r', encoding='utf-8') as f:
+        entry = json.load(f)
+    entry['attempts'] += 1
+    with tracing.span('send', count=1, bytes=len(entry['raw'])):
+        return _deliver_entry(entry, pending_path, inflight_path, outbox_dir)
+
+def _deliver_entry(entry, pending_path, inflight_path, outbox_dir):
+    entry_id = entry['id']
+    try:
+        service = utils.get_google_service(
+            'gmail', 'v1',
+            config.GOOGLE_SCOPES,
+            config.GOOGLE_CREDENTIALS_FILE,
+            entry['token_file']
+        )
+        # Paced within quota and retried on transient errors by the scheduler
+        sent = api_scheduler.execute(service.users().messages().send(userId="me", body={'raw': entry['raw']}))
+        os.remove(inflight_path)
+        print(f"Email sent successfully to {entry['recipient']}. Message ID: {sent['id']}")
+        return 'sent'
+    except Exception as error:
+        from googleapiclient.errors import HttpError # Only needed once a send has failed
+        entry['last_error'] = str(error)
+        print(f"An error occurred sending email to {entry['recipient']}: {error}")
+        if isinstance(error, HttpError) and error.resp is not None:
+            if error.resp.status == 401:
+                print("Suggestion: Authentication error. Ensure 'gmail.send' scope was granted. Try deleting token.json and re-running.")
+            elif error.resp.status == 403:
+                print("Suggestion: Ensure Gmail API is enabled and you have permission to send.")
+
+        permanent = not api_scheduler.is_retryable(error) and isinstance(error, HttpError)
+        if permanent or entry['attempts'] >= config.OUTBOX_MAX_ATTEMPTS:
+            failed_dir = os.path.join(outbox_dir, 'failed')
+            os.makedirs(failed_dir, exist_ok=True)
+            _write_entry(entry, os.path.join(failed_dir, entry_id + PENDING_SUFFIX))
+            os.remove(inflight_path)
+            print(f"Moved outbox entry {entry_id} to {failed_dir}.")
+            return 'failed'
+        # Transient (e.g. quota exhausted): keep it for the next flush
+        _write_entry(entry, pending_path)
+        os.remove(inflight_path)
+        return 'pending'
+
+def flush_outbox(entry_ids=None, max_workers=None, outbox_dir=None):
+    """Sends pending outbox entries concurrently (all of them, or just entry_ids).
+
+    Returns {'sent': [...], 'pending': [...], 'failed': [...]} lists of entry ids.
+    """
+    outbox_dir = outbox_dir or config.OUTBOX_DIR
+    results = {'sent': [], 'pending': [], 'failed': []}
+    if not os.path.isdir(outbox_dir):
+        return results
+    _reclaim_stale_inflight(outbox_dir)
+    entry_ids = list_pending(outbox_dir) if entry_ids is None else list(entry_ids)
+    if not entry_ids:
+        return results
+
+    print(f"\n--- Sending {len(entry_ids)} queued email(s) via Gmail API ---")
+    with ThreadPoolExecutor(max_workers=max_workers or config.SEND_MAX_WORKERS) as executor:
+        for entry_id, status in zip(entry_ids, executor.map(tracing.propagate(lambda e: _send_entry(e, outbox_dir)), entry_ids)):
+            if status in results:
+                results[status].append(entry_id)
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Send (or list) emails waiting in the outbox.")
+    parser.add_argument('--list', action='store_true', help="List pending entries without sending")
+    args = parser.parse_args()
+
+    if args.list:
+        for pending_id in list_pending():
+            print(pending_id)
+    else:
+        outcome = flush_outbox()
+        print(f"Sent: {len(outcome['sent'])}, still pending: {len(outcome['pending'])}, failed: {len(outcome['failed'])}")
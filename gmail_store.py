@@ -0,0 +1,102 @@
+import json
+import sqlite3
+import time
+
+import config
+
+def connect(db_file=None):
+    """Opens (and creates if needed) the local SQLite store of Gmail message metadata."""
+    conn = sqlite3.connect(db_file or config.GMAIL_STORE_FILE)
+    conn.row_factory = sqlite3.Row
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS messages (
+            id TEXT PRIMARY KEY,
+            thread_id TEXT,
+            internal_date INTEGER,
+            sender TEXT,
+            subject TEXT,
+            snippet TEXT,
+            label_ids TEXT,
+            headers TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_messages_internal_date ON messages (internal_date);
+        CREATE TABLE IF NOT EXISTS sync_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """)
+    return conn
+
+def get_state(conn, key):
+    """Returns a saved sync value (e.g. the last historyId), or None."""
+    row = conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+    return row['value'] if row else None
+
+def set_state(conn, key, value):
+    """Saves a sync value."""
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, str(value)))
+
+def get_retry_ids(conn):
+    """Returns the ids of messages whose fetch failed during an earlier sync."""
+    return set(json.loads(get_state(conn, 'retry_ids') or '[]'))
+
+def set_retry_ids(conn, message_ids):
+    """Saves the ids of messages to fetch again on the next sync."""
+    set_state(conn, 'retry_ids', json.dumps(sorted(message_ids)))
+
+def upsert_messages(conn, records):
+    """Inserts or updates message records produced by gmail_fetcher._parse_message()."""
+    with conn:
+        conn.executemany(
+            """INSERT OR REPLACE INTO messages
+               (id, thread_id, internal_date, sender, subject, snippet, label_ids, headers)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+            [(r['id'], r['thread_id'], r['internal_date'], r['sender'], r['subject'], r['snippet'],
+              json.dumps(r['label_ids']), json.dumps(r['headers'])) for r in records]
+        )
+
+def delete_messages(conn, message_ids):
+    """Removes messages that were deleted from the mailbox."""
+    with conn:
+        conn.executemany("DELETE FROM messages WHERE id = ?", [(m,) for m in message_ids])
+
+def clear(conn):
+    """Drops all stored messages and sync state (used before a full resync)."""
+    with conn:
+        conn.execute("DELETE FROM messages")
+        conn.execute("DELETE FROM sync_state")
+
+def prune(conn, retention_days):
+    """Deletes messages older than the retention window so the store stays small."""
+    cutoff_ms = int((time.time() - retention_days * 86400) * 1000)
+    with conn:
+        conn.execute("DELETE FROM messages WHERE internal_date < ?", (cutoff_ms,))
+
+def recent_messages(conn, lookback_hours, limit, required_label='INBOX', excluded_labels=('TRASH', 'SPAM')):
+    """Returns the newest stored messages within the lookback window, newest first."""
+    since_ms = int((time.time() - lookback_hours * 3600) * 1000)
+    rows = conn.execute(
+        "SELECT * FROM messages WHERE internal_date >= ? ORDER BY internal_date DESC",
+        (since_ms,)
+    )
+    records = []
+    for row in rows:
+        label_ids = json.loads(row['label_ids'] or '[]')
+        if required_label and required_label not in label_ids:
+            continue
+        if any(label in label_ids for label in excluded_labels):
+            continue
+        records.append({
+            'id': row['id'],
+            'thread_id': row['thread_id'],
+            'internal_date': row['internal_date'],
+            'sender': row['sender'],
+            'subject': row['subject'],
+            'snippet': row['snippet'],
+            'label_ids': label_ids,
+            'headers': json.loads(row['headers'] or '{}'),
+        })
+        if len(records) >= limit:
+            break
+    return records
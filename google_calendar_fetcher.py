@@ -1,12 +1,25 @@
-from datetime import datetime
-import pytz
+import heapq
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
 
-from googleapiclient.errors import HttpError
 
+import api_scheduler
 import config
+import tracing
 import utils
 
-def format_event_time(event_time_data):
+def _resolve_target_timezone():
+    """Resolves config.TARGET_TIMEZONE once, falling back to UTC."""
+    import pytz
+    try:
+        return pytz.timezone(config.TARGET_TIMEZONE)
+    except pytz.UnknownTimeZoneError:
+        print(f"Error: Unknown timezone '{config.TARGET_TIMEZONE}'. Using UTC.")
+        return pytz.utc
+
+def format_event_time(event_time_data, target_tz=None):
     """Formats Google Calendar event time data into a readable string."""
     # Check for date field (all-day events) first
     if event_time_data.get('date'):
@@ -16,7 +29,8 @@ def format_event_time(event_time_data):
         dt_str = event_time_data['dateTime']
         dt_utc = datetime.fromisoformat(dt_str)
         try:
-            target_tz = pytz.timezone(config.TARGET_TIMEZONE)
+            if target_tz is None:
+                target_tz = _resolve_target_timezone()
             dt_local = dt_utc.astimezone(target_tz)
             # Format as HH:MM AM/PM (e.g., 09:30 AM)
             return dt_local.strftime('%I:%M %p')
@@ -26,52 +40,204 @@ def format_event_time(event_time_data):
     else:
         return "Time N/A" # Should not happen often
 
-def get_calendar_events():
-    """Fetches today's events from Google Calendar."""
-    print("\n--- Fetching Google Calendar Events ---")
+def _event_datetime(event_time_data, target_tz):
+    """Returns an aware datetime for an event start/end (all-day dates become local midnight)."""
+    if event_time_data.get('dateTime'):
+        return datetime.fromisoformat(event_time_data['dateTime'])
+    if event_time_data.get('date'):
+        day = datetime.strptime(event_time_data['date'], '%Y-%m-%d').date()
+        return target_tz.localize(datetime.combine(day, time.min))
+    return None
+
+def get_calendar_ids():
+    """Returns the calendars to include, from the CALENDAR_IDS environment variable or config."""
+    env_value = os.getenv(config.CALENDAR_IDS_ENV_VAR)
+    if env_value:
+        return [cal_id.strip() for cal_id in env_value.split(',') if cal_id.strip()]
+    return list(config.CALENDAR_IDS)
+
+def _load_cache(cache_file):
+    if not os.path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Warning: could not read calendar cache ({e}). Performing full sync.")
+        return {}
+
+def _save_cache(cache, cache_file):
     try:
-        service = utils.get_google_service(
-            'calendar', 'v3',
-            config.GOOGLE_SCOPES,
-            config.GOOGLE_CREDENTIALS_FILE,
-            config.GOOGLE_TOKEN_FILE
+        utils.write_atomic(cache_file, json.dumps(cache))
+    except OSError as e:
+        print(f"Warning: could not save calendar cache: {e}")
+
+def _minimal_event(event):
+    """Keeps only the fields the brief needs, so the cache stays small."""
+    return {
+        'id': event['id'],
+        'iCalUID': event.get('iCalUID'),
+        'summary': event.get('summary', 'No Title'),
+        'start': event.get('start', {}),
+        'end': event.get('end', {}),
+    }
+
+def _list_events(service, **params):
+    """Runs a paginated events().list call, returning (items, nextSyncToken)."""
+    items = []
+    page_token = None
+    with tracing.span('calendar.list', calendar=params.get('calendarId'), incremental='syncToken' in params) as span:
+        while True:
+            response = api_scheduler.execute(service.events().list(pageToken=page_token, **params))
+            items.extend(response.get('items', []))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                span.set('count', len(items))
+                return items, response.get('nextSyncToken')
+
+def _full_sync(service, calendar_id, window_start, window_end):
+    print(f"Performing full calendar sync for {calendar_id}...")
+    items, sync_token = _list_events(
+        service,
+        calendarId=calendar_id,
+        timeMin=window_start.isoformat(),
+        timeMax=window_end.isoformat(),
+        singleEvents=True, # Expand recurring events
+    )
+    events = {e['id']: _minimal_event(e) for e in items if e.get('status') != 'cancelled'}
+    return {'sync_token': sync_token, 'window_end': window_end.isoformat(), 'events': events}
+
+def _sync_calendar(service, calendar_id, entry, window_start, window_end):
+    """Brings one calendar's cache entry up to date using its syncToken."""
+    from googleapiclient.errors import HttpError # Loaded with the service already
+    if not entry or not entry.get('sync_token') or datetime.fromisoformat(entry['window_end']) < window_start + timedelta(days=1):
+        return _full_sync(service, calendar_id, window_start, window_end)
+    try:
+        items, sync_token = _list_events(
+            service,
+            calendarId=calendar_id,
+            syncToken=entry['sync_token'],
+            singleEvents=True,
         )
+    except HttpError as error:
+        # 410 Gone: the sync token was invalidated by the server
+        if error.resp.status != 410:
+            raise
+        print(f"Calendar sync token expired for {calendar_id}.")
+        return _full_sync(service, calendar_id, window_start, window_end)
 
-        time_min_iso, time_max_iso = utils.get_localized_time_range(config.TARGET_TIMEZONE)
+    events = entry['events']
+    for event in items:
+        if event.get('status') == 'cancelled':
+            events.pop(event['id'], None)
+        else:
+            events[event['id']] = _minimal_event(event)
+    print(f"Incremental calendar sync for {calendar_id}: {len(items)} changed events.")
+    entry['sync_token'] = sync_token or entry['sync_token']
+    return entry
 
-        print(f"Fetching events from {time_min_iso} to {time_max_iso}")
+def _fetch_calendar(calendar_id, entry, day_start, day_end, target_tz, token_file):
+    """Fetches one calendar and returns (cache_entry, today's events sorted by start)."""
+    service = utils.get_google_service(
+        'calendar', 'v3',
+        config.GOOGLE_SCOPES,
+        config.GOOGLE_CREDENTIALS_FILE,
+        token_file
+    )
 
-        events_result = service.events().list(
-            calendarId='primary', # Use the primary calendar
-            timeMin=time_min_iso,
-            timeMax=time_max_iso,
+    if config.CALENDAR_INCREMENTAL_SYNC:
+        window_end = day_start + timedelta(days=config.CALENDAR_SYNC_WINDOW_DAYS)
+        entry = _sync_calendar(service, calendar_id, entry, day_start, window_end)
+        candidates = entry['events'].values()
+    else:
+        candidates, _ = _list_events(
+            service,
+            calendarId=calendar_id,
+            timeMin=day_start.isoformat(),
+            timeMax=day_end.isoformat(),
             singleEvents=True, # Expand recurring events
-            orderBy='startTime'
-        ).execute()
+        )
+        candidates = [e for e in candidates if e.get('status') != 'cancelled']
+
+    todays_events = []
+    for event in candidates:
+        start = _event_datetime(event.get('start', {}), target_tz)
+        end = _event_datetime(event.get('end', {}), target_tz) or start
+        if start is None or start >= day_end or end <= day_start:
+            continue
+        todays_events.append((start, event))
+    todays_events.sort(key=lambda item: item[0])
+    return entry, todays_events
+
+def get_calendar_events(calendar_ids=None, token_file=None, cache_file=None):
+    """Fetches today's events from all configured Google Calendars.
+
+    Arguments default to get_calendar_ids(), config.GOOGLE_TOKEN_FILE and config.CALENDAR_CACHE_FILE.
+    """
+    print("\n--- Fetching Google Calendar Events ---")
+    from googleapiclient.errors import HttpError # Not at module level: it would load googleapiclient at start-up
+    try:
+        target_tz = _resolve_target_timezone()
+        now_local = datetime.now(target_tz)
+        day_start = target_tz.localize(datetime.combine(now_local.date(), time.min))
+        day_end = day_start + timedelta(days=1)
+        calendar_ids = calendar_ids or get_calendar_ids()
+        token_file = token_file or config.GOOGLE_TOKEN_FILE
+        cache_file = cache_file or config.CALENDAR_CACHE_FILE
 
-        events = events_result.get('items', [])
+        print(f"Fetching events from {day_start.isoformat()} to {day_end.isoformat()} for {len(calendar_ids)} calendar(s)")
+
+        cache = _load_cache(cache_file) if config.CALENDAR_INCREMENTAL_SYNC else {}
+        per_calendar = []
+        errors = []
+        with ThreadPoolExecutor(max_workers=max(1, min(len(calendar_ids), config.CALENDAR_MAX_WORKERS))) as executor:
+            futures = {
+                calendar_id: executor.submit(tracing.propagate(_fetch_calendar), calendar_id, cache.get(calendar_id), day_start, day_end, target_tz, token_file)
+                for calendar_id in calendar_ids
+            }
+            for calendar_id, future in futures.items():
+                try:
+                    cache[calendar_id], events = future.result()
+                    per_calendar.append(events)
+                except HttpError as error:
+                    print(f'An HTTP error occurred fetching calendar {calendar_id}: {error}')
+                    if error.resp.status == 403:
+                        print("Suggestion: Ensure the Google Calendar API is enabled in your GCP project.")
+                    elif error.resp.status == 401:
+                        print("Suggestion: Authentication error. Try deleting token.json and re-running.")
+                    errors.append(error)
+                except FileNotFoundError:
+                    raise
+                except Exception as e:
+                    print(f'An unexpected error occurred fetching calendar {calendar_id}: {e}')
+                    errors.append(e)
+
+        if config.CALENDAR_INCREMENTAL_SYNC:
+            _save_cache({cal_id: entry for cal_id, entry in cache.items() if cal_id in calendar_ids and entry}, cache_file)
+
+        if errors and not per_calendar:
+            return ["Error fetching calendar events."]
+
+        # Each calendar's list is already sorted, so merge instead of re-sorting everything
         formatted_events = []
+        seen = set()
+        for start, event in heapq.merge(*per_calendar, key=lambda item: item[0]):
+            # The same meeting shows up on every calendar it was shared to
+            dedupe_key = (event.get('iCalUID') or event['id'], start)
+            if dedupe_key in seen:
+                continue
+            seen.add(dedupe_key)
+            start_time_str = format_event_time(event['start'], target_tz)
+            summary = event.get('summary', 'No Title')
+            print(f"  - {start_time_str} - {summary}")
+            formatted_events.append({'time': start_time_str, 'name': summary, 'id': event['id']})
 
-        if not events:
+        if not formatted_events:
             print("No upcoming events found for today.")
             return ["No meetings scheduled for today."]
-        else:
-            print(f"Found {len(events)} events:")
-            for event in events:
-                start_time_str = format_event_time(event['start'])
-                summary = event.get('summary', 'No Title')
-                formatted_event = f"{start_time_str} - {summary}"
-                print(f"  - {formatted_event}")
-                formatted_events.append({'time': start_time_str, 'name': summary})
-            return formatted_events
+        print(f"Found {len(formatted_events)} events.")
+        return formatted_events
 
-    except HttpError as error:
-        print(f'An HTTP error occurred fetching calendar events: {error}')
-        if error.resp.status == 403:
-             print("Suggestion: Ensure the Google Calendar API is enabled in your GCP project.")
-        elif error.resp.status == 401:
-            print("Suggestion: Authentication error. Try deleting token.json and re-running.")
-        return ["Error fetching calendar events."]
     except FileNotFoundError as fnf_error:
         print(f"Configuration error: {fnf_error}")
         return ["Error: Credentials file missing."]
@@ -84,4 +250,4 @@ if __name__ == '__main__':
     todays_events = get_calendar_events()
     print("\nFormatted Events:")
     for event_dict in todays_events:
-        print(f"{event_dict['time']} - {event_dict['name']}") 
\ No newline at end of file
+        print(f"{event_dict['time']} - {event_dict['name']}")
@@ -1,172 +1,399 @@
+import argparse
 import time
 import os
-import base64
-from email.mime.text import MIMEText
-from googleapiclient.errors import HttpError
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 from dotenv import load_dotenv
-from openai import OpenAI, OpenAIError
 
 # Import fetcher and composer functions
+import ai_summarizer
+import brief_archive
+import deadline
 import google_calendar_fetcher
 import gmail_fetcher
+import gmail_sender
 import onenote_parser
+import zoom_parser
+import prompt_builder
 import email_composer
+import section_cache
+import summary_cache
+import tracing
 import config
-import utils # Import utils for google service
-
-
-def get_ai_summary(text_to_summarize):
-    """Summarizes the provided text using the OpenAI ChatCompletion API."""
-    print("\n--- Calling OpenAI for Summarization ---")
-    if not text_to_summarize or text_to_summarize.strip() == "":
-        print("No text provided for AI summary.")
-        return "No email or meeting content available to summarize."
-
-    # Load API key and initialize client
-    api_key = os.getenv(config.OPENAI_API_KEY_ENV_VAR)
-    if not api_key:
-        print(f"Error: {config.OPENAI_API_KEY_ENV_VAR} not found in environment variables.")
-        return "Error: OpenAI API key not configured."
-    client = OpenAI(api_key=api_key)
-
-    # Prepare chat messages
-    system_message = ("You are a highly efficient executive assistant. Your task is to analyze the provided text, which includes emails, meeting notes (from Zoom), and personal task notes (from OneNote). "
-                      "Consolidate this information and extract ONLY the following:\n\n"
-                      "1. Key Decisions: List any significant decisions explicitly mentioned.\n\n"
-                      "2. Action Items (Seth Benkov): List all action items assigned specifically to Seth Benkov. Include any mentioned due dates.\n\n"
-                      "3. Action Items (Others): List action items assigned to Kevin or Trent that have upcoming due dates (e.g., today, tomorrow, this week). Be specific about who is responsible.\n\n"
-                      "4. Due Dates: List any other major deadlines or due dates mentioned.\n\n"
-                      "Format the output clearly with headings for each section. If no information is found for a section, state 'None identified'. Be concise and focus only on these points.")
-
-    user_message = f"Analyze the following content from yesterday and today:\n\n{text_to_summarize}"
-
-    messages = [
-        {"role": "system", "content": system_message},
-        {"role": "user", "content": user_message}
-    ]
 
-    try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            max_tokens=1000, # Increased token limit
-            temperature=0.5
-        )
-        summary = response.choices[0].message.content.strip()
-        print("OpenAI Summary generated successfully.")
-        return summary
-    except OpenAIError as e:
-        print(f"OpenAI API Error: {e}")
-        return f"Error: OpenAI API error: {e}"
-    except Exception as e:
-        print(f"Unexpected error in OpenAI summarization: {e}")
-        return f"Error generating AI summary: {e}"
+# Data sources that can be selected with --only; 'ai' can be skipped with --no-ai
+SOURCES = ('calendar', 'gmail', 'onenote', 'zoom')
+# Sources that feed the AI summary (it is skipped when none of them is selected)
+AI_SOURCES = ('gmail', 'onenote', 'zoom')
 
-def send_gmail(subject, html_body, recipient):
-    """Sends an email using the Gmail API."""
-    print("\n--- Sending Email via Gmail API ---")
+def send_gmail(subject, html_body, recipient, token_file=None, flush=True):
+    """Queues an email in the durable outbox and (by default) sends it via the Gmail API.
+
+    Returns the outbox entry id when flush=False, otherwise True if Gmail accepted the message.
+    A message that could not be sent stays in the outbox for the next flush.
+    """
     if not recipient:
         print("Error: Recipient email address not configured.")
         return False
-        
+
     try:
-        # Get Gmail service (ensure correct scopes including send)
-        service = utils.get_google_service(
-            'gmail', 'v1',
-            config.GOOGLE_SCOPES,
-            config.GOOGLE_CREDENTIALS_FILE,
-            config.GOOGLE_TOKEN_FILE
-        )
-
-        # Create the email message
-        message = MIMEText(html_body, 'html')
-        message['to'] = recipient
-        message['subject'] = subject
-        # You can set 'from' if needed, otherwise it defaults to the authenticated user
-        # message['from'] = 'Your Name <your_email@example.com>' 
-
-        # Encode the message in base64url format
-        raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
-        create_message = {'raw': raw_message}
-
-        # Send the email
-        send_message = (service.users().messages().send(userId="me", body=create_message)
-                       .execute())
-        print(f"Email sent successfully to {recipient}. Message ID: {send_message['id']}")
-        return True
-
-    except HttpError as error:
-        print(f'An HTTP error occurred sending email: {error}')
-        if error.resp.status == 401:
-            print("Suggestion: Authentication error. Ensure 'gmail.send' scope was granted. Try deleting token.json and re-running.")
-        elif error.resp.status == 403:
-             print("Suggestion: Ensure Gmail API is enabled and you have permission to send.")
-        return False
+        entry_id = gmail_sender.enqueue(subject, html_body, recipient, token_file or config.GOOGLE_TOKEN_FILE)
     except Exception as e:
-        print(f'An unexpected error occurred sending email: {e}')
+        print(f'An unexpected error occurred queueing email: {e}')
         return False
+    if not flush:
+        return entry_id
+    return entry_id in gmail_sender.flush_outbox([entry_id])['sent']
 
 
-def main():
-    """Runs the full data fetching, AI summarization, composition, and sending process locally."""
-    start_time = time.time()
-    print("Starting Daily Brief generation process...")
-    
-    # Load environment variables from .env file
-    load_dotenv() 
+def _start_fetch(name, fetch_func):
+    """Runs fetch_func in a daemon thread and returns a Future for its result."""
+    # Daemon threads (not a ThreadPoolExecutor) so a hung fetch can't keep the process alive
+    future = Future()
+
+    def runner():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            with tracing.span(f"fetch.{name}"):
+                result = fetch_func()
+            future.set_result(result)
+        except BaseException as e:
+            future.set_exception(e)
+
+    runner = tracing.propagate(runner) # Spans from the fetch nest under the current brief
+    threading.Thread(target=runner, name=f"fetch-{name}", daemon=True).start()
+    return future
+
+def default_user():
+    """Builds the single-user profile from .env / config (used when not running for a team)."""
+    return {
+        'name': 'default',
+        'token_file': config.GOOGLE_TOKEN_FILE,
+        'recipient': os.getenv(config.RECIPIENT_EMAIL_ENV_VAR),
+        'onenote_export_folder': os.getenv(config.ONENOTE_EXPORT_FOLDER_ENV_VAR),
+        'zoom_summary_folder': os.getenv(config.ZOOM_SUMMARY_FOLDER_ENV_VAR),
+        'calendars': google_calendar_fetcher.get_calendar_ids(),
+        'cache_dir': '',
+        'output_file': config.LOCAL_OUTPUT_HTML_FILE,
+    }
+
+def fetch_all_sources(user, sections=SOURCES, stale=None):
+    """Runs the calendar, Gmail, OneNote and Zoom fetchers concurrently with a timeout per source.
+
+    Timeouts are also capped by the current deadline stage. A source that fails, returns an
+    error placeholder or times out is replaced by its last good result (see section_cache);
+    stale, if given, receives {source: time that result was fetched} for those. Without one,
+    it gets the placeholder its fetcher returns on error, so the section renders as degraded
+    instead of stalling the brief. Sources not listed in sections are not fetched (their
+    clients are never imported) and get an empty result.
+    """
+    cache_dir = user.get('cache_dir', '')
+    section_cache_file = os.path.join(cache_dir, config.SECTION_CACHE_FILE)
+    sources = {
+        'calendar': (lambda: google_calendar_fetcher.get_calendar_events(
+                         calendar_ids=user.get('calendars'),
+                         token_file=user['token_file'],
+                         cache_file=os.path.join(cache_dir, config.CALENDAR_CACHE_FILE)),
+                     ["Error fetching calendar events."]),
+        'gmail': (lambda: gmail_fetcher.get_email_snippets(
+                      token_file=user['token_file'],
+                      store_file=os.path.join(cache_dir, config.GMAIL_STORE_FILE)),
+                  ([], "")),
+        'onenote': (lambda: onenote_parser.get_onenote_tasks_from_export(
+                        user.get('onenote_export_folder'),
+                        index_file=os.path.join(cache_dir, config.ONENOTE_TASK_INDEX_FILE),
+                        cache_file=os.path.join(cache_dir, config.ONENOTE_CACHE_FILE)),
+                    ["Error: OneNote export could not be read in time."]),
+        'zoom': (lambda: zoom_parser.get_zoom_recaps(
+                     user.get('zoom_summary_folder'),
+                     index_file=os.path.join(cache_dir, config.ZOOM_INDEX_FILE)),
+                 ["Error: Zoom recaps could not be read in time."]),
+    }
+
+    skipped = {'calendar': [], 'gmail': ([], ""), 'onenote': [], 'zoom': []}
+    results = {name: skipped[name] for name in sources if name not in sections}
+
+    stage_start = time.time()
+    futures = {name: _start_fetch(name, fetch_func) for name, (fetch_func, _) in sources.items() if name in sections}
+
+    fresh = {}
+    for name, future in futures.items():
+        result = sources[name][1] # Placeholder unless the fetcher returns its own
+        # All sources started together, so each timeout is measured from the stage start
+        timeout = config.FETCH_TIMEOUT_SECONDS.get(name, 60)
+        remaining = deadline.cap(max(0.0, stage_start + timeout - time.time()))
+        try:
+            result = future.result(timeout=remaining)
+            if not section_cache.is_error(name, result):
+                results[name] = fresh[name] = result
+                continue
+        except deadline.DeadlineExceeded as e: # A TimeoutError too, so caught before FutureTimeoutError
+            print(f"Warning: {name} fetch stopped: {e}.")
+        except FutureTimeoutError:
+            print(f"Warning: {name} fetch did not finish within {time.time() - stage_start:.0f}s.")
+        except Exception as e:
+            print(f"Error: {name} fetch failed: {e}")
+
+        cached = section_cache.last_good(section_cache_file, name)
+        if cached is None:
+            print(f"No recent {name} result to fall back to. Rendering section as unavailable.")
+            results[name] = result
+            continue
+        results[name], saved_at = cached
+        if stale is not None:
+            stale[name] = saved_at
+        print(f"Using the last good {name} result, from {time.strftime('%H:%M', time.localtime(saved_at))}.")
+
+    section_cache.save(section_cache_file, fresh)
+    print(f"Fetch stage finished in {time.time() - stage_start:.2f} seconds.")
+    return results
+
+
+def run_brief(user, send=True, flush=True, sections=SOURCES, use_ai=True, new_only=None):
+    """Runs fetch, AI summarization, composition and sending for one user profile.
+
+    With flush=False the brief is only queued in the outbox (its id is returned as
+    'outbox_id') so a caller can send many briefs together. sections limits the sources
+    fetched and use_ai=False skips summarization; skipped parts render as not included.
+    new_only limits the AI input to items new or changed since the last brief (default:
+    config.ARCHIVE_AI_NEW_ONLY).
+    Returns a result dict ({'name', 'ok', 'sent', 'outbox_id', 'elapsed', 'error'}) for summaries.
+    Per-stage timings are written to the user's trace file and Prometheus textfile.
+    Stages run within slices of config.BRIEF_DEADLINE_SECONDS (see deadline.py).
+    """
+    with tracing.span('brief', user=user['name']) as root, deadline.budget():
+        start_time = time.time()
+        brief = prepare_brief(user, sections, use_ai, new_only)
+        result = deliver_brief(user, brief, send, flush)
+        result['elapsed'] = time.time() - start_time
+        root.set('error', result['error'])
+    if config.TRACE_ENABLED:
+        tracing.export(root, user['name'], trace_file=os.path.join(user.get('cache_dir', ''), config.TRACE_FILE))
+    return result
+
+def build_ai_input(fetched, item_status=None):
+    """Builds the summarizer input from fetched emails, OneNote tasks and Zoom recaps within the prompt token budget.
+
+    With item_status (from brief_archive.diff), only new and changed items are included.
+    Returns (text, stats); see prompt_builder.build_prompt.
+    """
+    inputs = {'gmail': fetched['gmail'][0], 'onenote': fetched['onenote'], 'zoom': fetched['zoom']}
+    carried_over = 0
+    if item_status:
+        for name, entries in inputs.items():
+            kept = [entry for entry, status in zip(entries, item_status[name]) if status]
+            carried_over += len(entries) - len(kept)
+            inputs[name] = kept
+    text, stats = prompt_builder.build_prompt(inputs['gmail'], inputs['onenote'], inputs['zoom'])
+    stats['carried_over'] = carried_over
+    return text, stats
+
+def _archive_file(user):
+    return os.path.join(user.get('cache_dir', ''), config.BRIEF_ARCHIVE_FILE)
+
+def diff_against_archive(user, fetched):
+    """Returns (archive items, item statuses) for the fetched sources; statuses are None
+    when there is no earlier brief (or the archive can't be read)."""
+    items = brief_archive.collect_items(fetched['calendar'], fetched['gmail'][0], fetched['onenote'], fetched['zoom'])
+    try:
+        conn = brief_archive.connect(_archive_file(user))
+        try:
+            previous = brief_archive.last_brief_fingerprints(conn, user['name'])
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"Warning: could not read the brief archive: {e}")
+        previous = {}
+    if not previous:
+        return items, None
+    item_status = brief_archive.diff(items, previous)
+    changed = sum(1 for statuses in item_status.values() for status in statuses if status)
+    print(f"{changed} items are new or changed since the last brief.")
+    return items, item_status
+
+def archive_delivered_brief(user, brief):
+    """Stores a delivered brief's items and AI summary in the user's archive."""
+    summary = brief['ai_summary']
+    if summary is not None and not isinstance(summary, str):
+        summary = summary.rendered # SummaryStream: the text that went into the email
+    try:
+        conn = brief_archive.connect(_archive_file(user))
+        try:
+            brief_archive.archive_brief(conn, user['name'], brief['archive_items'], summary, brief.get('item_status'))
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"Warning: could not archive the brief: {e}")
+
+def summary_or_last_good(section_cache_file, summary):
+    """Returns (summary, None) after saving a complete summary as the last good one.
+
+    For an error placeholder, returns (the last good summary, the time it was generated)
+    instead, so the brief shows it marked as stale; the placeholder if there is none.
+    """
+    if not section_cache.is_error('ai', summary):
+        section_cache.save(section_cache_file, {'ai': summary}) # Skips summaries cut off by the deadline
+        return summary, None
+    cached = section_cache.last_good(section_cache_file, 'ai')
+    if cached is None:
+        print("No recent AI summary to fall back to.")
+        return summary, None
+    summary, saved_at = cached
+    print(f"Using the last good AI summary, from {time.strftime('%H:%M', time.localtime(saved_at))}.")
+    return summary, time.strftime('%a %I:%M %p', time.localtime(saved_at))
+
+def prepare_brief(user, sections=SOURCES, use_ai=True, new_only=None):
+    """Fetches the selected sources, diffs them against the last archived brief and summarizes them.
+
+    Returns the brief's content (the compose_email arguments plus 'archive_items'), ready for deliver_brief.
+    Fetch and summarization run as the 'fetch' and 'summarize' stages of the current deadline budget.
+    A failed source or summary is replaced by its last good result (see section_cache).
+    """
+    skipped_sections = [name for name in SOURCES if name not in sections]
+    # Only emails, tasks and meeting recaps feed the summary
+    use_ai = use_ai and any(name in sections for name in AI_SOURCES)
+    if not use_ai:
+        skipped_sections.append('ai')
 
     # --- Fetch Data ---
     print("\n--- Fetching Data ---")
     # Note: The first time running may trigger browser-based auth flows
-    todays_events = google_calendar_fetcher.get_calendar_events()
-    email_list, raw_email_text = gmail_fetcher.get_email_snippets()
-    # Zoom parser was removed; ensure you handle meeting summaries separately if needed
-    onenote_tasks = onenote_parser.get_onenote_tasks_from_export()
-
-    # Combine raw text for AI, including OneNote tasks
-    # Filter out error messages from OneNote tasks before adding to AI input
-    onenote_text_for_ai = "\n".join([task for task in onenote_tasks if not task.startswith("Error:") and task != "No open tasks found in latest OneNote export."])
-    combined_raw_text = f"""--- Emails ---
-{raw_email_text}
+    stale = {}
+    with tracing.span('fetch'), deadline.stage('fetch'):
+        fetched = fetch_all_sources(user, sections, stale)
+    stale_sections = {name: time.strftime('%a %I:%M %p', time.localtime(saved_at)) for name, saved_at in stale.items()}
 
---- OneNote Tasks ---
-{onenote_text_for_ai}"""
+    archive_items = item_status = None
+    if config.ARCHIVE_ENABLED:
+        archive_items, item_status = diff_against_archive(user, fetched)
+    new_only = config.ARCHIVE_AI_NEW_ONLY if new_only is None else new_only
 
     # --- AI Summarization ---
-    ai_summary_result = get_ai_summary(combined_raw_text)
-    print(f"AI Summary Result: {ai_summary_result[:100]}...")
+    section_cache_file = os.path.join(user.get('cache_dir', ''), config.SECTION_CACHE_FILE)
+    ai_summary_result = ""
+    cache_stats = None
+    input_stats = None
+    if use_ai:
+        combined_raw_text, input_stats = build_ai_input(fetched, item_status if new_only else None)
+    if use_ai and config.AI_STREAMING_ENABLED:
+        # Streams in the background; compose_email renders the other sections meanwhile
+        with deadline.stage('summarize'):
+            ai_summary_result = ai_summarizer.SummaryStream(
+                combined_raw_text, fallback=lambda summary: summary_or_last_good(section_cache_file, summary))
+    elif use_ai:
+        stats_before = summary_cache.get_stats()
+        with tracing.span('summarize', bytes=len(combined_raw_text.encode('utf-8'))) as span, deadline.stage('summarize'):
+            ai_summary_result = ai_summarizer.get_ai_summary(combined_raw_text)
+        print(f"AI Summary Result: {ai_summary_result[:100]}...")
+        ai_summary_result, stale_at = summary_or_last_good(section_cache_file, ai_summary_result)
+        if stale_at:
+            stale_sections['ai'] = stale_at
+        stats_after = summary_cache.get_stats()
+        cache_stats = {key: stats_after[key] - stats_before[key] for key in stats_after}
+        span.set('cache_hits', cache_stats['hits'])
+        span.set('cache_misses', cache_stats['misses'])
+        print(f"AI cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+    else:
+        print("\nSkipping AI summarization for this run.")
+
+    return {
+        'calendar_events': fetched['calendar'], # List of dicts
+        'email_list': fetched['gmail'][0],      # List of dicts
+        'onenote_tasks': fetched['onenote'],    # Keep as list of strings for its own section
+        'ai_summary': ai_summary_result,        # Zoom recaps are only summarized, not listed
+        'ai_cache_stats': cache_stats,
+        'ai_input_stats': input_stats,          # Items trimmed or left out of the AI prompt
+        'skipped_sections': skipped_sections,
+        'stale_sections': stale_sections,       # Sources shown from their last good result, with its time
+        'item_status': item_status,             # New/changed markers per listed item
+        'archive_items': archive_items,         # Stored by deliver_brief once the brief goes out
+    }
+
+def deliver_brief(user, brief, send=True, flush=True):
+    """Renders a prepared brief, saves the local HTML copy and sends (or queues) it.
+
+    Briefs rendered for sending are added to the user's archive (local-only runs are not,
+    so they don't affect the next brief's "new since last brief" markers).
+
+    Returns a result dict ({'name', 'ok', 'sent', 'outbox_id', 'elapsed', 'error'}).
+    """
+    start_time = time.time()
+    result = {'name': user['name'], 'ok': False, 'sent': False, 'outbox_id': None, 'elapsed': 0.0, 'error': None}
 
     # --- Compose Email ---
     email_subject = f"Daily Brief - {time.strftime('%A, %B %d, %Y')}" 
-    final_html = email_composer.compose_email(
-        calendar_events=todays_events, # Now a list of dicts
-        email_list=email_list,       # Now a list of dicts
-        onenote_tasks=onenote_tasks, # Keep as list of strings for its own section
-        ai_summary=ai_summary_result
-        # zoom_summaries are now implicitly included in ai_summary input
-    )
+    with tracing.span('render') as span, deadline.stage('render'):
+        final_html = email_composer.compose_email(**{key: value for key, value in brief.items() if key != 'archive_items'})
+        span.set('bytes', len(final_html.encode('utf-8')))
 
     # --- Save Local Output ---
-    output_file = config.LOCAL_OUTPUT_HTML_FILE
+    output_file = user.get('output_file') or os.path.join(user.get('cache_dir', ''), config.LOCAL_OUTPUT_HTML_FILE)
     try:
         with open(output_file, 'w', encoding='utf-8') as f:
             f.write(final_html)
         print(f"\nHTML output saved locally to: {output_file}")
     except Exception as e:
         print(f"Error saving local HTML file {output_file}: {e}")
-        
+
     # --- Send Email ---
-    recipient_email = os.getenv(config.RECIPIENT_EMAIL_ENV_VAR)
     if final_html and not final_html.startswith("<html><body><h1>Error</h1>"):
-        send_success = send_gmail(email_subject, final_html, recipient_email)
-        if not send_success:
-             print("\n*** Email sending failed. Check logs above. ***")
+        result['ok'] = True
+        with deadline.stage('send'): # Past the send slice, the brief waits in the outbox
+            if send and not flush:
+                result['outbox_id'] = send_gmail(email_subject, final_html, user.get('recipient'), user['token_file'], flush=False)
+                if not result['outbox_id']:
+                    result['error'] = "Email could not be queued."
+            elif send:
+                result['sent'] = send_gmail(email_subject, final_html, user.get('recipient'), user['token_file'])
+                if not result['sent']:
+                     print("\n*** Email sending failed. Check logs above. ***")
+                     result['error'] = "Email sending failed."
+        if send and brief.get('archive_items') is not None:
+            archive_delivered_brief(user, brief) # Failed sends stay in the outbox and go out later
     else:
         print("\nSkipping email sending due to composition error.")
+        result['error'] = "Email composition failed."
+
+    result['elapsed'] = time.time() - start_time
+    return result
+
+def parse_sections(value):
+    sections = [name.strip().lower() for name in value.split(',') if name.strip()]
+    unknown = [name for name in sections if name not in SOURCES]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown section(s) {', '.join(unknown)}; choose from {', '.join(SOURCES)}")
+    return tuple(sections)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate (and send) the Daily Brief.")
+    parser.add_argument('--only', type=parse_sections, default=SOURCES, metavar='SECTIONS',
+                        help=f"Comma-separated sources to fetch (default: {','.join(SOURCES)}); others render as not included")
+    parser.add_argument('--no-send', action='store_true', help="Render the brief locally without sending it")
+    parser.add_argument('--no-ai', action='store_true', help="Skip the OpenAI summary")
+    parser.add_argument('--new-only', action='store_true', default=None,
+                        help="Summarize only items new or changed since the last brief")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Runs the full data fetching, AI summarization, composition, and sending process locally."""
+    args = parse_args(argv)
+    start_time = time.time()
+    print("Starting Daily Brief generation process...")
+    
+    # Load environment variables from .env file
+    load_dotenv() 
+
+    if not args.no_send:
+        # Deliver anything a previous run rendered but could not send
+        gmail_sender.flush_outbox()
+
+    with tracing.profiled():
+        run_brief(default_user(), send=not args.no_send, sections=args.only, use_ai=not args.no_ai, new_only=args.new_only)
 
     # --- Finish ---
     end_time = time.time()
     print(f"\nDaily Brief generation process finished in {end_time - start_time:.2f} seconds.")
 
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,108 @@
+import hashlib
+import re
+import sqlite3
+from datetime import date, timedelta
+
+import config
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+def normalize_task(text):
+    """Task text without the DONE marker, case and whitespace differences (the dedup key)."""
+    text = text.strip()
+    if text.upper().startswith(config.ONENOTE_DONE_MARKER):
+        text = text[len(config.ONENOTE_DONE_MARKER):]
+    return WHITESPACE_PATTERN.sub(' ', text).strip().casefold()
+
+def task_hash(text):
+    return hashlib.sha1(normalize_task(text).encode('utf-8')).hexdigest()
+
+def connect(db_file=None):
+    """Opens (and creates if needed) the cross-file index of OneNote tasks."""
+    conn = sqlite3.connect(db_file or config.ONENOTE_TASK_INDEX_FILE)
+    conn.row_factory = sqlite3.Row
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime_ns INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS file_tasks (
+            path TEXT,
+            hash TEXT,
+            position INTEGER,
+            done INTEGER,
+            PRIMARY KEY (path, hash)
+        );
+        CREATE INDEX IF NOT EXISTS idx_file_tasks_hash ON file_tasks (hash);
+        CREATE TABLE IF NOT EXISTS tasks (
+            hash TEXT PRIMARY KEY,
+            text TEXT,
+            done INTEGER,
+            first_seen TEXT,
+            last_seen TEXT
+        );
+    """)
+    return conn
+
+def indexed_files(conn):
+    """Returns {path: (size, mtime_ns)} for every export in the index."""
+    return {row['path']: (row['size'], row['mtime_ns']) for row in conn.execute("SELECT * FROM files")}
+
+def replace_file(conn, path, size, mtime_ns, entries, today=None):
+    """Replaces one export's tasks with freshly parsed (text, done) entries."""
+    today = (today or date.today()).isoformat()
+    rows = {}
+    for position, (text, done) in enumerate(entries):
+        # A task listed twice in one file keeps its first position; it is open if any copy is
+        key = task_hash(text)
+        if key in rows:
+            rows[key][3] = rows[key][3] and done
+        else:
+            rows[key] = [path, key, position, done, text]
+    with conn:
+        conn.execute("DELETE FROM file_tasks WHERE path = ?", (path,))
+        conn.executemany("INSERT INTO file_tasks (path, hash, position, done) VALUES (?, ?, ?, ?)",
+                         [row[:4] for row in rows.values()])
+        # The stored text follows the newest parse
+        conn.executemany(
+            """INSERT INTO tasks (hash, text, done, first_seen, last_seen) VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(hash) DO UPDATE SET text = excluded.text""",
+            [(key, text, int(done), today, today) for _, key, _, done, text in rows.values()]
+        )
+        conn.execute("INSERT OR REPLACE INTO files (path, size, mtime_ns) VALUES (?, ?, ?)", (path, size, mtime_ns))
+
+def remove_files(conn, paths):
+    """Forgets exports that were deleted from the folder."""
+    with conn:
+        conn.executemany("DELETE FROM file_tasks WHERE path = ?", [(p,) for p in paths])
+        conn.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in paths])
+
+def refresh_status(conn, today=None):
+    """Recomputes each task's done flag from the newest export containing it and stamps last_seen."""
+    today = (today or date.today()).isoformat()
+    with conn:
+        conn.execute("""
+            UPDATE tasks SET
+                done = (SELECT ft.done FROM file_tasks ft JOIN files f ON f.path = ft.path
+                        WHERE ft.hash = tasks.hash ORDER BY f.mtime_ns DESC LIMIT 1),
+                last_seen = ?
+            WHERE hash IN (SELECT hash FROM file_tasks)
+        """, (today,))
+
+def prune(conn, retention_days, today=None):
+    """Deletes tasks that have not appeared in any export within the retention window."""
+    cutoff = ((today or date.today()) - timedelta(days=retention_days)).isoformat()
+    with conn:
+        conn.execute("DELETE FROM tasks WHERE last_seen < ? AND hash NOT IN (SELECT hash FROM file_tasks)", (cutoff,))
+
+def open_tasks(conn):
+    """Returns open tasks present in at least one current export, oldest first, as dicts."""
+    rows = conn.execute("""
+        SELECT t.text, t.first_seen, t.last_seen, COUNT(*) AS files
+        FROM tasks t JOIN file_tasks ft ON ft.hash = t.hash
+        WHERE t.done = 0
+        GROUP BY t.hash
+        ORDER BY t.first_seen, MIN(ft.position), t.hash
+    """)
+    return [dict(row) for row in rows]
@@ -1,93 +1,463 @@
 import os
-import glob
+import json
+import multiprocessing
+import threading
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from docx import Document
-from docx.opc.exceptions import PackageNotFoundError
 from dotenv import load_dotenv
 
 import config
+import onenote_index
+import tracing
+import utils
 
-def find_latest_docx(folder_path):
-    """Finds the most recently modified .docx file in a folder."""
+def _is_export_name(name):
+    # Same files glob('*.docx') matched (no hidden files), minus Word's "~$" lock files
+    return name.lower().endswith('.docx') and not name.startswith(('.', '~$'))
+
+def find_latest_docx_entry(folder_path):
+    """Returns (path, stat) of the most recently modified .docx file in a folder, or (None, None).
+
+    A single scandir pass; the stat results are kept so the parser doesn't stat the file again.
+    """
     if not os.path.isdir(folder_path):
         print(f"Error: OneNote export folder not found: {folder_path}")
-        return None
-    
-    search_pattern = os.path.join(folder_path, '*.docx')
-    docx_files = glob.glob(search_pattern)
-    
-    if not docx_files:
-        print(f"No .docx files found in {folder_path}")
-        return None
-    
+        return None, None
+
+    latest_path, latest_stat = None, None
     try:
-        latest_file = max(docx_files, key=os.path.getmtime)
-        return latest_file
-    except Exception as e:
+        with os.scandir(folder_path) as entries:
+            for entry in entries:
+                if not _is_export_name(entry.name):
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    entry_stat = entry.stat()
+                except OSError:
+                    continue # Removed or unreadable mid-scan
+                if latest_stat is None or entry_stat.st_mtime > latest_stat.st_mtime:
+                    latest_path, latest_stat = entry.path, entry_stat
+    except OSError as e:
         print(f"Error finding latest file in {folder_path}: {e}")
-        return None
+        return None, None
 
-def parse_onenote_docx(file_path):
-    """Parses a .docx file exported from OneNote, extracting tasks not marked with DONE."""
-    tasks = []
+    if latest_path is None:
+        print(f"No .docx files found in {folder_path}")
+    return latest_path, latest_stat
+
+def find_latest_docx(folder_path):
+    """Finds the most recently modified .docx file in a folder."""
+    return find_latest_docx_entry(folder_path)[0]
+
+def list_docx_entries(folder_path):
+    """Returns {path: stat} for every .docx export in a folder (one scandir pass)."""
+    exports = {}
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            if _is_export_name(entry.name):
+                try:
+                    if entry.is_file():
+                        exports[os.path.abspath(entry.path)] = entry.stat()
+                except OSError:
+                    continue
+    return exports
+
+# WordprocessingML element names used by the streaming parser
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+W_P = W_NS + 'p'
+W_T = W_NS + 't'
+W_TAB = W_NS + 'tab'
+W_BREAKS = (W_NS + 'br', W_NS + 'cr')
+
+def _iter_docx_paragraphs(file_path):
+    """Stream-parses word/document.xml out of the .docx zip, yielding paragraph text in document order.
+
+    Paragraphs inside tables are included. Elements are cleared as soon as they are consumed,
+    so memory stays flat regardless of export size.
+    """
+    with zipfile.ZipFile(file_path) as archive:
+        with archive.open('word/document.xml') as xml_file:
+            body = None
+            depth = 0
+            for event, elem in ET.iterparse(xml_file, events=('start', 'end')):
+                if event == 'start':
+                    depth += 1
+                    if depth == 2: # <w:document><w:body>
+                        body = elem
+                    continue
+
+                depth -= 1
+                if elem.tag == W_P:
+                    parts = []
+                    for node in elem.iter():
+                        if node.tag == W_T:
+                            parts.append(node.text or '')
+                        elif node.tag == W_TAB:
+                            parts.append('\t')
+                        elif node.tag in W_BREAKS:
+                            parts.append('\n')
+                    yield ''.join(parts)
+                    elem.clear()
+                if depth == 2 and body is not None:
+                    # A top-level block (paragraph or whole table) is done; drop it from the tree
+                    body.clear()
+
+def _iter_docx_paragraphs_python_docx(file_path):
+    """Fallback extraction through python-docx for documents the streaming parser can't read."""
+    # python-docx is only imported when the fallback is actually needed
+    from docx import Document
+    from docx.opc.exceptions import PackageNotFoundError
     try:
         document = Document(file_path)
-        print(f"Parsing OneNote export: {os.path.basename(file_path)}")
-        
-        # Iterate through paragraphs (simplest approach)
-        # Might need refinement based on how OneNote structures lists/tasks in DOCX
-        for para in document.paragraphs:
-            text = para.text.strip()
-            if text: # Ignore empty paragraphs
-                # Check if the line starts with the DONE marker (case-insensitive)
-                if not text.upper().startswith(config.ONENOTE_DONE_MARKER):
-                    # Check if it looks like a list item (starts with bullet, number, etc.)
-                    # This helps filter out regular paragraphs if needed, but might be too strict.
-                    # For now, let's include any non-DONE line.
-                    # if re.match(r'^\s*[-*\u2022\u25E6\u25CF]|\d+\.\s', text):
-                    print(f"  * [Found Task] {text}")
-                    tasks.append(text)
-                # else:
-                    # print(f"  - [Skipped DONE] {text}")
-        
-        # Alternative: Iterate through tables if tasks are in tables
-        # for table in document.tables:
-        #     for row in table.rows:
-        #         for cell in row.cells:
-        #             # Process cell text similarly
-        #             pass
-            
-    except PackageNotFoundError:
-        print(f"Error: Could not open file {file_path}. It might be corrupted or not a valid .docx file.")
+    except PackageNotFoundError as e:
+        raise zipfile.BadZipFile(str(e)) from e
+    for para in document.paragraphs:
+        yield para.text
+    for table in document.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                for para in cell.paragraphs:
+                    yield para.text
+
+def _read_paragraphs(file_path):
+    """All paragraph texts of an export, falling back to python-docx if streaming fails."""
+    try:
+        return list(_iter_docx_paragraphs(file_path))
+    except (ET.ParseError, KeyError) as e:
+        print(f"Streaming parse of {os.path.basename(file_path)} failed ({e}). Falling back to python-docx.")
+        return list(_iter_docx_paragraphs_python_docx(file_path))
+
+def _parse_export_entries(file_path):
+    """Returns (text, done) for every non-empty paragraph; runs in a worker process.
+
+    Done tasks are returned without the DONE marker.
+    """
+    entries = []
+    for text in _read_paragraphs(file_path):
+        text = text.strip()
+        if not text:
+            continue
+        done = text.upper().startswith(config.ONENOTE_DONE_MARKER)
+        if done:
+            text = text[len(config.ONENOTE_DONE_MARKER):].strip()
+        if text:
+            entries.append((text, done))
+    return entries
+
+def _extract_tasks(paragraphs):
+    """Returns the non-empty paragraphs that are not marked with the DONE marker."""
+    tasks = []
+    for text in paragraphs:
+        text = text.strip()
+        if text: # Ignore empty paragraphs
+            # Check if the line starts with the DONE marker (case-insensitive)
+            if not text.upper().startswith(config.ONENOTE_DONE_MARKER):
+                # Check if it looks like a list item (starts with bullet, number, etc.)
+                # This helps filter out regular paragraphs if needed, but might be too strict.
+                # For now, let's include any non-DONE line.
+                # if re.match(r'^\s*[-*\u2022\u25E6\u25CF]|\d+\.\s', text):
+                print(f"  * [Found Task] {text}")
+                tasks.append(text)
+            # else:
+                # print(f"  - [Skipped DONE] {text}")
+    return tasks
+
+def iter_open_tasks(file_path):
+    """Yields the open tasks of an export one at a time, without building the task list."""
+    for text in _iter_docx_paragraphs(file_path):
+        text = text.strip()
+        if text and not text.upper().startswith(config.ONENOTE_DONE_MARKER):
+            yield text
+
+def _load_parse_cache(cache_file):
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_parse_cache(cache, cache_file):
+    try:
+        utils.write_atomic(cache_file, json.dumps(cache))
+    except OSError as e:
+        print(f"Warning: could not save OneNote parse cache: {e}")
+
+_parse_lock = threading.Lock() # The brief and a background watcher share the parse cache file
+
+def parse_onenote_docx(file_path, file_stat=None, cache_file=None):
+    """Parses a .docx file exported from OneNote, extracting tasks not marked with DONE.
+
+    Results are cached on disk (cache_file, default config.ONENOTE_CACHE_FILE) keyed by
+    (path, size, mtime), so an unchanged export costs a single stat() call (none when
+    file_stat comes from the folder scan).
+    """
+    with _parse_lock:
+        return _parse_onenote_docx(file_path, file_stat, cache_file or config.ONENOTE_CACHE_FILE)
+
+def _parse_onenote_docx(file_path, file_stat, cache_file):
+    cache_key = os.path.abspath(file_path)
+    try:
+        file_stat = file_stat or os.stat(file_path)
+    except OSError as e:
+        print(f"Error: Could not read file {file_path}: {e}")
         return ["Error: Invalid OneNote export file found."]
-    except Exception as e:
-        print(f"Error parsing Word document {file_path}: {e}")
-        return [f"Error parsing OneNote export: {e}"]
+
+    cache = _load_parse_cache(cache_file)
+    cached = cache.get(cache_key)
+    if cached and cached['size'] == file_stat.st_size and cached['mtime_ns'] == file_stat.st_mtime_ns:
+        print(f"Using cached tasks for unchanged OneNote export: {os.path.basename(file_path)}")
+        tasks = cached['tasks']
+    else:
+        try:
+            print(f"Parsing OneNote export: {os.path.basename(file_path)}")
+            with tracing.span('docx.parse', bytes=file_stat.st_size) as span:
+                try:
+                    tasks = _extract_tasks(_iter_docx_paragraphs(file_path))
+                except (ET.ParseError, KeyError) as e:
+                    print(f"Streaming parse failed ({e}). Falling back to python-docx.")
+                    tasks = _extract_tasks(_iter_docx_paragraphs_python_docx(file_path))
+                span.set('count', len(tasks))
+        except zipfile.BadZipFile:
+            print(f"Error: Could not open file {file_path}. It might be corrupted or not a valid .docx file.")
+            return ["Error: Invalid OneNote export file found."]
+        except Exception as e:
+            print(f"Error parsing Word document {file_path}: {e}")
+            return [f"Error parsing OneNote export: {e}"]
+
+        # Keep only the most recent entries; old exports are rarely re-read
+        cache.pop(cache_key, None)
+        cache[cache_key] = {'size': file_stat.st_size, 'mtime_ns': file_stat.st_mtime_ns, 'tasks': tasks}
+        cache = dict(list(cache.items())[-config.ONENOTE_CACHE_MAX_ENTRIES:])
+        _save_parse_cache(cache, cache_file)
 
     if not tasks:
         print("No open tasks found in the document.")
         return ["No open tasks found in latest OneNote export."]
-        
+
     return tasks
 
-def get_onenote_tasks_from_export():
-    """Finds the latest OneNote .docx export and parses it for open tasks."""
+def get_onenote_tasks_from_export(export_folder=None, index_file=None, cache_file=None):
+    """Finds the latest OneNote .docx export and parses it for open tasks (cached in cache_file).
+
+    With ONENOTE_PARSE_MODE = 'notebook', open tasks come from every export instead (see get_notebook_tasks).
+    """
     print("\n--- Parsing OneNote Export File --- ")
-    load_dotenv()
-    export_folder = os.getenv(config.ONENOTE_EXPORT_FOLDER_ENV_VAR)
+    if not export_folder:
+        load_dotenv()
+        export_folder = os.getenv(config.ONENOTE_EXPORT_FOLDER_ENV_VAR)
 
     if not export_folder:
         print(f"Error: Environment variable {config.ONENOTE_EXPORT_FOLDER_ENV_VAR} not set in .env file.")
         return [f"Error: OneNote export folder path not configured."]
+
+    if config.ONENOTE_PARSE_MODE == 'notebook':
+        return get_notebook_tasks(export_folder, index_file)
     
-    latest_export_file = find_latest_docx(export_folder)
-    
+    watcher = _watchers.get(os.path.abspath(export_folder))
+    if watcher is not None and watcher.ready():
+        latest_export_file, tasks = watcher.current()
+        print(f"Using watched OneNote export: {os.path.basename(latest_export_file)}")
+        return tasks
+
+    latest_export_file, latest_stat = find_latest_docx_entry(export_folder)
+
     if not latest_export_file:
         return ["Error: Could not find a recent OneNote .docx export file."]
-        
-    tasks = parse_onenote_docx(latest_export_file)
+
+    tasks = parse_onenote_docx(latest_export_file, latest_stat, cache_file)
     return tasks
 
+def _parse_changed_exports(changed):
+    """Parses {path: stat} exports, across a process pool when there is more than one.
+
+    Yields (path, stat, entries or None on failure).
+    """
+    workers = min(len(changed), config.ONENOTE_PARSE_WORKERS or os.cpu_count() or 1)
+    if workers <= 1:
+        for path, file_stat in changed.items():
+            try:
+                yield path, file_stat, _parse_export_entries(path)
+            except Exception as e:
+                print(f"Error parsing OneNote export {path}: {e}")
+                yield path, file_stat, None
+        return
+    # spawn: the brief forks from a multi-threaded process, where fork is unsafe
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {path: pool.submit(_parse_export_entries, path) for path in changed}
+        for path, future in futures.items():
+            try:
+                yield path, changed[path], future.result()
+            except Exception as e:
+                print(f"Error parsing OneNote export {path}: {e}")
+                yield path, changed[path], None
+
+def get_notebook_tasks(export_folder, index_file=None):
+    """Returns open tasks from every .docx export in the folder, deduplicated across files.
+
+    Tasks are tracked in a SQLite index keyed by normalized text hash, with first/last seen
+    dates. A task is done when the newest export containing it marks it DONE. Only exports
+    whose size or mtime changed since the last run are parsed.
+    """
+    if not os.path.isdir(export_folder):
+        print(f"Error: OneNote export folder not found: {export_folder}")
+        return ["Error: Could not find a recent OneNote .docx export file."]
+
+    conn = onenote_index.connect(index_file)
+    try:
+        exports = list_docx_entries(export_folder)
+        if not exports:
+            print(f"No .docx files found in {export_folder}")
+            return ["Error: Could not find a recent OneNote .docx export file."]
+        indexed = onenote_index.indexed_files(conn)
+        onenote_index.remove_files(conn, [path for path in indexed if path not in exports])
+        # Oldest first, so a task's stored text comes from the newest export that has it
+        changed = {path: file_stat for path, file_stat in sorted(exports.items(), key=lambda item: item[1].st_mtime_ns)
+                   if indexed.get(path) != (file_stat.st_size, file_stat.st_mtime_ns)}
+
+        if changed:
+            print(f"Parsing {len(changed)} of {len(exports)} OneNote exports.")
+            with tracing.span('docx.parse', bytes=sum(s.st_size for s in changed.values())) as span:
+                for path, file_stat, entries in _parse_changed_exports(changed):
+                    if entries is not None:
+                        onenote_index.replace_file(conn, path, file_stat.st_size, file_stat.st_mtime_ns, entries)
+                span.set('count', len(changed))
+        else:
+            print(f"All {len(exports)} OneNote exports unchanged; using the task index.")
+        onenote_index.refresh_status(conn)
+        onenote_index.prune(conn, config.ONENOTE_INDEX_RETENTION_DAYS)
+        tasks = [task['text'] for task in onenote_index.open_tasks(conn)]
+    finally:
+        conn.close()
+
+    print(f"Found {len(tasks)} open tasks across {len(exports)} OneNote exports.")
+    if not tasks:
+        return ["No open tasks found in latest OneNote export."]
+    return tasks
+
+class ExportWatcher:
+    """Keeps the latest export in a folder and its parsed tasks current in a background thread.
+
+    Uses watchdog (inotify, FSEvents, ReadDirectoryChangesW) when it is installed; otherwise
+    polls every ONENOTE_WATCH_POLL_SECONDS, rescanning only when the folder's or the latest
+    file's modification time changed, plus a full rescan every ONENOTE_WATCH_RESCAN_MINUTES.
+    """
+
+    def __init__(self, folder_path, cache_file=None):
+        self.folder_path = os.path.abspath(folder_path)
+        self.cache_file = cache_file
+        self._lock = threading.Lock()
+        self._latest = (None, None, None) # (path, stat, tasks)
+        self._dirty = threading.Event() # Set when a filesystem event may have changed the latest export
+        self._stop = threading.Event()
+        self._observer = None
+        self._thread = None
+
+    def ready(self):
+        return self._latest[2] is not None
+
+    def current(self):
+        """(path, tasks) of the latest export as of the last refresh."""
+        with self._lock:
+            path, _, tasks = self._latest
+            return path, list(tasks)
+
+    def refresh(self):
+        """Rescans the folder and re-parses the latest export if it changed."""
+        path, file_stat = find_latest_docx_entry(self.folder_path)
+        if path is None:
+            tasks = ["Error: Could not find a recent OneNote .docx export file."]
+        else:
+            _, old_stat, old_tasks = self._latest
+            unchanged = old_stat is not None and self._latest[0] == path and \
+                (old_stat.st_size, old_stat.st_mtime_ns) == (file_stat.st_size, file_stat.st_mtime_ns)
+            tasks = old_tasks if unchanged else parse_onenote_docx(path, file_stat, self.cache_file)
+        with self._lock:
+            self._latest = (path, file_stat, tasks)
+
+    def _changed_since_scan(self, folder_mtime_ns):
+        path, file_stat, _ = self._latest
+        try:
+            if os.stat(self.folder_path).st_mtime_ns != folder_mtime_ns:
+                return True
+            return path is not None and os.stat(path).st_mtime_ns != file_stat.st_mtime_ns
+        except OSError:
+            return True
+
+    def _run(self):
+        folder_mtime_ns = None
+        last_full_scan = None
+        while not self._stop.is_set():
+            due_full_scan = last_full_scan is None or time.monotonic() - last_full_scan >= config.ONENOTE_WATCH_RESCAN_MINUTES * 60
+            if self._dirty.is_set() or due_full_scan or (self._observer is None and self._changed_since_scan(folder_mtime_ns)):
+                if self._observer is not None and self._dirty.is_set():
+                    # Let a sync client finish writing before parsing
+                    self._stop.wait(config.ONENOTE_WATCH_DEBOUNCE_SECONDS)
+                self._dirty.clear()
+                try:
+                    folder_mtime_ns = os.stat(self.folder_path).st_mtime_ns
+                    self.refresh()
+                except Exception as e:
+                    print(f"Warning: OneNote watcher refresh failed: {e}")
+                if due_full_scan:
+                    last_full_scan = time.monotonic()
+            if self._observer is not None:
+                self._dirty.wait(config.ONENOTE_WATCH_POLL_SECONDS)
+            else:
+                self._stop.wait(config.ONENOTE_WATCH_POLL_SECONDS)
+
+    def _start_observer(self):
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            return None
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                paths = [event.src_path, getattr(event, 'dest_path', '')]
+                if any(_is_export_name(os.path.basename(path)) for path in paths if path):
+                    watcher._dirty.set()
+
+        observer = Observer()
+        observer.schedule(Handler(), self.folder_path, recursive=False)
+        observer.daemon = True
+        observer.start()
+        return observer
+
+    def start(self):
+        if os.path.isdir(self.folder_path):
+            self._observer = self._start_observer()
+        print(f"Watching OneNote exports in {self.folder_path} "
+              f"({'filesystem events' if self._observer else f'polling every {config.ONENOTE_WATCH_POLL_SECONDS}s'}).")
+        self._thread = threading.Thread(target=self._run, name='onenote-watch', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._dirty.set() # Wakes the event-driven loop
+        if self._observer is not None:
+            self._observer.stop()
+
+_watchers = {} # Absolute folder path -> running ExportWatcher
+
+def start_watching(export_folder, cache_file=None):
+    """Starts (or returns the running) watcher for a folder; the brief then reads tasks from it."""
+    key = os.path.abspath(export_folder)
+    if key not in _watchers:
+        _watchers[key] = ExportWatcher(key, cache_file).start()
+    return _watchers[key]
+
+def stop_watching():
+    for watcher in _watchers.values():
+        watcher.stop()
+    _watchers.clear()
+
 if __name__ == '__main__':
     # For local testing
     # Ensure you have a .docx file in the folder specified in your .env
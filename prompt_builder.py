@@ -0,0 +1,105 @@
+"""Builds the AI prompt from emails, tasks and meeting recaps within a token budget, most valuable items first.
+
+Emails are scored by sender importance, recency and whether the user is a direct recipient.
+When everything doesn't fit, the snippets of the lowest-scored emails are cut first
+(keeping sender and subject), then the lowest-scored items are left out altogether.
+"""
+import os
+import time
+
+import ai_summarizer
+import config
+import gmail_fetcher
+import zoom_parser
+
+ONENOTE_PLACEHOLDER = "No open tasks found in latest OneNote export."
+
+def important_senders():
+    """Addresses (or '@domain' suffixes) configured as important, lowercased."""
+    value = os.getenv(config.IMPORTANT_SENDERS_ENV_VAR)
+    senders = value.split(',') if value else config.IMPORTANT_SENDERS
+    return [sender.strip().lower() for sender in senders if sender.strip()]
+
+def _sender_score(email, important):
+    address = email.get('sender_address', '')
+    if address and any(address == s or (s.startswith('@') and address.endswith(s)) for s in important):
+        return 1.0
+    if any(pattern in address for pattern in config.AUTOMATED_SENDER_PATTERNS):
+        return 0.0
+    if {'IMPORTANT', 'STARRED'} & set(email.get('label_ids', [])):
+        return 0.6
+    return 0.3
+
+def score_email(email, important=None, now=None):
+    """Weighted sum of sender importance, direct-recipient status and recency (newer is higher)."""
+    important = important_senders() if important is None else important
+    weights = config.PROMPT_SCORE_WEIGHTS
+    age_hours = max(0.0, ((now or time.time()) * 1000 - email.get('internal_date', 0)) / 3_600_000)
+    recency = 0.5 ** (age_hours / config.PROMPT_RECENCY_HALF_LIFE_HOURS)
+    recipient = {'to': 1.0, 'cc': 0.5}.get(email.get('recipient_type'), 0.0)
+    return weights['sender'] * _sender_score(email, important) + weights['recipient'] * recipient + weights['recency'] * recency
+
+def build_prompt(email_list, onenote_tasks, zoom_recaps=(), token_budget=None):
+    """Returns (prompt text, stats) for the summarizer.
+
+    stats has 'items' (emails, tasks and recaps offered), 'tokens' (of the prompt), 'trimmed' (emails
+    sent without their snippet) and 'dropped' (items the AI did not see). Kept items stay
+    in their original order.
+    """
+    token_budget = config.PROMPT_TOKEN_BUDGET if token_budget is None else token_budget
+    important = important_senders()
+    now = time.time()
+    # Filter out error messages from OneNote tasks before adding to AI input
+    tasks = [task for task in onenote_tasks if not task.startswith("Error:") and task != ONENOTE_PLACEHOLDER]
+
+    entries = []
+    for email in email_list:
+        full = gmail_fetcher.format_email_item(email)
+        entries.append({'section': 'email', 'score': score_email(email, important, now), 'text': full,
+                        'short': gmail_fetcher.format_email_item(email, include_snippet=False)})
+    for task in tasks:
+        entries.append({'section': 'task', 'score': config.PROMPT_TASK_SCORE, 'text': task, 'short': task})
+    for recap in zoom_recaps:
+        if isinstance(recap, dict): # Skips the error placeholder
+            text = zoom_parser.format_recap(recap)
+            entries.append({'section': 'meeting', 'score': config.PROMPT_MEETING_SCORE, 'text': text, 'short': text})
+    for entry in entries:
+        entry['tokens'] = ai_summarizer.count_tokens(entry['text']) + 2 # Plus the separator
+    total_tokens = sum(entry['tokens'] for entry in entries)
+
+    trimmed = dropped = 0
+    if token_budget and total_tokens > token_budget:
+        by_value = sorted(entries, key=lambda entry: entry['score'])
+        # First cut snippets, lowest-value emails first
+        for entry in by_value:
+            if total_tokens <= token_budget:
+                break
+            if entry['short'] != entry['text']:
+                short_tokens = ai_summarizer.count_tokens(entry['short']) + 2
+                total_tokens -= entry['tokens'] - short_tokens
+                entry['text'], entry['tokens'] = entry['short'], short_tokens
+                trimmed += 1
+        # Then leave out whole items
+        for entry in by_value:
+            if total_tokens <= token_budget:
+                break
+            total_tokens -= entry['tokens']
+            entry['dropped'] = True
+            dropped += 1
+
+    email_text = "\n\n".join(e['text'] for e in entries if e['section'] == 'email' and not e.get('dropped'))
+    task_text = "\n".join(e['text'] for e in entries if e['section'] == 'task' and not e.get('dropped'))
+    meeting_text = "\n\n".join(e['text'] for e in entries if e['section'] == 'meeting' and not e.get('dropped'))
+    prompt = f"""--- Emails ---
+{email_text}
+
+--- OneNote Tasks ---
+{task_text}"""
+    if meeting_text:
+        # Only added when there are recaps, so prompts (and their cache keys) are otherwise unchanged
+        prompt += f"\n\n--- Zoom Meetings ---\n{meeting_text}"
+    stats = {'items': len(entries), 'tokens': total_tokens, 'trimmed': trimmed, 'dropped': dropped}
+    if trimmed or dropped:
+        print(f"AI prompt over the {token_budget}-token budget: cut {trimmed} snippets, "
+              f"left out {dropped} of {len(entries)} items.")
+    return prompt, stats
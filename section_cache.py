@@ -0,0 +1,58 @@
+"""Last good result of each brief source and of the AI summary ('ai'), used when one fails or runs out of time."""
+import json
+import threading
+import time
+
+import config
+import utils
+
+_lock = threading.Lock()
+
+def is_error(name, result):
+    """True for a fetcher's error placeholder, e.g. ["Error fetching calendar events."], or an AI summary error."""
+    if name == 'ai':
+        return result.startswith("Error")
+    # The Gmail fetcher raises on errors instead, so its (emails, text) result is never a placeholder
+    return name != 'gmail' and any(isinstance(entry, str) and entry.startswith("Error") for entry in result)
+
+def is_good(name, result):
+    """Whether a result is worth keeping: not an error placeholder, for Gmail not empty, and for
+    the AI summary not cut off by its deadline."""
+    if name == 'gmail':
+        return bool(result and result[0])
+    if name == 'ai':
+        return bool(result) and not is_error(name, result) and config.AI_DEADLINE_MARKER not in result
+    return bool(result) and not is_error(name, result)
+
+def _load(cache_file):
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save(cache_file, results):
+    """Stores the good entries of {source: result} as the sources' last good results."""
+    good = {name: result for name, result in results.items() if is_good(name, result)}
+    if not good:
+        return
+    with _lock:
+        sections = _load(cache_file)
+        now = time.time()
+        for name, result in good.items():
+            sections[name] = {'saved_at': now, 'result': result}
+        try:
+            utils.write_atomic(cache_file, json.dumps(sections))
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Warning: could not write section cache {cache_file}: {e}")
+
+def last_good(cache_file, name):
+    """Returns (result, saved_at) for a source, or None if there is none within SECTION_CACHE_MAX_AGE_HOURS."""
+    with _lock:
+        entry = _load(cache_file).get(name)
+    if not entry or time.time() - entry['saved_at'] > config.SECTION_CACHE_MAX_AGE_HOURS * 3600:
+        return None
+    result = entry['result']
+    if name == 'gmail':
+        result = tuple(result) # (email list, raw text); JSON has no tuples
+    return result, entry['saved_at']
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+import config
+
+_lock = threading.Lock()
+_conn = None
+_stats = {'hits': 0, 'misses': 0}
+
+def make_key(*parts):
+    """Returns a content-addressed key (SHA-256) for the given parts, e.g. (model, prompt, input)."""
+    payload = json.dumps(parts, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _connection():
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(config.AI_CACHE_FILE, check_same_thread=False)
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                size INTEGER NOT NULL
+            )
+        """)
+        _conn.commit()
+    return _conn
+
+def get(key):
+    """Returns the cached value for key, or None. Counts a hit or a miss."""
+    if not config.AI_CACHE_ENABLED:
+        return None
+    with _lock:
+        try:
+            conn = _connection()
+            row = conn.execute("SELECT value, created_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row and time.time() - row[1] <= config.AI_CACHE_MAX_AGE_DAYS * 86400:
+                conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+                conn.commit()
+                _stats['hits'] += 1
+                return row[0]
+        except sqlite3.Error as e:
+            print(f"Warning: AI summary cache read failed: {e}")
+        _stats['misses'] += 1
+        return None
+
+def put(key, value):
+    """Stores value under key."""
+    if not config.AI_CACHE_ENABLED:
+        return
+    now = time.time()
+    with _lock:
+        try:
+            conn = _connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, created_at, accessed_at, size) VALUES (?, ?, ?, ?, ?)",
+                (key, value, now, now, len(value.encode('utf-8')))
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Warning: AI summary cache write failed: {e}")
+
+def evict():
+    """Drops entries older than AI_CACHE_MAX_AGE_DAYS, then least recently used entries beyond AI_CACHE_MAX_BYTES."""
+    if not config.AI_CACHE_ENABLED:
+        return
+    with _lock:
+        try:
+            conn = _connection()
+            conn.execute("DELETE FROM cache WHERE created_at < ?", (time.time() - config.AI_CACHE_MAX_AGE_DAYS * 86400,))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+            if total > config.AI_CACHE_MAX_BYTES:
+                removed = 0
+                for key, size in conn.execute("SELECT key, size FROM cache ORDER BY accessed_at").fetchall():
+                    if total - removed <= config.AI_CACHE_MAX_BYTES:
+                        break
+                    conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    removed += size
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Warning: AI summary cache eviction failed: {e}")
+
+def get_stats():
+    """Returns a copy of the hit/miss counters for this run."""
+    with _lock:
+        return dict(_stats)
+
+def reset_stats():
+    with _lock:
+        _stats['hits'] = 0
+        _stats['misses'] = 0
+
+def close():
+    """Closes the cache connection; the next call reopens config.AI_CACHE_FILE."""
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
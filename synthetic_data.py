@@ -0,0 +1,146 @@
+"""Deterministic synthetic inboxes, calendars and OneNote exports for offline benchmarks."""
+import random
+import time
+import zipfile
+from datetime import datetime, timedelta, timezone
+from xml.sax.saxutils import escape
+
+PEOPLE = ['Kevin Ross', 'Trent Walker', 'Priya Shah', 'Maria Lopez', 'Chen Wei', 'Ola Nordmann',
+          'Billing Team', 'Jira', 'GitHub', 'Newsletter Digest', 'Dana Kim', 'Sam Patel']
+TOPICS = ['Q3 budget', 'vendor contract', 'launch plan', 'hiring pipeline', 'security review',
+          'customer escalation', 'board deck', 'roadmap', 'pricing change', 'offsite logistics']
+VERBS = ['Re:', 'Fwd:', 'Action needed:', 'Update on', 'Decision on', 'Reminder:', 'Question about']
+SNIPPET_TEMPLATES = [
+    "Hi Seth, can you review the {topic} by {day}? Kevin owns the follow-up.",
+    "We decided to move forward with the {topic}. Trent will circulate notes.",
+    "Quick update on the {topic}: numbers are in the shared folder, due {day}.",
+    "Reminder that the {topic} is due {day}. Let me know if anything blocks you.",
+    "FYI only, no action needed. Summary of the {topic} discussion attached.",
+]
+DAYS = ['today', 'tomorrow', 'Friday', 'next Monday', 'end of week']
+
+def generate_inbox(message_count, seed=0, hours=23, now=None):
+    """Returns Gmail metadata-format message resources, newest first, spread over the last `hours`.
+
+    Roughly half of the messages share a thread with a neighbour, and a few are archived
+    or in spam, so label filtering and thread grouping get exercised.
+    """
+    rng = random.Random(seed)
+    now_ms = int((now or time.time()) * 1000)
+    step_ms = max(1, int(hours * 3600 * 1000 / max(1, message_count)))
+    messages = []
+    for i in range(message_count):
+        person = rng.choice(PEOPLE)
+        topic = rng.choice(TOPICS)
+        thread_index = i if rng.random() < 0.5 else max(0, i - 1)
+        labels = ['INBOX', 'UNREAD'] if rng.random() < 0.6 else ['INBOX']
+        roll = rng.random()
+        if roll < 0.03:
+            labels = ['SPAM']
+        elif roll < 0.08:
+            labels = ['CATEGORY_UPDATES'] # Archived
+        messages.append({
+            'id': f'{i:012x}',
+            'threadId': f't{thread_index:011x}',
+            'internalDate': str(now_ms - i * step_ms),
+            'labelIds': labels,
+            'snippet': rng.choice(SNIPPET_TEMPLATES).format(topic=topic, day=rng.choice(DAYS)),
+            'payload': {'headers': [
+                {'name': 'From', 'value': f'{person} <{person.split()[0].lower()}@example.com>'},
+                # Mostly direct, some copied, some via a list (varied without extra rng draws, so inboxes stay comparable)
+                *([{'name': 'To', 'value': 'seth@example.com'}] if i % 5 < 3 else
+                  [{'name': 'To', 'value': 'team@example.com'}, {'name': 'Cc', 'value': 'seth@example.com'}] if i % 5 == 3 else
+                  [{'name': 'To', 'value': 'all-staff@example.com'}]),
+                {'name': 'Subject', 'value': f'{rng.choice(VERBS)} {topic}'},
+            ]},
+        })
+    return messages
+
+def generate_calendar_events(calendar_id, event_count, seed=0, day=None, shared=False):
+    """Returns Calendar API event resources for `day` (default: today, UTC), sorted by start.
+
+    With shared=True every third event uses an iCalUID common to all calendars generated
+    the same way, to exercise cross-calendar de-duplication.
+    """
+    rng = random.Random(f'{seed}-{calendar_id}')
+    day = day or datetime.now(timezone.utc).date()
+    day_start = datetime(day.year, day.month, day.day, 7, tzinfo=timezone.utc)
+    events = []
+    for i in range(event_count):
+        if i % 10 == 9:
+            events.append({'id': f'{calendar_id}-allday-{i}', 'iCalUID': f'{calendar_id}-{i}@example.com',
+                           'status': 'confirmed', 'summary': f'All-day: {rng.choice(TOPICS)}',
+                           'start': {'date': day.isoformat()},
+                           'end': {'date': (day + timedelta(days=1)).isoformat()}})
+            continue
+        start = day_start + timedelta(minutes=15 * rng.randrange(0, 48))
+        uid = f'shared-{i}@example.com' if shared and i % 3 == 0 else f'{calendar_id}-{i}@example.com'
+        events.append({
+            'id': f'{calendar_id}-evt-{i}', 'iCalUID': uid, 'status': 'confirmed',
+            'summary': f'{rng.choice(TOPICS).title()} sync',
+            'start': {'dateTime': start.isoformat()},
+            'end': {'dateTime': (start + timedelta(minutes=rng.choice([15, 30, 60]))).isoformat()},
+        })
+    events.sort(key=lambda e: e['start'].get('dateTime') or e['start'].get('date'))
+    return events
+
+_CONTENT_TYPES = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                  '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                  '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                  '<Default Extension="xml" ContentType="application/xml"/>'
+                  '<Override PartName="/word/document.xml" '
+                  'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+                  '</Types>')
+_RELS = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+         '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+         '<Relationship Id="rId1" '
+         'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+         'Target="word/document.xml"/></Relationships>')
+_DOCUMENT_OPEN = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                  '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>')
+_DOCUMENT_CLOSE = '</w:body></w:document>'
+
+def _paragraph(text):
+    return f'<w:p><w:r><w:t xml:space="preserve">{escape(text)}</w:t></w:r></w:p>'
+
+def generate_onenote_docx(file_path, task_count, seed=0, done_ratio=0.3, table_every=50):
+    """Writes a OneNote-style .docx export with `task_count` task lines; returns the open task count.
+
+    A `done_ratio` share of tasks start with the DONE marker, and every `table_every`-th
+    task is placed in a one-cell table (OneNote exports tables for some layouts).
+    document.xml is streamed into the zip, so very large exports don't need to fit in memory.
+    """
+    rng = random.Random(seed)
+    open_tasks = 0
+    with zipfile.ZipFile(file_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        archive.writestr('_rels/.rels', _RELS)
+        with archive.open('word/document.xml', 'w') as document:
+            document.write(_DOCUMENT_OPEN.encode('utf-8'))
+            for i in range(task_count):
+                text = f"{rng.choice(['Follow up on', 'Draft', 'Review', 'Send', 'Schedule'])} {rng.choice(TOPICS)} ({rng.choice(DAYS)})"
+                if rng.random() < done_ratio:
+                    text = 'DONE ' + text
+                else:
+                    open_tasks += 1
+                xml = _paragraph(text)
+                if table_every and i % table_every == table_every - 1:
+                    xml = f'<w:tbl><w:tr><w:tc>{xml}</w:tc></w:tr></w:tbl>'
+                document.write(xml.encode('utf-8'))
+            document.write(_DOCUMENT_CLOSE.encode('utf-8'))
+    return open_tasks
+
+def generate_zoom_recap(file_path, seed=0, filler_paragraphs=200):
+    """Writes a Zoom-style recap page: the configured sections plus `filler_paragraphs` of transcript."""
+    rng = random.Random(seed)
+    topic = rng.choice(TOPICS)
+    next_steps = ''.join(f"<li>{escape(rng.choice(PEOPLE))} to {rng.choice(['draft', 'review', 'send'])} the {escape(rng.choice(TOPICS))} "
+                         f"by {rng.choice(DAYS)}</li>" for _ in range(rng.randint(2, 5)))
+    transcript = ''.join(f"<p>{escape(rng.choice(PEOPLE))}: {escape(rng.choice(SNIPPET_TEMPLATES).format(topic=rng.choice(TOPICS), day=rng.choice(DAYS)))}</p>"
+                         for _ in range(filler_paragraphs))
+    with open(file_path, 'w', encoding='utf-8') as f:
+        f.write(f"<html><head><title>{escape(topic.title())} sync</title></head><body>"
+                f"<div id=\"quick-recap\"><p>The team discussed the {escape(topic)} and agreed on next steps.</p></div>"
+                f"<div id=\"next-steps\"><ul>{next_steps}</ul></div>"
+                f"<div id=\"summary\"><p>Decision: the {escape(topic)} moves forward as planned.</p></div>"
+                f"<div id=\"transcript\">{transcript}</div></body></html>")
@@ -0,0 +1,106 @@
+import argparse
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+import config
+import gmail_sender
+import main
+import tracing
+
+def load_team_config(config_file):
+    """Loads the team config file and fills in per-user defaults.
+
+    Expected format:
+        {"users": [{"name": "alice", "token_file": "tokens/alice.json", "recipient": "alice@example.com",
+                    "onenote_export_folder": "/exports/alice", "zoom_summary_folder": "/zoom/alice", "calendars": ["primary", "team@group.calendar.google.com"]}]}
+    """
+    with open(config_file, 'r', encoding='utf-8') as f:
+        team = json.load(f)
+
+    users = []
+    for entry in team.get('users', []):
+        if not entry.get('name') or not entry.get('token_file'):
+            raise ValueError(f"Each user needs at least 'name' and 'token_file': {entry}")
+        user = {
+            'name': entry['name'],
+            'token_file': entry['token_file'],
+            'recipient': entry.get('recipient'),
+            'onenote_export_folder': entry.get('onenote_export_folder'),
+            'zoom_summary_folder': entry.get('zoom_summary_folder'),
+            'calendars': entry.get('calendars') or list(config.CALENDAR_IDS),
+            # Per-user Gmail store, calendar cache and HTML output live under cache_dir
+            'cache_dir': entry.get('cache_dir') or os.path.join(config.TEAM_CACHE_DIR, entry['name']),
+        }
+        user['output_file'] = os.path.join(user['cache_dir'], config.LOCAL_OUTPUT_HTML_FILE)
+        users.append(user)
+    return users
+
+def _run_user(user, send):
+    """Runs one user's brief, turning any failure into a result instead of an exception."""
+    start_time = time.time()
+    try:
+        # Worker processes can't complete a browser OAuth flow, so a token must already exist
+        if not os.path.exists(user['token_file']):
+            raise FileNotFoundError(f"Token file not found: {user['token_file']}. Authorize this user once with main.py first.")
+        os.makedirs(user['cache_dir'], exist_ok=True)
+        # Only queue here; run_team sends every queued brief together afterwards
+        return main.run_brief(user, send=send, flush=False)
+    except Exception as e:
+        traceback.print_exc()
+        return {'name': user['name'], 'ok': False, 'sent': False, 'outbox_id': None, 'elapsed': time.time() - start_time, 'error': str(e)}
+
+def run_team(users, max_workers, send=True, use_threads=False):
+    """Generates briefs for all users with bounded concurrency; per-user failures are isolated."""
+    executor_class = ThreadPoolExecutor if use_threads else ProcessPoolExecutor
+    results = []
+    with executor_class(max_workers=max_workers) as executor:
+        futures = {executor.submit(_run_user, user, send): user for user in users}
+        for future in as_completed(futures):
+            user = futures[future]
+            try:
+                results.append(future.result())
+            except Exception as e:
+                # e.g. the worker process died; only this user is affected
+                results.append({'name': user['name'], 'ok': False, 'sent': False, 'outbox_id': None, 'elapsed': 0.0, 'error': f"Worker failed: {e}"})
+
+    queued = [r for r in results if r.get('outbox_id')]
+    if queued:
+        with tracing.span('team.send', count=len(queued)) as root:
+            outcome = gmail_sender.flush_outbox([r['outbox_id'] for r in queued])
+        if config.TRACE_ENABLED:
+            tracing.export(root, 'team', trace_file=os.path.join(config.TEAM_CACHE_DIR, config.TRACE_FILE))
+        for r in queued:
+            r['sent'] = r['outbox_id'] in outcome['sent']
+            if not r['sent']:
+                r['error'] = f"Email sending failed (kept in outbox as {r['outbox_id']})."
+    return results
+
+def print_summary(results, elapsed):
+    ok = [r for r in results if r['ok'] and not r['error']]
+    failed = [r for r in results if not r['ok'] or r['error']]
+    print("\n=== Team Brief Summary ===")
+    print(f"Users: {len(results)}  Succeeded: {len(ok)}  Failed: {len(failed)}  Total time: {elapsed:.2f}s")
+    if results:
+        print(f"Average per-user time: {sum(r['elapsed'] for r in results) / len(results):.2f}s")
+    for r in sorted(failed, key=lambda r: r['name']):
+        print(f"  FAILED {r['name']}: {r['error']}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate daily briefs for every user in a team config file.")
+    parser.add_argument('--config', default=config.TEAM_CONFIG_FILE, help="Team config JSON file")
+    parser.add_argument('--workers', type=int, default=config.TEAM_MAX_WORKERS, help="Max users processed concurrently")
+    parser.add_argument('--threads', action='store_true', help="Use a thread pool instead of a process pool")
+    parser.add_argument('--no-send', action='store_true', help="Render briefs without sending them")
+    args = parser.parse_args()
+
+    load_dotenv()
+    start_time = time.time()
+    team_users = load_team_config(args.config)
+    print(f"Generating briefs for {len(team_users)} users with {args.workers} workers...")
+    team_results = run_team(team_users, args.workers, send=not args.no_send, use_threads=args.threads)
+    print_summary(team_results, time.time() - start_time)
@@ -0,0 +1,21 @@
+"""In-memory stand-ins for googleapiclient requests and resources."""
+import httplib2
+from googleapiclient.errors import HttpError
+
+class FakeRequest:
+    """A request whose execute() calls func (which may raise, e.g. http_error(...))."""
+
+    def __init__(self, func):
+        self.func = func
+
+    def execute(self):
+        return self.func()
+
+class FakeResource:
+    """A resource whose methods are the given callables, e.g. FakeResource(list=...)."""
+
+    def __init__(self, **methods):
+        self.__dict__.update(methods)
+
+def http_error(status):
+    return HttpError(httplib2.Response({'status': status}), b'{}')
@@ -0,0 +1,56 @@
+"""Archiving briefs and diffing a new brief against the last one."""
+import pytest
+
+import brief_archive
+
+STANDUP = {'time': '09:00 AM', 'name': 'Standup', 'id': 'evt-standup'}
+REVIEW = {'time': '02:00 PM', 'name': 'Budget review', 'id': 'evt-review'}
+EMAIL = {'sender': 'Ann', 'subject': 'Budget', 'count': 1, 'snippet': 'Numbers attached', 'thread_id': 't1'}
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = brief_archive.connect(str(tmp_path / 'brief_archive.sqlite3'))
+    yield conn
+    conn.close()
+
+def archive(conn, calendar, emails=(), tasks=(), summary=None):
+    items = brief_archive.collect_items(calendar, list(emails), list(tasks))
+    statuses = brief_archive.diff(items, brief_archive.last_brief_fingerprints(conn, 'ann'))
+    brief_archive.archive_brief(conn, 'ann', items, summary, statuses)
+    return statuses
+
+def test_first_brief_marks_nothing(conn):
+    statuses = archive(conn, [STANDUP], [EMAIL], ["[Budget] Send numbers"])
+    assert statuses == {'calendar': [None], 'gmail': [None], 'onenote': [None], 'zoom': []}
+
+def test_new_and_unchanged_items(conn):
+    archive(conn, [STANDUP], [EMAIL], ["[Budget] Send numbers"])
+    statuses = archive(conn, [STANDUP, REVIEW], [EMAIL], ["[Budget] Send numbers", "[Admin] Book travel"])
+    assert statuses['calendar'] == [None, brief_archive.NEW]
+    assert statuses['gmail'] == [None]
+    assert statuses['onenote'] == [None, brief_archive.NEW]
+
+def test_rescheduled_meeting_is_one_changed_item(conn):
+    archive(conn, [STANDUP, REVIEW])
+    moved = dict(REVIEW, time='04:00 PM')
+    statuses = archive(conn, [STANDUP, moved])
+    assert statuses['calendar'] == [None, brief_archive.CHANGED]
+
+def test_thread_with_new_reply_is_changed(conn):
+    archive(conn, [], [EMAIL])
+    statuses = archive(conn, [], [dict(EMAIL, count=2, snippet='Revised numbers')])
+    assert statuses['gmail'] == [brief_archive.CHANGED]
+
+def test_placeholders_are_not_archived(conn):
+    items = brief_archive.collect_items(["Error fetching calendar events."], [], ["No open tasks found in latest OneNote export."])
+    assert items['calendar'] == [None]
+    assert items['onenote'] == [None]
+
+def test_search_finds_archived_items(conn):
+    archive(conn, [REVIEW], [EMAIL], summary="Budget review moved to Friday.")
+    archive(conn, [REVIEW], [EMAIL])
+    results = brief_archive.search(conn, 'budget')
+    kinds = {result['kind'] for result in results}
+    assert {'event', 'email', 'summary'} <= kinds
+    event = next(result for result in results if result['kind'] == 'event')
+    assert event['briefs'] == 2 # Stored once, linked to both briefs
@@ -0,0 +1,108 @@
+"""syncToken-based calendar sync against an in-memory calendar."""
+import json
+from datetime import datetime, timedelta, timezone
+
+import config
+import google_calendar_fetcher
+import utils
+from tests.fakes import FakeRequest, FakeResource, http_error
+
+NOW = datetime.now(timezone.utc)
+WINDOW_START = NOW - timedelta(hours=1)
+WINDOW_END = WINDOW_START + timedelta(days=14)
+
+def make_event(event_id, summary, start=None, ical_uid=None):
+    start = start or NOW
+    return {'id': event_id, 'iCalUID': ical_uid or f'{event_id}@example.com', 'summary': summary, 'status': 'confirmed',
+            'start': {'dateTime': start.isoformat()}, 'end': {'dateTime': (start + timedelta(minutes=30)).isoformat()}}
+
+class FakeCalendar:
+    """events().list for full syncs (timeMin/timeMax) and incremental syncs (syncToken)."""
+
+    def __init__(self, events=()):
+        self.stored = {event['id']: event for event in events}
+        self.changes = [] # Events changed since the last sync token, cancelled ones included
+        self.version = 0
+        self.expired = False
+        self.requests = []
+
+    def change(self, event):
+        self.stored[event['id']] = event
+        self.changes.append(event)
+
+    def cancel(self, event_id):
+        self.change({'id': event_id, 'status': 'cancelled'})
+
+    def _list(self, params):
+        self.requests.append(params)
+        if 'syncToken' in params:
+            if self.expired:
+                raise http_error(410)
+            items = self.changes
+        else:
+            items = [event for event in self.stored.values() if event['status'] != 'cancelled']
+        self.changes = []
+        self.version += 1
+        return {'items': items, 'nextSyncToken': f'token-{self.version}'}
+
+    def events(self):
+        return FakeResource(list=lambda pageToken=None, **params: FakeRequest(lambda: self._list(params)))
+
+def sync(calendar, entry=None):
+    return google_calendar_fetcher._sync_calendar(calendar, 'primary', entry, WINDOW_START, WINDOW_END)
+
+def test_full_sync_stores_events_and_token():
+    calendar = FakeCalendar([make_event('a', 'Standup')])
+    entry = sync(calendar)
+    assert set(entry['events']) == {'a'}
+    assert entry['sync_token'] == 'token-1'
+    assert 'timeMin' in calendar.requests[-1]
+
+def test_incremental_sync_applies_changes():
+    calendar = FakeCalendar([make_event('a', 'Standup'), make_event('b', 'Review')])
+    entry = sync(calendar)
+    calendar.change(make_event('a', 'Standup (moved)', NOW + timedelta(hours=2)))
+    calendar.change(make_event('c', 'Lunch'))
+    calendar.cancel('b')
+    entry = sync(calendar, entry)
+    assert calendar.requests[-1]['syncToken'] == 'token-1'
+    assert sorted(entry['events']) == ['a', 'c']
+    assert entry['events']['a']['summary'] == 'Standup (moved)'
+    assert entry['sync_token'] == 'token-2'
+
+def test_expired_token_falls_back_to_full_sync():
+    calendar = FakeCalendar([make_event('a', 'Standup')])
+    entry = sync(calendar)
+    calendar.expired = True
+    entry = sync(calendar, entry)
+    assert 'timeMin' in calendar.requests[-1]
+    assert set(entry['events']) == {'a'}
+
+def test_used_up_window_triggers_full_sync():
+    calendar = FakeCalendar([make_event('a', 'Standup')])
+    entry = sync(calendar)
+    entry['window_end'] = (WINDOW_START + timedelta(hours=12)).isoformat()
+    sync(calendar, entry)
+    assert 'timeMin' in calendar.requests[-1]
+
+def test_get_calendar_events_syncs_incrementally_and_merges_calendars(monkeypatch, tmp_path):
+    shared = make_event('shared-on-team', 'Planning', NOW, ical_uid='planning@example.com')
+    calendars = {
+        'primary': FakeCalendar([make_event('a', 'Standup', NOW), dict(shared, id='shared-on-primary')]),
+        'team': FakeCalendar([shared]),
+    }
+    services = iter([calendars['primary'], calendars['team']] * 2)
+    monkeypatch.setattr(config, 'TARGET_TIMEZONE', 'UTC')
+    monkeypatch.setattr(config, 'CALENDAR_MAX_WORKERS', 1) # Services are handed out in calendar order
+    monkeypatch.setattr(utils, 'get_google_service', lambda *args: next(services))
+    cache_file = str(tmp_path / 'calendar_cache.json')
+
+    events = google_calendar_fetcher.get_calendar_events(['primary', 'team'], 'token.json', cache_file)
+    assert sorted(event['name'] for event in events) == ['Planning', 'Standup'] # Shared meeting listed once
+    with open(cache_file, encoding='utf-8') as f:
+        assert set(json.load(f)) == {'primary', 'team'}
+
+    calendars['primary'].cancel('a')
+    events = google_calendar_fetcher.get_calendar_events(['primary', 'team'], 'token.json', cache_file)
+    assert [event['name'] for event in events] == ['Planning']
+    assert all('syncToken' in calendar.requests[-1] for calendar in calendars.values())
@@ -0,0 +1,95 @@
+"""Deadline slices and the last-good fallback for sources and the AI summary."""
+import os
+import time
+
+import pytest
+
+import ai_summarizer
+import config
+import deadline
+import email_composer
+import google_calendar_fetcher
+import main
+import section_cache
+
+EVENTS = [{'time': '09:00 AM', 'name': 'Team Sync'}]
+CALENDAR_ERROR = ["Error fetching calendar events."]
+
+@pytest.fixture
+def user(tmp_path):
+    return {'name': 'test', 'token_file': str(tmp_path / 'token.json'), 'calendars': ['primary'], 'cache_dir': str(tmp_path)}
+
+@pytest.fixture
+def cache_file(user):
+    return os.path.join(user['cache_dir'], config.SECTION_CACHE_FILE)
+
+def fetch_calendar(user, stale):
+    return main.fetch_all_sources(user, ('calendar',), stale)['calendar']
+
+def test_stage_slices_are_cumulative():
+    with deadline.budget(100) as budget:
+        assert budget.ends_at('fetch') - budget.start == pytest.approx(40)
+        assert budget.ends_at('summarize') - budget.start == pytest.approx(80)
+        assert budget.ends_at('send') - budget.start == pytest.approx(100)
+        with deadline.stage('fetch'):
+            assert 39 < deadline.remaining() <= 40
+            assert deadline.cap(10) == 10
+    assert deadline.remaining() is None
+
+def test_timeout_raises_once_the_slice_is_used_up():
+    with deadline.budget(0.01), deadline.stage('fetch'):
+        time.sleep(0.02)
+        with pytest.raises(deadline.DeadlineExceeded):
+            deadline.timeout(5)
+
+def test_good_fetch_is_saved(monkeypatch, user, cache_file):
+    monkeypatch.setattr(google_calendar_fetcher, 'get_calendar_events', lambda **kwargs: EVENTS)
+    stale = {}
+    assert fetch_calendar(user, stale) == EVENTS
+    assert stale == {}
+    assert section_cache.last_good(cache_file, 'calendar')[0] == EVENTS
+
+def test_error_placeholder_uses_last_good(monkeypatch, user, cache_file):
+    section_cache.save(cache_file, {'calendar': EVENTS})
+    monkeypatch.setattr(google_calendar_fetcher, 'get_calendar_events', lambda **kwargs: CALENDAR_ERROR)
+    stale = {}
+    assert fetch_calendar(user, stale) == EVENTS
+    assert 'calendar' in stale
+
+def test_fetch_out_of_time_uses_last_good(monkeypatch, user, cache_file):
+    section_cache.save(cache_file, {'calendar': EVENTS})
+    monkeypatch.setattr(google_calendar_fetcher, 'get_calendar_events', lambda **kwargs: time.sleep(1) or [])
+    stale = {}
+    start = time.time()
+    with deadline.budget(0.5), deadline.stage('fetch'): # The fetch slice is 0.2s
+        assert fetch_calendar(user, stale) == EVENTS
+    assert time.time() - start < 0.9
+    assert 'calendar' in stale
+
+def test_without_recent_last_good_the_placeholder_is_kept(monkeypatch, user, cache_file):
+    section_cache.save(cache_file, {'calendar': EVENTS})
+    monkeypatch.setattr(config, 'SECTION_CACHE_MAX_AGE_HOURS', 0)
+    monkeypatch.setattr(google_calendar_fetcher, 'get_calendar_events', lambda **kwargs: CALENDAR_ERROR)
+    stale = {}
+    assert fetch_calendar(user, stale) == CALENDAR_ERROR
+    assert stale == {}
+
+def test_summary_error_uses_last_good_summary(cache_file):
+    assert main.summary_or_last_good(cache_file, "Yesterday's summary") == ("Yesterday's summary", None)
+    summary, stale_at = main.summary_or_last_good(cache_file, "Error generating AI summary: timed out")
+    assert summary == "Yesterday's summary"
+    assert stale_at
+
+def test_partial_summary_is_not_kept(cache_file):
+    partial = f"Half a summary\n\n{config.AI_DEADLINE_MARKER}"
+    assert main.summary_or_last_good(cache_file, partial) == (partial, None)
+    assert section_cache.last_good(cache_file, 'ai') is None
+
+def test_streamed_summary_error_renders_last_good_as_stale(monkeypatch, cache_file):
+    section_cache.save(cache_file, {'ai': "Earlier summary"})
+    monkeypatch.setattr(ai_summarizer, 'get_ai_summary', lambda text, on_delta=None: "Error generating AI summary: boom")
+    stream = ai_summarizer.SummaryStream("emails", fallback=lambda summary: main.summary_or_last_good(cache_file, summary))
+    html = email_composer.compose_email(EVENTS, [], [], stream)
+    assert stream.rendered == "Earlier summary"
+    assert "Earlier summary" in html
+    assert "showing the summary from" in html
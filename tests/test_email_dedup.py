@@ -0,0 +1,45 @@
+"""Thread collapsing and MinHash near-duplicate clustering."""
+import email_dedup
+
+def record(message_id, sender, subject, snippet, thread_id=None):
+    return {'id': message_id, 'thread_id': thread_id or message_id, 'sender': sender, 'subject': subject, 'snippet': snippet}
+
+def test_similarity_estimate_tracks_jaccard():
+    permutations = email_dedup._permutations(256)
+    a = email_dedup.shingles("the quick brown fox jumps over the lazy dog today")
+    b = email_dedup.shingles("the quick brown fox jumps over the lazy cat today")
+    jaccard = len(a & b) / len(a | b)
+    estimate = email_dedup.estimated_similarity(email_dedup.minhash(a, permutations), email_dedup.minhash(b, permutations))
+    assert abs(estimate - jaccard) < 0.15
+
+def test_numbers_are_masked():
+    assert email_dedup.shingles("Build #1841 failed on main") == email_dedup.shingles("Build #1842 failed on main")
+
+def test_threads_collapse_to_newest_message():
+    records = [
+        record('m3', 'Bob', 'Re: Budget', 'Looks good', thread_id='t1'),
+        record('m2', 'Ann', 'Re: Budget', 'Updated numbers', thread_id='t1'),
+        record('m1', 'Bob', 'Budget', 'First draft', thread_id='t1'),
+    ]
+    threads = email_dedup.group_threads(records)
+    assert len(threads) == 1
+    assert threads[0]['id'] == 'm3'
+    assert threads[0]['message_count'] == 3
+    assert threads[0]['senders'] == ['Bob', 'Ann']
+
+def test_notification_storm_is_merged_per_sender():
+    storm = [record(f'ci-{n}', 'CI', f'Build #{1800 + n} failed', f'Pipeline main failed at step test in job {n}') for n in range(5)]
+    other_sender = record('alerts', 'Alerts', 'Build #1900 failed', 'Pipeline main failed at step test in job 9')
+    unrelated = record('lunch', 'CI', 'Team lunch on Friday', 'Pizza at noon in the big room')
+    items, stats = email_dedup.collapse(storm + [other_sender, unrelated])
+    assert [item['id'] for item in items] == ['ci-0', 'alerts', 'lunch']
+    assert items[0]['message_count'] == 5
+    assert items[0]['duplicate_count'] == 4
+    assert stats == {'messages': 7, 'threads': 7, 'items': 3, 'near_duplicates': 4}
+
+def test_different_emails_from_one_sender_stay_separate():
+    items, _ = email_dedup.collapse([
+        record('a', 'Ann', 'Budget review', 'Please look at the Q3 numbers before Friday'),
+        record('b', 'Ann', 'Offsite planning', 'Which venue do you prefer for the team offsite'),
+    ])
+    assert len(items) == 2
@@ -0,0 +1,139 @@
+"""historyId sync of the local Gmail store against an in-memory mailbox."""
+import time
+
+import pytest
+from googleapiclient.errors import HttpError
+
+import config
+import gmail_fetcher
+import gmail_store
+from tests.fakes import FakeRequest, FakeResource, http_error
+
+class FakeBatch:
+    def __init__(self, callback):
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        for request_id, request in self.requests:
+            try:
+                response, exception = request.execute(), None
+            except HttpError as error:
+                response, exception = None, error
+            self.callback(request_id, response, exception)
+
+class FakeGmail:
+    """The users.messages/history/getProfile calls gmail_fetcher makes, served from a dict mailbox.
+
+    Used as service.users().messages().get(...), like a googleapiclient resource.
+    """
+
+    def __init__(self):
+        self.mailbox = {}
+        self.changes = [] # (history id, added message id)
+        self.history_id = 100
+        self.failing = {} # message id -> HTTP status its get answers with
+
+    def add_message(self, message_id):
+        self.history_id += 1
+        self.mailbox[message_id] = {
+            'id': message_id, 'threadId': f't-{message_id}', 'labelIds': ['INBOX'], 'snippet': f'About {message_id}',
+            'internalDate': str(int(time.time() * 1000)),
+            'payload': {'headers': [{'name': 'From', 'value': 'Ann <ann@example.com>'},
+                                    {'name': 'Subject', 'value': f'Subject {message_id}'}]},
+        }
+        self.changes.append((self.history_id, message_id))
+
+    def _get(self, message_id):
+        if message_id in self.failing:
+            raise http_error(self.failing[message_id])
+        return self.mailbox[message_id]
+
+    def _history(self, start_history_id):
+        history = [{'id': str(history_id), 'messagesAdded': [{'message': {'id': message_id, 'threadId': f't-{message_id}'}}]}
+                   for history_id, message_id in self.changes if history_id > int(start_history_id)]
+        return {'history': history, 'historyId': str(self.history_id)}
+
+    def users(self):
+        return self
+
+    def getProfile(self, userId):
+        return FakeRequest(lambda: {'historyId': str(self.history_id), 'emailAddress': 'me@example.com'})
+
+    def messages(self):
+        return FakeResource(
+            get=lambda userId, id, **kwargs: FakeRequest(lambda: self._get(id)),
+            list=lambda userId, **kwargs: FakeRequest(
+                lambda: {'messages': [{'id': m['id'], 'threadId': m['threadId']} for m in self.mailbox.values()]}))
+
+    def history(self):
+        return FakeResource(list=lambda userId, startHistoryId, **kwargs: FakeRequest(lambda: self._history(startHistoryId)))
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(callback)
+
+@pytest.fixture
+def gmail(monkeypatch):
+    monkeypatch.setattr(config, 'GOOGLE_MAX_RETRIES', 0)
+    monkeypatch.setattr(config, 'GMAIL_QUERY', 'in:inbox')
+    return FakeGmail()
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = gmail_store.connect(str(tmp_path / 'gmail_store.sqlite3'))
+    yield conn
+    conn.close()
+
+def stored_ids(conn):
+    return {row['id'] for row in conn.execute("SELECT id FROM messages")}
+
+def test_full_sync_then_incremental_sync(gmail, conn):
+    gmail.add_message('m1')
+    gmail_fetcher.sync_store(gmail, conn)
+    assert stored_ids(conn) == {'m1'}
+    assert gmail_store.get_state(conn, 'history_id') == '101'
+
+    gmail.add_message('m2')
+    gmail_fetcher.sync_store(gmail, conn)
+    assert stored_ids(conn) == {'m1', 'm2'}
+    assert gmail_store.get_state(conn, 'history_id') == '102'
+
+def test_failed_get_is_retried_on_next_sync(gmail, conn):
+    gmail.add_message('m1')
+    gmail_fetcher.sync_store(gmail, conn)
+
+    gmail.add_message('m2')
+    gmail.add_message('m3')
+    gmail.failing['m2'] = 500
+    gmail_fetcher.sync_store(gmail, conn)
+    assert stored_ids(conn) == {'m1', 'm3'}
+    assert gmail_store.get_state(conn, 'history_id') == '103'
+    assert gmail_store.get_retry_ids(conn) == {'m2'}
+
+    # No new history since the checkpoint; m2 must still be picked up
+    del gmail.failing['m2']
+    gmail_fetcher.sync_store(gmail, conn)
+    assert stored_ids(conn) == {'m1', 'm2', 'm3'}
+    assert gmail_store.get_retry_ids(conn) == set()
+
+def test_failed_get_in_full_sync_is_retried(gmail, conn):
+    gmail.add_message('m1')
+    gmail.add_message('m2')
+    gmail.failing['m1'] = 503
+    gmail_fetcher.sync_store(gmail, conn)
+    assert stored_ids(conn) == {'m2'}
+
+    del gmail.failing['m1']
+    gmail_fetcher.sync_store(gmail, conn)
+    assert stored_ids(conn) == {'m1', 'm2'}
+
+def test_deleted_message_is_not_retried(gmail, conn):
+    gmail_fetcher.sync_store(gmail, conn)
+    gmail.add_message('m1')
+    gmail.failing['m1'] = 404 # Deleted between the history entry and the get
+    gmail_fetcher.sync_store(gmail, conn)
+    assert stored_ids(conn) == set()
+    assert gmail_store.get_retry_ids(conn) == set()
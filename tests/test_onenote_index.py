@@ -0,0 +1,71 @@
+"""Notebook mode: tasks from every OneNote export, deduplicated in the cross-file index."""
+import os
+import time
+
+import docx
+import pytest
+
+import config
+import onenote_index
+import onenote_parser
+
+@pytest.fixture
+def notebook(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'ONENOTE_PARSE_WORKERS', 1) # Parse in-process
+    folder = tmp_path / 'exports'
+    folder.mkdir()
+    return folder
+
+@pytest.fixture
+def index_file(tmp_path):
+    return str(tmp_path / 'onenote_tasks.sqlite3')
+
+def write_export(folder, name, lines, age_seconds):
+    path = str(folder / name)
+    document = docx.Document()
+    for line in lines:
+        document.add_paragraph(line)
+    document.save(path)
+    then = time.time() - age_seconds
+    os.utime(path, (then, then))
+    return path
+
+def test_normalized_tasks_share_a_key():
+    assert onenote_index.task_hash("Send  the budget") == onenote_index.task_hash("DONE send the Budget ")
+
+def test_tasks_are_deduplicated_across_exports(notebook, index_file):
+    write_export(notebook, 'monday.docx', ["Send the budget", "Book travel"], age_seconds=200)
+    write_export(notebook, 'tuesday.docx', ["send  the budget", "Call the vendor"], age_seconds=100)
+    tasks = onenote_parser.get_notebook_tasks(str(notebook), index_file)
+    # Listed once, with the text from the newest export that has it
+    assert sorted(tasks) == ["Book travel", "Call the vendor", "send  the budget"]
+
+def test_newest_export_decides_done(notebook, index_file):
+    write_export(notebook, 'monday.docx', ["Send the budget", "Book travel"], age_seconds=200)
+    write_export(notebook, 'tuesday.docx', ["DONE Send the budget"], age_seconds=100)
+    assert onenote_parser.get_notebook_tasks(str(notebook), index_file) == ["Book travel"]
+
+    write_export(notebook, 'wednesday.docx', ["Send the budget"], age_seconds=0) # Reopened
+    assert sorted(onenote_parser.get_notebook_tasks(str(notebook), index_file)) == ["Book travel", "Send the budget"]
+
+def test_only_changed_exports_are_parsed(notebook, index_file, monkeypatch):
+    write_export(notebook, 'monday.docx', ["Send the budget"], age_seconds=200)
+    write_export(notebook, 'tuesday.docx', ["Book travel"], age_seconds=100)
+    onenote_parser.get_notebook_tasks(str(notebook), index_file)
+
+    parsed = []
+    parse = onenote_parser._parse_export_entries
+    monkeypatch.setattr(onenote_parser, '_parse_export_entries', lambda path: parsed.append(path) or parse(path))
+    assert sorted(onenote_parser.get_notebook_tasks(str(notebook), index_file)) == ["Book travel", "Send the budget"]
+    assert parsed == []
+
+    tuesday = write_export(notebook, 'tuesday.docx', ["Book travel", "Call the vendor"], age_seconds=0)
+    assert len(onenote_parser.get_notebook_tasks(str(notebook), index_file)) == 3
+    assert parsed == [tuesday]
+
+def test_deleted_export_drops_its_tasks(notebook, index_file):
+    write_export(notebook, 'monday.docx', ["Send the budget"], age_seconds=200)
+    tuesday = write_export(notebook, 'tuesday.docx', ["Book travel"], age_seconds=100)
+    onenote_parser.get_notebook_tasks(str(notebook), index_file)
+    os.remove(tuesday)
+    assert onenote_parser.get_notebook_tasks(str(notebook), index_file) == ["Send the budget"]
@@ -0,0 +1,101 @@
+"""Durable outbox: claiming, sending, retrying and reclaiming orphaned entries."""
+import os
+import time
+
+import pytest
+
+import config
+import gmail_sender
+import utils
+from tests.fakes import FakeRequest, FakeResource, http_error
+
+class FakeGmail:
+    """users().messages().send(); on_send(body) runs during each send and may raise."""
+
+    def __init__(self):
+        self.sent = []
+        self.on_send = None
+
+    def _send(self, body):
+        if self.on_send:
+            self.on_send(body)
+        self.sent.append(body['raw'])
+        return {'id': f'sent-{len(self.sent)}'}
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return FakeResource(send=lambda userId, body: FakeRequest(lambda: self._send(body)))
+
+@pytest.fixture
+def gmail(monkeypatch):
+    service = FakeGmail()
+    monkeypatch.setattr(config, 'GOOGLE_MAX_RETRIES', 0)
+    monkeypatch.setattr(utils, 'get_google_service', lambda *args: service)
+    return service
+
+@pytest.fixture
+def outbox(tmp_path):
+    return str(tmp_path / 'outbox')
+
+def enqueue(outbox):
+    return gmail_sender.enqueue("Daily Brief", "<p>Hello</p>", "ann@example.com", 'token.json', outbox)
+
+def age(path, seconds):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+def test_flush_sends_and_removes_entries(gmail, outbox):
+    entry_ids = [enqueue(outbox), enqueue(outbox)]
+    assert gmail_sender.list_pending(outbox) == sorted(entry_ids)
+    results = gmail_sender.flush_outbox(outbox_dir=outbox)
+    assert sorted(results['sent']) == sorted(entry_ids)
+    assert len(gmail.sent) == 2
+    assert os.listdir(outbox) == []
+
+def test_transient_failure_stays_pending_until_max_attempts(gmail, outbox, monkeypatch):
+    monkeypatch.setattr(config, 'OUTBOX_MAX_ATTEMPTS', 2)
+    def unavailable(body):
+        raise http_error(503)
+    gmail.on_send = unavailable
+    entry_id = enqueue(outbox)
+    assert gmail_sender.flush_outbox(outbox_dir=outbox)['pending'] == [entry_id]
+    assert gmail_sender.list_pending(outbox) == [entry_id]
+    assert gmail_sender.flush_outbox(outbox_dir=outbox)['failed'] == [entry_id]
+    assert gmail_sender.list_pending(outbox) == []
+    assert os.listdir(os.path.join(outbox, 'failed')) == [entry_id + gmail_sender.PENDING_SUFFIX]
+
+def test_permanent_failure_moves_to_failed(gmail, outbox):
+    def bad_request(body):
+        raise http_error(400)
+    gmail.on_send = bad_request
+    entry_id = enqueue(outbox)
+    assert gmail_sender.flush_outbox(outbox_dir=outbox)['failed'] == [entry_id]
+
+def test_orphaned_inflight_entry_is_reclaimed(gmail, outbox):
+    entry_id = enqueue(outbox)
+    pending_path = os.path.join(outbox, entry_id + gmail_sender.PENDING_SUFFIX)
+    inflight_path = os.path.join(outbox, entry_id + gmail_sender.INFLIGHT_SUFFIX)
+    os.replace(pending_path, inflight_path) # Claimed by a process that then crashed
+    age(inflight_path, config.OUTBOX_INFLIGHT_TIMEOUT_SECONDS + 60)
+    assert gmail_sender.flush_outbox(outbox_dir=outbox)['sent'] == [entry_id]
+
+def test_recent_inflight_entry_is_left_alone(gmail, outbox):
+    entry_id = enqueue(outbox)
+    os.replace(os.path.join(outbox, entry_id + gmail_sender.PENDING_SUFFIX),
+               os.path.join(outbox, entry_id + gmail_sender.INFLIGHT_SUFFIX)) # Another process is sending it
+    assert gmail_sender.flush_outbox(outbox_dir=outbox)['sent'] == []
+    assert gmail.sent == []
+
+def test_old_entry_is_not_reclaimed_while_being_sent(gmail, outbox):
+    entry_id = enqueue(outbox)
+    age(os.path.join(outbox, entry_id + gmail_sender.PENDING_SUFFIX), config.OUTBOX_INFLIGHT_TIMEOUT_SECONDS + 60)
+    def concurrent_flush(body):
+        # Another process flushing mid-send must neither reclaim nor claim the entry
+        gmail_sender._reclaim_stale_inflight(outbox)
+        assert gmail_sender.list_pending(outbox) == []
+        assert gmail_sender._send_entry(entry_id, outbox) == 'claimed'
+    gmail.on_send = concurrent_flush
+    assert gmail_sender.flush_outbox(outbox_dir=outbox)['sent'] == [entry_id]
+    assert len(gmail.sent) == 1
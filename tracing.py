@@ -0,0 +1,234 @@
+import contextlib
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import config
+
+# Counters summed per stage in the stage summary and the Prometheus textfile
+COUNTER_ATTRS = ('count', 'bytes', 'requests', 'retries')
+
+class Span:
+    """One timed stage. Attributes in COUNTER_ATTRS are summed per stage when exported."""
+
+    def __init__(self, name, parent, attrs):
+        self.id = next(_span_ids)
+        self.name = name
+        self.parent_id = parent.id if parent else None
+        self.root_id = parent.root_id if parent else self.id
+        self.thread = threading.current_thread().name
+        self.start = time.time()
+        self.duration = None
+        self.error = None
+        self.attrs = dict(attrs)
+        self._lock = threading.Lock()
+
+    def set(self, key, value):
+        with self._lock:
+            self.attrs[key] = value
+
+    def add(self, key, amount=1):
+        with self._lock:
+            self.attrs[key] = self.attrs.get(key, 0) + amount
+
+    def to_dict(self):
+        return {
+            'id': self.id, 'parent_id': self.parent_id, 'name': self.name, 'thread': self.thread,
+            'start': self.start, 'duration': self.duration, 'error': self.error, 'attrs': self.attrs,
+        }
+
+_span_ids = itertools.count(1)
+_thread_local = threading.local()
+_lock = threading.Lock()
+_traces = OrderedDict() # root span id -> finished spans of that trace
+
+def _stack():
+    stack = getattr(_thread_local, 'stack', None)
+    if stack is None:
+        stack = _thread_local.stack = []
+    return stack
+
+def current_span():
+    """Returns the innermost open span on this thread, or None."""
+    stack = _stack()
+    return stack[-1] if stack else None
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    """Times a stage; nested spans (also across propagate()d threads) belong to the same trace."""
+    if not config.TRACE_ENABLED:
+        yield Span(name, None, attrs) # Detached: attributes can still be set, nothing is recorded
+        return
+    parent = current_span()
+    current = Span(name, parent, attrs)
+    if parent is None:
+        with _lock:
+            _traces[current.root_id] = []
+            while len(_traces) > config.TRACE_MAX_TRACES:
+                _traces.popitem(last=False) # Unexported traces (e.g. module test runs) don't pile up
+    stack = _stack()
+    stack.append(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        stack.pop()
+        current.duration = time.time() - current.start
+        with _lock:
+            spans = _traces.get(current.root_id)
+            if spans is not None: # None if the trace was already exported (e.g. a timed-out fetch finishing late)
+                spans.append(current)
+
+def add(key, amount=1):
+    """Adds to a counter on the current span (no-op outside a span)."""
+    current = current_span()
+    if current is not None:
+        current.add(key, amount)
+
+def propagate(func):
+    """Wraps func so that, when run on another thread, its spans nest under the current span.
+
+    func also runs in a copy of the caller's context variables (e.g. the brief's deadline).
+    """
+    parent = current_span()
+    context = contextvars.copy_context()
+
+    def wrapper(*args, **kwargs):
+        stack = _stack()
+        saved = list(stack)
+        stack[:] = [parent] if parent else []
+        try:
+            # A fresh copy per call: one Context can't be entered by several threads at once
+            return context.copy().run(func, *args, **kwargs)
+        finally:
+            stack[:] = saved
+    return wrapper
+
+def stage_totals(spans):
+    """Aggregates spans by name: {name: {'seconds', 'calls', 'count', 'bytes', 'requests', 'retries'}}."""
+    totals = {}
+    for s in spans:
+        entry = totals.setdefault(s.name, dict({'seconds': 0.0, 'calls': 0}, **{key: 0 for key in COUNTER_ATTRS}))
+        entry['seconds'] += s.duration or 0.0
+        entry['calls'] += 1
+        for key in COUNTER_ATTRS:
+            value = s.attrs.get(key)
+            if isinstance(value, (int, float)):
+                entry[key] += value
+    return totals
+
+def _write_atomic(path, content):
+    import utils # Not at module level: utils imports tracing
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    utils.write_atomic(path, content) # node_exporter's textfile collector must never see a partial file
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_prometheus(root, totals, user):
+    """Renders stage totals in the Prometheus text exposition format."""
+    user_label = _escape_label(user)
+    metrics = [
+        ('daily_brief_stage_seconds', 'Wall time spent in each stage (summed over concurrent spans).', 'seconds'),
+        ('daily_brief_stage_calls', 'Number of spans recorded for each stage.', 'calls'),
+        ('daily_brief_stage_items', 'Items (messages, events, tasks, ...) handled by each stage.', 'count'),
+        ('daily_brief_stage_bytes', 'Payload bytes handled by each stage.', 'bytes'),
+        ('daily_brief_stage_requests', 'API requests issued by each stage.', 'requests'),
+        ('daily_brief_stage_retries', 'Retried API requests in each stage.', 'retries'),
+    ]
+    lines = []
+    for metric, help_text, key in metrics:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} gauge")
+        for stage, entry in sorted(totals.items()):
+            lines.append(f'{metric}{{user="{user_label}",stage="{_escape_label(stage)}"}} {entry[key]}')
+    lines.append("# HELP daily_brief_run_seconds Duration of the last brief run.")
+    lines.append("# TYPE daily_brief_run_seconds gauge")
+    lines.append(f'daily_brief_run_seconds{{user="{user_label}"}} {root.duration or 0.0}')
+    lines.append("# HELP daily_brief_run_success Whether the last brief run finished without an error.")
+    lines.append("# TYPE daily_brief_run_success gauge")
+    lines.append(f'daily_brief_run_success{{user="{user_label}"}} {0 if root.error or root.attrs.get("error") else 1}')
+    lines.append("# HELP daily_brief_last_run_timestamp_seconds Unix time the last brief run finished.")
+    lines.append("# TYPE daily_brief_last_run_timestamp_seconds gauge")
+    lines.append(f'daily_brief_last_run_timestamp_seconds{{user="{user_label}"}} {root.start + (root.duration or 0.0):.3f}')
+    return '\n'.join(lines) + '\n'
+
+def print_stage_summary(totals):
+    print("\n--- Stage Timings ---")
+    for stage, entry in sorted(totals.items(), key=lambda item: -item[1]['seconds']):
+        counters = ', '.join(f"{key}={entry[key]}" for key in COUNTER_ATTRS if entry[key])
+        print(f"  {stage:<16} {entry['seconds']:7.2f}s  calls={entry['calls']}{'  ' + counters if counters else ''}")
+
+def export(root, user, trace_file=None, metrics_file=None):
+    """Writes a finished trace to a JSON trace file and a Prometheus textfile, then drops it from memory.
+
+    trace_file defaults to config.TRACE_FILE; metrics_file to daily_brief_<user>.prom in
+    config.METRICS_TEXTFILE_DIR. Returns the stage totals.
+    """
+    with _lock:
+        spans = _traces.pop(root.root_id, [])
+    if root not in spans:
+        spans.append(root)
+    totals = stage_totals(spans)
+    print_stage_summary(totals)
+
+    trace_file = trace_file or config.TRACE_FILE
+    metrics_file = metrics_file or os.path.join(config.METRICS_TEXTFILE_DIR, f"daily_brief_{user}.prom")
+    try:
+        trace = {'user': user, 'start': root.start, 'duration': root.duration,
+                 'stages': totals, 'spans': [s.to_dict() for s in sorted(spans, key=lambda s: s.start)]}
+        _write_atomic(trace_file, json.dumps(trace, indent=2, default=str))
+        _write_atomic(metrics_file, format_prometheus(root, totals, user))
+        print(f"Trace written to {trace_file}; metrics to {metrics_file}")
+    except OSError as e:
+        print(f"Warning: could not write trace/metrics files: {e}")
+    return totals
+
+@contextlib.contextmanager
+def profiled(label='daily_brief'):
+    """Profiles the enclosed block when the profiler environment variable is set.
+
+    DAILY_BRIEF_PROFILE=cprofile writes <label>.prof (open with pstats or snakeviz);
+    DAILY_BRIEF_PROFILE=pyinstrument writes <label>.html (requires pyinstrument).
+    """
+    mode = (os.getenv(config.PROFILE_ENV_VAR) or '').strip().lower()
+    if mode == 'cprofile':
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(f"{label}.prof")
+            print(f"\ncProfile stats written to {label}.prof. Top functions by cumulative time:")
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(15)
+    elif mode == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("Warning: pyinstrument is not installed (pip install pyinstrument). Running without profiling.")
+            yield
+            return
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(f"{label}.html", 'w', encoding='utf-8') as f:
+                f.write(profiler.output_html())
+            print(f"\npyinstrument report written to {label}.html")
+    else:
+        if mode:
+            print(f"Warning: unknown {config.PROFILE_ENV_VAR} value '{mode}' (use 'cprofile' or 'pyinstrument').")
+        yield
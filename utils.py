@@ -1,17 +1,120 @@
+import functools
+import hashlib
 import os
 import pickle
+import tempfile
+import threading
 from datetime import datetime, time, timedelta, timezone
 
-import pytz # Use pytz for robust timezone handling
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 from dotenv import load_dotenv
+# The Google client libraries are imported inside the functions that use them:
+# they account for a large share of start-up time and partial runs may not need them
 
 import config
+import deadline
+import tracing
 
-def get_google_service(api_name, api_version, scopes, credentials_file, token_file):
-    """Authenticates and builds a Google API service object."""
+# Fetchers run concurrently, so token loading/refreshing must not race on token_file
+_credentials_lock = threading.Lock()
+
+# Process-wide caches: credentials per (token_file, scopes), and service objects per
+# (api, version, scopes, token_file), shared by every thread. httplib2 transports are not
+# thread-safe, so each service sends its requests through a pool of AuthorizedHttp objects,
+# one per request in flight (see _PooledHttp).
+_credentials_cache = {}
+_services = {}
+_services_lock = threading.Lock()
+_refresher_wakeup = threading.Event()
+_refresher_thread = None
+
+class _DiscoveryFileCache:
+    """On-disk discovery document cache used when static discovery documents are unavailable."""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def _path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, url):
+        try:
+            with open(self._path(url), 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def set(self, url, content):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(self._path(url), 'w', encoding='utf-8') as f:
+                f.write(content)
+        except OSError as e:
+            print(f"Warning: could not write discovery cache: {e}")
+
+def _seconds_until_expiry(creds):
+    """Returns seconds until the access token expires (None if it has no expiry)."""
+    if not creds.expiry:
+        return None
+    # google-auth stores expiry as a naive UTC datetime
+    return (creds.expiry - datetime.now(timezone.utc).replace(tzinfo=None)).total_seconds()
+
+def _auth_request():
+    """A google-auth transport whose token refreshes time out (capped by the current deadline)."""
+    from google.auth.transport.requests import Request
+    return functools.partial(Request(), timeout=deadline.timeout(config.GOOGLE_HTTP_TIMEOUT_SECONDS))
+
+def _set_timeout(http, seconds):
+    """Sets the socket timeout of an AuthorizedHttp, including its open keep-alive connections."""
+    if http.timeout == seconds:
+        return
+    http.timeout = seconds
+    for connection in http.connections.values():
+        connection.timeout = seconds
+        if getattr(connection, 'sock', None) is not None:
+            connection.sock.settimeout(seconds)
+
+class _PooledHttp:
+    """Http-like transport that runs each request on an AuthorizedHttp checked out of a pool.
+
+    Any thread can use it; keep-alive connections are reused by whichever request comes next.
+    Each request's socket timeout is capped by the current deadline slice.
+    """
+
+    def __init__(self, creds):
+        self.credentials = creds # Read by googleapiclient (batches) and api_scheduler (quota buckets)
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _checkout(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        import httplib2
+        from google_auth_httplib2 import AuthorizedHttp
+        return AuthorizedHttp(self.credentials, http=httplib2.Http(timeout=config.GOOGLE_HTTP_TIMEOUT_SECONDS))
+
+    def request(self, *args, **kwargs):
+        http = self._checkout()
+        try:
+            _set_timeout(http, deadline.timeout(config.GOOGLE_HTTP_TIMEOUT_SECONDS))
+            return http.request(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._idle.append(http)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for http in idle:
+            http.close()
+
+def _save_credentials(creds, token_file):
+    with open(token_file, 'wb') as token:
+        pickle.dump(creds, token)
+
+def _load_credentials(scopes, credentials_file, token_file):
+    """Loads credentials from token_file, refreshing or re-authenticating when needed."""
+    from google.auth.exceptions import TransportError
     creds = None
     if os.path.exists(token_file):
         with open(token_file, 'rb') as token:
@@ -21,7 +124,9 @@ def get_google_service(api_name, api_version, scopes, credentials_file, token_fi
         if creds and creds.expired and creds.refresh_token:
             print("Refreshing Google API token...")
             try:
-                creds.refresh(Request())
+                creds.refresh(_auth_request())
+            except (deadline.DeadlineExceeded, TransportError):
+                raise # Out of time or unreachable (e.g. a timed-out refresh), not a bad token: keep it
             except Exception as e:
                 print(f"Error refreshing token: {e}. Deleting token and re-authenticating.")
                 # Attempt to remove token file only if it exists
@@ -35,6 +140,7 @@ def get_google_service(api_name, api_version, scopes, credentials_file, token_fi
             print("Google credentials not found or invalid. Starting auth flow...")
             if not os.path.exists(credentials_file):
                 raise FileNotFoundError(f"Credentials file not found: {credentials_file}. Please download it from Google Cloud Console.")
+            from google_auth_oauthlib.flow import InstalledAppFlow
             flow = InstalledAppFlow.from_client_secrets_file(credentials_file, scopes)
             # Specify host='localhost' and port=0 to let the library find an available port
             creds = flow.run_local_server(host='localhost', port=0)
@@ -48,25 +154,111 @@ def get_google_service(api_name, api_version, scopes, credentials_file, token_fi
              print("Could not obtain valid Google credentials.")
              # Avoid building service if creds are None
              raise ConnectionError("Failed to obtain Google credentials.")
+    return creds
+
+def _refresh_expiring_tokens():
+    """Background loop that refreshes cached tokens shortly before they expire."""
+    margin = config.TOKEN_REFRESH_MARGIN_SECONDS
+    while True:
+        with _credentials_lock:
+            cached = list(_credentials_cache.items())
+
+        next_check = 3600
+        for (token_file, _), creds in cached:
+            remaining = _seconds_until_expiry(creds)
+            if remaining is None or not creds.refresh_token:
+                continue
+            if remaining <= margin:
+                # Refresh outside the lock so callers keep using the still-valid token meanwhile
+                try:
+                    creds.refresh(_auth_request())
+                    with _credentials_lock:
+                        _save_credentials(creds, token_file)
+                    print(f"Refreshed Google API token in background ({token_file}).")
+                    remaining = _seconds_until_expiry(creds) or 3600
+                except Exception as e:
+                    print(f"Background token refresh failed for {token_file}: {e}")
+                    remaining = margin + 60 # Retry in a minute
+            next_check = min(next_check, max(remaining - margin, 30))
 
+        _refresher_wakeup.wait(next_check)
+        _refresher_wakeup.clear()
 
+def _ensure_token_refresher():
+    global _refresher_thread
+    if _refresher_thread is None or not _refresher_thread.is_alive():
+        _refresher_thread = threading.Thread(target=_refresh_expiring_tokens, name='token-refresher', daemon=True)
+        _refresher_thread.start()
+    _refresher_wakeup.set()
+
+def _get_credentials(scopes, credentials_file, token_file):
+    """Returns cached credentials for token_file, loading them on first use."""
+    key = (token_file, tuple(scopes))
+    with _credentials_lock:
+        creds = _credentials_cache.get(key)
+        if creds is not None and creds.valid:
+            return creds
+        # First use, or the background refresher fell behind: load/refresh on the critical path
+        creds = _load_credentials(scopes, credentials_file, token_file)
+        _credentials_cache[key] = creds
+    _ensure_token_refresher()
+    return creds
+
+def _build_service(api_name, api_version, creds):
+    """Builds a service on a transport pool, using static or cached discovery documents."""
+    from googleapiclient.discovery import build
+    authorized_http = _PooledHttp(creds)
+    api_endpoint = os.getenv(config.GOOGLE_API_ENDPOINT_ENV_VAR)
+    client_options = {'api_endpoint': api_endpoint} if api_endpoint else None
     try:
-        service = build(api_name, api_version, credentials=creds)
-        print(f"Successfully connected to Google {api_name.capitalize()} API.")
-        return service
+        # Discovery documents bundled with google-api-python-client (no network fetch)
+        return build(api_name, api_version, http=authorized_http, static_discovery=True, client_options=client_options)
     except Exception as e:
-        print(f"Error building Google {api_name.capitalize()} service: {e}")
-        # Attempt to delete potentially corrupted token file
-        if os.path.exists(token_file):
-            try:
-                os.remove(token_file)
-                print(f"Removed potentially corrupted token file: {token_file}")
-            except OSError as ose:
-                print(f"Error removing token file {token_file}: {ose}")
-        raise
+        print(f"Static discovery unavailable for {api_name} {api_version} ({e}). Using cached discovery document.")
+        return build(api_name, api_version, http=authorized_http, static_discovery=False,
+                     cache=_DiscoveryFileCache(config.DISCOVERY_CACHE_DIR), client_options=client_options)
+
+def get_google_service(api_name, api_version, scopes, credentials_file, token_file):
+    """Returns an authenticated Google API service object, reusing cached clients where possible.
+
+    Services are shared by every thread of the process (requests go through a transport pool).
+    """
+    with tracing.span('auth', api=api_name) as span:
+        creds = _get_credentials(scopes, credentials_file, token_file)
+        key = (api_name, api_version, tuple(scopes), token_file)
+        try:
+            with _services_lock:
+                cached = _services.get(key)
+                if cached is not None and cached[0] is creds:
+                    span.set('cached', True)
+                    return cached[1]
+                service = _build_service(api_name, api_version, creds)
+                _services[key] = (creds, service)
+            print(f"Successfully connected to Google {api_name.capitalize()} API.")
+            return service
+        except Exception as e:
+            print(f"Error building Google {api_name.capitalize()} service: {e}")
+            with _credentials_lock:
+                _credentials_cache.pop((token_file, tuple(scopes)), None)
+            # Attempt to delete potentially corrupted token file
+            if os.path.exists(token_file):
+                try:
+                    os.remove(token_file)
+                    print(f"Removed potentially corrupted token file: {token_file}")
+                except OSError as ose:
+                    print(f"Error removing token file {token_file}: {ose}")
+            raise
+
+def clear_google_service_cache():
+    """Drops all cached credentials and service objects (e.g. after token files change)."""
+    with _credentials_lock:
+        _credentials_cache.clear()
+    with _services_lock:
+        _services.clear()
 
 def get_localized_time_range(target_tz_name):
     """Returns the start and end of today in the target timezone (ISO format)."""
+    import pytz # Use pytz for robust timezone handling
     try:
         target_tz = pytz.timezone(target_tz_name)
     except pytz.UnknownTimeZoneError:
@@ -85,4 +277,24 @@ def get_localized_time_range(target_tz_name):
 
 def get_yesterday_date():
     """Returns the date for yesterday."""
-    return datetime.now().date() - timedelta(days=1) 
\ No newline at end of file
+    return datetime.now().date() - timedelta(days=1) 
+
+def write_atomic(path, content, fsync=False):
+    """Replaces path with content (text) through a unique temp file in the same directory.
+
+    Readers never see a partial file, and concurrent writers (team runs, the daemon) never
+    share a temp file. With fsync, the data is on disk before the rename. Raises OSError,
+    leaving path as it was.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(content)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
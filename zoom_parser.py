@@ -0,0 +1,182 @@
+import os
+import re
+import json
+import time
+from dotenv import load_dotenv
+
+import config
+import tracing
+import utils
+
+RECAP_EXTENSIONS = ('.html', '.htm', '.txt')
+WHITESPACE_PATTERN = re.compile(r'[ \t\r\f\v]+')
+
+def _section_ids():
+    """Element ids of the recap sections to extract, in the order they are reported."""
+    return {config.ZOOM_RECAP_ID: 'Quick recap', config.ZOOM_NEXT_STEPS_ID: 'Next steps', config.ZOOM_SUMMARY_ID: 'Summary'}
+
+def _clean_text(text):
+    lines = (WHITESPACE_PATTERN.sub(' ', line).strip() for line in text.splitlines())
+    return '\n'.join(line for line in lines if line)
+
+def _block_text(elem):
+    """Text of an element, one line per block-level child (list items, paragraphs)."""
+    parts = []
+    for node in elem.iter():
+        if node.tag in ('li', 'p', 'br', 'div', 'h1', 'h2', 'h3', 'h4', 'tr'):
+            parts.append('\n')
+        if node is not elem and node.tag == 'li':
+            parts.append('- ')
+        if node.text:
+            parts.append(node.text)
+        if node is not elem and node.tail:
+            parts.append(node.tail)
+    return _clean_text(''.join(parts))
+
+def _parse_html_recap(file_path):
+    """Stream-parses a Zoom recap page, keeping only the title and the configured sections.
+
+    Elements outside the wanted sections are cleared as soon as they end, so large pages
+    never build a full tree.
+    """
+    from lxml import etree # Imported when a recap actually needs parsing
+    wanted = _section_ids()
+    title = None
+    sections = {}
+    inside = 0 # Depth of wanted sections currently open
+    for event, elem in etree.iterparse(file_path, events=('start', 'end'), html=True, recover=True, encoding='utf-8'):
+        if not isinstance(elem.tag, str):
+            continue # Comments and processing instructions
+        if event == 'start':
+            if elem.get('id') in wanted:
+                inside += 1
+            continue
+        if elem.get('id') in wanted:
+            inside -= 1
+            sections[wanted[elem.get('id')]] = _block_text(elem)
+        elif title is None and elem.tag in ('title', 'h1'):
+            title = _clean_text(''.join(elem.itertext()))
+        if not inside:
+            elem.clear(keep_tail=True)
+    return title, sections
+
+def _parse_text_recap(file_path):
+    """Parses a plain-text recap; lines naming a section ("Quick recap", "Next steps:") start it."""
+    headings = {name.lower(): name for name in _section_ids().values()}
+    title = None
+    sections = {}
+    current = None
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            stripped = line.strip()
+            heading = headings.get(stripped.rstrip(':').lower())
+            if heading:
+                current = heading
+                sections.setdefault(current, [])
+            elif current:
+                sections[current].append(stripped)
+            elif stripped and title is None:
+                title = stripped
+    return title, {name: _clean_text('\n'.join(lines)) for name, lines in sections.items()}
+
+def parse_recap_file(file_path):
+    """Returns {'title', 'sections'} for one recap file (sections keyed by display name)."""
+    if file_path.lower().endswith('.txt'):
+        title, sections = _parse_text_recap(file_path)
+    else:
+        title, sections = _parse_html_recap(file_path)
+    title = title or os.path.splitext(os.path.basename(file_path))[0]
+    return {'title': title, 'sections': {name: text for name, text in sections.items() if text}}
+
+def _load_index(index_file):
+    try:
+        with open(index_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_index(index, index_file):
+    try:
+        utils.write_atomic(index_file, json.dumps(index))
+    except OSError as e:
+        print(f"Warning: could not save Zoom recap index: {e}")
+
+def _recent_recap_files(folder_path, since):
+    """(path, stat) for recap files modified after `since`, from a single scandir pass.
+
+    Files that vanish or can't be read mid-scan (e.g. while Zoom is writing them) are skipped.
+    """
+    recent = []
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            if not entry.name.lower().endswith(RECAP_EXTENSIONS):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                entry_stat = entry.stat()
+            except OSError:
+                continue
+            if entry_stat.st_mtime >= since:
+                recent.append((entry.path, entry_stat))
+    return sorted(recent, key=lambda item: item[1].st_mtime)
+
+def get_zoom_recaps(summary_folder=None, index_file=None):
+    """Returns recaps of meetings whose recap files changed within ZOOM_LOOKBACK_HOURS, oldest first.
+
+    Each recap is {'title', 'time', 'sections'}. Parsed files are indexed on disk (index_file,
+    default config.ZOOM_INDEX_FILE) by (path, size, mtime), so only new or changed recaps are parsed.
+    """
+    index_file = index_file or config.ZOOM_INDEX_FILE
+    print("\n--- Parsing Zoom Recaps ---")
+    if not summary_folder:
+        load_dotenv()
+        summary_folder = os.getenv(config.ZOOM_SUMMARY_FOLDER_ENV_VAR)
+
+    if not summary_folder:
+        print(f"Error: Environment variable {config.ZOOM_SUMMARY_FOLDER_ENV_VAR} not set in .env file.")
+        return ["Error: Zoom summary folder path not configured."]
+    if not os.path.isdir(summary_folder):
+        print(f"Error: Zoom summary folder not found: {summary_folder}")
+        return ["Error: Zoom summary folder not found."]
+
+    index = _load_index(index_file)
+    recaps = []
+    parsed = 0
+    with tracing.span('zoom.parse') as span:
+        for file_path, file_stat in _recent_recap_files(summary_folder, time.time() - config.ZOOM_LOOKBACK_HOURS * 3600):
+            key = os.path.abspath(file_path)
+            entry = index.get(key)
+            if not entry or entry['size'] != file_stat.st_size or entry['mtime_ns'] != file_stat.st_mtime_ns:
+                try:
+                    recap = parse_recap_file(file_path)
+                except Exception as e:
+                    print(f"Error parsing Zoom recap {file_path}: {e}")
+                    continue
+                entry = index[key] = {'size': file_stat.st_size, 'mtime_ns': file_stat.st_mtime_ns, **recap}
+                parsed += 1
+                span.add('bytes', file_stat.st_size)
+            if entry['sections']:
+                recaps.append({'title': entry['title'], 'time': time.strftime('%a %I:%M %p', time.localtime(file_stat.st_mtime)),
+                               'sections': entry['sections']})
+        span.set('count', parsed)
+
+    # Forget files that were deleted or have aged out of any lookback window
+    cutoff_ns = (time.time() - config.ZOOM_INDEX_RETENTION_DAYS * 86400) * 1e9
+    index = {key: entry for key, entry in index.items() if entry['mtime_ns'] >= cutoff_ns and os.path.exists(key)}
+    _save_index(index, index_file)
+    print(f"Found {len(recaps)} Zoom recaps ({parsed} newly parsed).")
+    return recaps
+
+def format_recap(recap):
+    """Formats one recap as a single prompt block (no blank lines, so it stays one summarizer item)."""
+    lines = [f"Meeting: {recap['title']} ({recap['time']})"]
+    for name, text in recap['sections'].items():
+        lines.append(f"{name}:")
+        lines.extend(text.splitlines())
+    return '\n'.join(lines)
+
+if __name__ == '__main__':
+    # For local testing
+    for recap in get_zoom_recaps():
+        print(recap if isinstance(recap, str) else format_recap(recap))